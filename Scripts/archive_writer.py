@@ -0,0 +1,435 @@
+import os
+import io
+import gzip
+import json
+import lzma
+import stat
+import time
+import zlib
+import logging
+import tarfile
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+EXTENSIONS = {"gzip": ".tar.gz", "lzma": ".tar.xz", "zstd": ".tar.zst", "none": ".tar"}
+
+
+def get_codec(codec):
+    """
+    Returns the codec to use, zstd falls back to gzip if 'zstandard' isn't installed.
+
+    Args:
+        codec (str): 'gzip', 'lzma', 'zstd' or 'none'.
+
+    Returns:
+        str: The available codec.
+    """
+    if codec not in EXTENSIONS:
+        raise ValueError(f"Unknown compression '{codec}'.")
+    if codec == "zstd" and zstandard is None:
+        logging.getLogger(__name__).warning("zstd compression needs the 'zstandard' package, using gzip.")
+        return "gzip"
+    return codec
+
+
+def _compress(codec, level, data):
+    """Compresses one chunk into an independent gzip member / xz stream / zstd frame (runs in the process pool)."""
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=6 if level is None else level, mtime=0)
+    if codec == "lzma":
+        return lzma.compress(data, format=lzma.FORMAT_XZ, preset=6 if level is None else level)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+    return data
+
+
+def _decompress(codec, data):
+    """Decompresses one chunk written by `_compress`."""
+    if codec == "gzip":
+        return zlib.decompressobj(wbits=31).decompress(data)
+    if codec == "lzma":
+        return lzma.decompress(data, format=lzma.FORMAT_XZ)
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+class ArchiveStopped(Exception):
+    """Raised inside the ArchiveWriter when the backup is stopped."""
+
+
+class ArchiveWriter:
+    """
+    Streams backup sources into a single tar archive (one per snapshot, e.g. 'backup_2025-01-31.tar.gz').
+    For slow or network destinations, where mirroring small files one by one is dominated by metadata round trips.
+
+    The tar stream is cut into chunks which are compressed independently on a process pool and written in order
+    in large blocks. The concatenated chunks are a valid .tar.gz/.tar.xz/.tar.zst (readable with `tar`), and with the
+    index of the chunk and member offsets ('<archive>.index.json') single members can be restored without
+    decompressing the whole archive (see `restore`).
+    """
+    CHUNK_SIZE = 16 * 1024 * 1024
+    WRITE_BUFFER = 8 * 1024 * 1024
+    INDEX_SUFFIX = ".index.json"
+
+    def __init__(self, archive_path, codec="gzip", level=None, workers=None, stop_callback=None, progress_callback=None):
+        """
+        Initializes the ArchiveWriter.
+
+        Args:
+            archive_path (str): Path of the archive to create (replaced when finished).
+            codec (str): 'gzip', 'lzma', 'zstd' or 'none'.
+            level (int, optional): Compression level, codec default if None.
+            workers (int, optional): Number of compressing processes. Defaults to the number of CPUs.
+            stop_callback (callable, optional): Returns True if the backup should stop.
+            progress_callback (callable, optional): Called with progress events (dict with 'percent', 'bytes',
+                'total_bytes', 'files', 'file').
+        """
+        self.logger = logging.getLogger(__name__)
+        self.archive_path = str(archive_path)
+        self.codec = get_codec(codec)
+        self.level = level
+        self.workers = workers or os.cpu_count() or 1
+        self.stop_callback = stop_callback or (lambda: False)
+        self.progress_callback = progress_callback
+        self.stats = {"bytes": 0, "files": 0, "compressed": 0, "failed": 0, "seconds": 0.0}
+
+    def write(self, sources, total_bytes=0, filters=None):
+        """
+        Writes all sources into the archive, each under its base name.
+
+        Args:
+            sources (list[str]): Source paths (directories or files).
+            total_bytes (int): Size of all sources for the progress (from the scanner).
+            filters (dict, optional): Include/exclude rules per source (PathFilter or None), excluded entries aren't archived.
+
+        Returns:
+            int: 0 on success, 20 if stopped, 23 if some files couldn't be read.
+        """
+        start = time.monotonic()
+        partial = self.archive_path + ".partial"
+        self.total_bytes = total_bytes
+        self.last_event = 0.0
+        self.members = {}
+        stream = _ChunkStream(partial, self.codec, self.level, self.workers, self.CHUNK_SIZE, self.WRITE_BUFFER)
+        try:
+            with tarfile.open(fileobj=stream, mode="w", format=tarfile.PAX_FORMAT) as tar:
+                for src in sources:
+                    self._add_source(tar, os.path.normpath(src), (filters or {}).get(src))
+            stream.close()
+        except ArchiveStopped:
+            stream.abort()
+            self.logger.info(f"Archiving to '{self.archive_path}' stopped.")
+            return 20
+        except Exception:
+            stream.abort()
+            raise
+        os.replace(partial, self.archive_path)
+        self._write_index(stream.chunks)
+        self.total_bytes = self.stats["bytes"]
+        self._report(None, force=True)
+        self.stats["compressed"] = stream.compressed
+        self.stats["seconds"] = time.monotonic() - start
+        self.logger.info(f"Archived {self.stats['files']} files ({self.stats['bytes'] / (1024 * 1024):.1f} MB, "
+                         f"{self.stats['compressed'] / (1024 * 1024):.1f} MB {self.codec}) in {self.stats['seconds']:.1f}s "
+                         f"({self.stats['bytes'] / (1024 * 1024) / max(self.stats['seconds'], 1e-6):.1f} MB/s).")
+        return 23 if self.stats["failed"] else 0
+
+    def _add_source(self, tar, src, filters=None):
+        """Adds a source tree (or file) to the tar, directories before their content, without the excluded entries."""
+        base = os.path.basename(src)
+        stack = [(src, base)]
+        while stack:
+            path, name = stack.pop()
+            if self.stop_callback():
+                raise ArchiveStopped()
+            try:
+                info = tar.gettarinfo(path, arcname=name)
+            except OSError as e:
+                self.logger.warning(f"Skipped '{path}' ({e})")
+                self.stats["failed"] += 1
+                continue
+            if info.isdir():
+                tar.addfile(info)
+                self.members[name] = {"type": "dir", "mode": info.mode, "mtime": info.mtime}
+                try:
+                    with os.scandir(path) as entries:
+                        children = sorted((entry.path, f"{name}/{entry.name}") for entry in entries
+                                          if not filters or not filters.is_excluded(f"{name}/{entry.name}"[len(base) + 1:],
+                                                                                    entry.is_dir(follow_symlinks=False)))
+                except OSError as e:
+                    self.logger.warning(f"Skipped content of '{path}' ({e})")
+                    self.stats["failed"] += 1
+                    continue
+                stack.extend(reversed(children))
+            elif info.issym():
+                tar.addfile(info)
+                self.members[name] = {"type": "symlink", "link": info.linkname, "mtime": info.mtime}
+            elif info.islnk():
+                # second name of a hard-linked file, tarfile stores only a reference to the first one
+                tar.addfile(info)
+                self.members[name] = {"type": "hardlink", "link": info.linkname}
+            elif info.isfile():
+                self._add_file(tar, path, name, info)
+            # sockets, fifos and devices are skipped like in the other backends
+
+    def _add_file(self, tar, path, name, info):
+        """
+        Adds a regular file, opened before its header is written so unreadable files don't break the stream.
+        A file that shrinks or fails while it is read is padded with zeros to the size in its header and counted as failed.
+        """
+        try:
+            f = open(path, "rb")
+        except OSError as e:
+            self.logger.warning(f"Skipped '{path}' ({e})")
+            self.stats["failed"] += 1
+            return
+        with f:
+            reader = _PaddedReader(f, info.size)
+            header = tar.offset
+            tar.addfile(info, reader)
+        data_offset = header + len(info.tobuf(tar.format, tar.encoding, tar.errors))
+        self.members[name] = {"type": "file", "offset": data_offset, "size": info.size, "mode": info.mode, "mtime": info.mtime}
+        if reader.error:
+            self.logger.warning(f"'{path}' changed during the backup, its archived copy is incomplete ({reader.error})")
+            self.stats["failed"] += 1
+        else:
+            self.stats["files"] += 1
+        self.stats["bytes"] += info.size
+        self._report(name)
+
+    def _report(self, name, force=False):
+        """Calls the progress callback (at most every 0.2s)."""
+        now = time.monotonic()
+        if not self.progress_callback or (now - self.last_event < 0.2 and not force):
+            return
+        self.last_event = now
+        total = self.total_bytes
+        self.progress_callback({
+            "percent": min(100, 100 * self.stats["bytes"] / total) if total else 0,
+            "bytes": self.stats["bytes"],
+            "total_bytes": total,
+            "files": self.stats["files"],
+            "file": name,
+        })
+
+    def _write_index(self, chunks):
+        """Writes the chunk and member offsets next to the archive."""
+        index = {"codec": self.codec, "chunks": chunks, "members": self.members}
+        tmp_path = self.archive_path + self.INDEX_SUFFIX + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.archive_path + self.INDEX_SUFFIX)
+
+
+class _PaddedReader:
+    """
+    File object for `tarfile.addfile`: reads at most `size` bytes and pads with zeros if the file ends early
+    or a read fails (the header with the size is already written, so the data must match it).
+    """
+
+    def __init__(self, f, size):
+        self.f = f
+        self.remaining = size
+        self.error = None # reason why the data was padded
+
+    def read(self, size=-1):
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = b""
+        if not self.error:
+            try:
+                data = self.f.read(size)
+            except OSError as e:
+                self.error = str(e)
+                data = b""
+            if len(data) < size and not self.error:
+                self.error = f"{self.remaining - len(data)} bytes missing"
+        data += bytes(size - len(data))
+        self.remaining -= size
+        return data
+
+
+class _ChunkStream(io.RawIOBase):
+    """
+    File object for tarfile: collects the tar stream into chunks, compresses them on a process pool and
+    writes the results in order. Keeps the offsets of every chunk ([raw offset, compressed offset, compressed length]).
+    """
+
+    def __init__(self, path, codec, level, workers, chunk_size, write_buffer):
+        self.codec = codec
+        self.level = level
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.raw_offset = 0
+        self.compressed = 0
+        self.chunks = []
+        self.pending = deque()
+        self.max_pending = workers * 2
+        self.pool = ProcessPoolExecutor(max_workers=workers) if codec != "none" else None
+        self.out = open(path, "wb", buffering=write_buffer)
+        self.path = path
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.raw_offset + len(self.buffer)
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.chunk_size:
+            self._submit(bytes(self.buffer[:self.chunk_size]))
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def _submit(self, data):
+        """Hands a chunk to the pool, writes finished chunks if too many are pending."""
+        if self.pool:
+            self.pending.append((self.raw_offset, self.pool.submit(_compress, self.codec, self.level, data)))
+        else:
+            self._write_chunk(self.raw_offset, data)
+        self.raw_offset += len(data)
+        while len(self.pending) > self.max_pending:
+            self._write_next()
+
+    def _write_next(self):
+        raw_offset, future = self.pending.popleft()
+        self._write_chunk(raw_offset, future.result())
+
+    def _write_chunk(self, raw_offset, data):
+        self.chunks.append([raw_offset, self.compressed, len(data)])
+        self.out.write(data)
+        self.compressed += len(data)
+
+    def close(self):
+        """Compresses the rest and closes the file (tarfile doesn't close a passed file object)."""
+        if self.out.closed:
+            return
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+            self.buffer.clear()
+        while self.pending:
+            self._write_next()
+        if self.pool:
+            self.pool.shutdown()
+        self.out.close()
+        super().close()
+
+    def abort(self):
+        """Drops the pending chunks and deletes the partial archive."""
+        for _, future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        if self.pool:
+            self.pool.shutdown(cancel_futures=True)
+        self.out.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def list_members(archive_path):
+    """
+    Returns the members of an archive from its index.
+
+    Args:
+        archive_path (str): Path of the archive.
+
+    Returns:
+        dict: Member name as key and its details (type, offset, size, mode, mtime) as value.
+    """
+    with open(str(archive_path) + ArchiveWriter.INDEX_SUFFIX) as f:
+        return json.load(f)["members"]
+
+
+def restore(archive_path, member, target_dir):
+    """
+    Restores a member (a file, or a directory with its content) of an archive, only the chunks containing it
+    are read and decompressed.
+
+    Args:
+        archive_path (str): Path of the archive.
+        member (str): Member name, e.g. 'Documents/taxes/2024.pdf' (the first part is the base name of the source).
+        target_dir (str): Directory the member is restored into (with its path).
+
+    Returns:
+        int: Number of restored members.
+    """
+    with open(str(archive_path) + ArchiveWriter.INDEX_SUFFIX) as f:
+        index = json.load(f)
+    codec, chunks, members = index["codec"], index["chunks"], index["members"]
+    member = member.strip("/")
+    names = sorted(name for name in members if name == member or name.startswith(member + "/"))
+    if not names:
+        raise KeyError(f"'{member}' isn't in '{archive_path}'.")
+    cache = {}
+    restored = 0
+    with open(archive_path, "rb") as archive:
+        def read(offset, size):
+            """Yields the raw tar bytes [offset, offset + size) chunk by chunk."""
+            num = max(0, _find_chunk(chunks, offset))
+            while size > 0:
+                raw_offset, comp_offset, comp_len = chunks[num]
+                if num not in cache:
+                    archive.seek(comp_offset)
+                    cache.clear() # only the last chunk is kept, members are stored in order
+                    cache[num] = _decompress(codec, archive.read(comp_len))
+                data = cache[num][offset - raw_offset:offset - raw_offset + size]
+                yield data
+                offset += len(data)
+                size -= len(data)
+                num += 1
+
+        for name in names:
+            details = members[name]
+            if details["type"] == "hardlink":
+                details = members[details["link"]]
+            target = os.path.join(target_dir, *name.split("/"))
+            if details["type"] == "dir":
+                os.makedirs(target, exist_ok=True)
+            elif details["type"] == "symlink":
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if os.path.lexists(target):
+                    os.remove(target)
+                os.symlink(details["link"], target)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, "wb") as out:
+                    for data in read(details["offset"], details["size"]):
+                        out.write(data)
+                os.chmod(target, stat.S_IMODE(details["mode"]))
+                os.utime(target, (details["mtime"], details["mtime"]))
+            restored += 1
+    return restored
+
+
+def _find_chunk(chunks, offset):
+    """Returns the number of the chunk containing a raw offset (binary search)."""
+    low, high = 0, len(chunks) - 1
+    while low < high:
+        mid = (low + high + 1) // 2
+        if chunks[mid][0] <= offset:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lists or restores members of a backup archive.")
+    parser.add_argument("archive", help="Path of the archive (e.g. backup_2025-01-31.tar.gz).")
+    parser.add_argument("member", nargs="?", help="Member to restore, lists the members if omitted.")
+    parser.add_argument("--to", default=".", help="Directory to restore into.")
+    args = parser.parse_args()
+
+    if args.member is None:
+        for name, details in sorted(list_members(args.archive).items()):
+            print(f"{details['type']:<8} {details.get('size', ''):>12} {name}")
+    else:
+        print(f"Restored {restore(args.archive, args.member, args.to)} members to '{args.to}'.")
@@ -0,0 +1,286 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+from file_handler import FileHandler
+from tools import get_copyHandler
+
+
+class TreeGenerator:
+    """
+    Generates reproducible synthetic source trees for the benchmarks.
+    The layouts are scaled with `scale`, the file contents come from a seeded random generator.
+    """
+    LAYOUTS = {
+        # name: (number of files, file size in bytes, files per directory, nesting depth)
+        "tiny_files": (20000, 1024, 200, 2),
+        "huge_files": (4, 256 * 1024 * 1024, 4, 1),
+        "deep_nesting": (5000, 4096, 5, 50),
+    }
+
+    def __init__(self, base_dir, scale=1.0, seed=42):
+        """
+        Initializes the TreeGenerator.
+
+        Args:
+            base_dir (str): Directory the trees are created in.
+            scale (float): Factor for the number of files (and the size of the huge files).
+            seed (int): Seed of the random contents.
+        """
+        self.base_dir = base_dir
+        self.scale = scale
+        self.rng = random.Random(seed)
+        self.block = self.rng.randbytes(1024 * 1024)
+
+    def generate(self, name):
+        """
+        Creates one tree ('tiny_files', 'huge_files', 'deep_nesting' or 'mixed').
+
+        Args:
+            name (str): Name of the layout.
+
+        Returns:
+            str: Path to the root of the tree.
+        """
+        root = os.path.join(self.base_dir, name)
+        if name == "mixed":
+            for layout in self.LAYOUTS:
+                self._fill(os.path.join(root, layout), *self._scaled(layout, 0.25))
+        else:
+            self._fill(root, *self._scaled(name, 1.0))
+        return root
+
+    def _scaled(self, layout, share):
+        """Returns the layout parameters scaled by `scale` and `share`."""
+        files, size, per_dir, depth = self.LAYOUTS[layout]
+        files = max(1, int(files * self.scale * share))
+        if layout == "huge_files":
+            files = max(1, int(self.LAYOUTS[layout][0] * share))
+            size = max(1024 * 1024, int(size * self.scale))
+        return files, size, per_dir, depth
+
+    def _fill(self, root, files, size, per_dir, depth):
+        """Writes `files` files of `size` bytes into a tree with `per_dir` files per directory nested `depth` levels deep."""
+        for num in range(files):
+            dir_num = num // per_dir
+            parts = [f"d{(dir_num + level) % 10}" for level in range(depth - 1)] + [f"dir{dir_num}"]
+            directory = os.path.join(root, *parts)
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f"file{num}.bin"), "wb") as f:
+                remaining = size
+                offset = self.rng.randrange(len(self.block))
+                while remaining > 0:
+                    chunk = self.block[offset:offset + remaining]
+                    f.write(chunk)
+                    remaining -= len(chunk)
+                    offset = 0
+
+
+class Benchmark:
+    """
+    Times the stages of the backup pipeline on synthetic trees:
+    size calculation, file counting, copying (first run and unchanged rerun, per backend),
+    the search for old backups and the deletion of a backup.
+    """
+
+    def __init__(self, work_dir, backends, repeat=3):
+        """
+        Initializes the Benchmark.
+
+        Args:
+            work_dir (str): Temporary directory for the trees, destinations and indexes.
+            backends (list[str]): Copy backends to compare ('shell', 'native').
+            repeat (int): Number of runs per measurement (the median is reported).
+        """
+        self.work_dir = work_dir
+        self.backends = backends
+        self.repeat = repeat
+        self.os_type = "windows" if os.name == "nt" else "linux"
+        self.results = []
+
+    def _filehandler(self, name):
+        """Returns a FileHandler with its own index and destination inside the work directory."""
+        fh = FileHandler("benchmark", self.work_dir)
+        fh.logger = logging.getLogger("file_handler")
+        fh.index_path = os.path.join(self.work_dir, f"index_{name}.sqlite")
+        fh.destPath = os.path.join(self.work_dir, "dest")
+        fh.userDict = {}
+        return fh
+
+    def _record(self, tree, stage, backend, times, files=0, bytes=0):
+        """Stores the median of the measured times and the resulting throughput."""
+        seconds = statistics.median(times)
+        result = {
+            "tree": tree,
+            "stage": stage,
+            "backend": backend,
+            "seconds": round(seconds, 6),
+            "runs": len(times),
+            "files": files,
+            "bytes": bytes,
+            "files_per_s": round(files / seconds, 1) if seconds else None,
+            "mb_per_s": round(bytes / (1024 * 1024) / seconds, 2) if seconds else None,
+        }
+        self.results.append(result)
+        print(f"{tree:>14} {stage:<22} {backend or '-':<7} {seconds:9.3f}s  "
+              f"{result['files_per_s'] or 0:>12} files/s  {result['mb_per_s'] or 0:>9} MB/s")
+        return result
+
+    def _time(self, func, setup=None):
+        """Runs `func` `repeat` times (calling `setup` before each run) and returns the times."""
+        times = []
+        for _ in range(self.repeat):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        return times
+
+    def run_tree(self, tree, src):
+        """
+        Benchmarks all stages on one tree.
+
+        Args:
+            tree (str): Name of the tree.
+            src (str): Path to the tree.
+        """
+        def drop_index():
+            for suffix in ("", "-wal", "-shm"):
+                path = os.path.join(self.work_dir, f"index_{tree}.sqlite{suffix}")
+                if os.path.exists(path):
+                    os.remove(path)
+
+        # size calculation (GUI start): without index, with index of an earlier session
+        times = self._time(lambda: self._filehandler(tree).get_size(src), setup=drop_index)
+        scan = self._filehandler(tree).get_scanner().scan(src)
+        files, size = scan.total_files, scan.total_bytes
+        self._record(tree, "get_size_cold", None, times, files, size)
+        times = self._time(lambda: self._filehandler(tree).get_size(src))
+        self._record(tree, "get_size_indexed", None, times, files, size)
+        # file counting of the executor
+        times = self._time(lambda: self._filehandler(tree).get_fileCounts([src]))
+        self._record(tree, "count_files", None, times, files, size)
+
+        for backend in self.backends:
+            try:
+                handler = get_copyHandler(self.os_type, backend)
+            except Exception as e:
+                print(f"Backend '{backend}' not available ({e}), skipped.")
+                continue
+            dest = os.path.join(self.work_dir, "dest", "benchmark", f"backup_{tree}_{backend}")
+            if shutil.which("rsync" if self.os_type == "linux" else "robocopy") is None and backend == "shell":
+                print("Backend 'shell' needs rsync/robocopy, skipped.")
+                continue
+            progress = []
+            copy = lambda: handler.run_copy(src, dest, progress.append, total_files=files)
+            times = self._time(copy, setup=lambda: shutil.rmtree(dest, ignore_errors=True))
+            self._record(tree, "copy_full", backend, times, files, size)
+            times = self._time(copy)
+            self._record(tree, "copy_unchanged", backend, times, files, size)
+            times = self._time(lambda: handler.delete(dest), setup=lambda: os.path.isdir(dest) or handler.run_copy(src, dest))
+            self._record(tree, "delete", backend, times, files, size)
+
+    def run_old_backups(self, count=365):
+        """
+        Benchmarks `FileHandler.check_old_backups` on a host directory with `count` backups.
+
+        Args:
+            count (int): Number of fake backup directories.
+        """
+        fh = self._filehandler("old_backups")
+        host_dir = os.path.join(fh.destPath, fh.hostname)
+        today = datetime.now()
+        for num in range(count):
+            os.makedirs(os.path.join(host_dir, f"backup_{(today - timedelta(days=num)):%Y-%m-%d}"), exist_ok=True)
+        times = self._time(lambda: fh.check_old_backups("backup"))
+        self._record("old_backups", "check_old_backups", None, times, count, 0)
+        shutil.rmtree(host_dir)
+
+    def report(self):
+        """
+        Returns the results with information about the environment.
+
+        Returns:
+            dict: Machine-readable results.
+        """
+        return {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "repeat": self.repeat,
+            "results": self.results,
+        }
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares results with a baseline file and prints the stages that got slower.
+
+    Args:
+        results (dict): Results of this run.
+        baseline (dict): Results of an earlier run.
+        threshold (float): Allowed slowdown (0.2 = 20 %).
+
+    Returns:
+        int: Number of regressions.
+    """
+    key = lambda r: (r["tree"], r["stage"], r["backend"])
+    old = {key(r): r for r in baseline["results"]}
+    regressions = 0
+    for result in results["results"]:
+        before = old.get(key(result))
+        if not before or not before["seconds"]:
+            continue
+        change = result["seconds"] / before["seconds"] - 1
+        if change > threshold:
+            regressions += 1
+            print(f"REGRESSION {key(result)}: {before['seconds']:.3f}s -> {result['seconds']:.3f}s (+{change:.0%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the backup pipeline on synthetic source trees.")
+    parser.add_argument("--trees", nargs="+", default=["tiny_files", "huge_files", "deep_nesting", "mixed"],
+                        choices=["tiny_files", "huge_files", "deep_nesting", "mixed"], help="Trees to benchmark.")
+    parser.add_argument("--backends", nargs="+", default=["shell", "native"], choices=["shell", "native"], help="Copy backends to compare.")
+    parser.add_argument("--scale", type=float, default=0.1, help="Size factor of the trees (1.0 = 20000 tiny files, 4x256 MB).")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, the median is reported.")
+    parser.add_argument("--workdir", help="Directory for the trees (default: a temporary directory, deleted afterwards).")
+    parser.add_argument("--out", help="Write the results as JSON to this file.")
+    parser.add_argument("--compare", help="JSON results of an earlier run to check for regressions.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown for --compare (0.2 = 20%%).")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    work_dir = args.workdir or tempfile.mkdtemp(prefix="backup_benchmark_")
+    try:
+        generator = TreeGenerator(os.path.join(work_dir, "src"), scale=args.scale)
+        benchmark = Benchmark(work_dir, args.backends, repeat=args.repeat)
+        for tree in args.trees:
+            src = generator.generate(tree)
+            benchmark.run_tree(tree, src)
+        benchmark.run_old_backups()
+        results = benchmark.report()
+    finally:
+        if not args.workdir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to '{args.out}'.")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        sys.exit(1 if compare(results, baseline, args.threshold) else 0)
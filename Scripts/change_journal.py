@@ -0,0 +1,444 @@
+import os
+import json
+import time
+import errno
+import select
+import signal
+import struct
+import logging
+import ctypes
+import ctypes.util
+
+
+class DirtySet:
+    """
+    Directories of a source that changed since a backup, relative to the source with '/' ('' is the source itself).
+    A directory is clean if neither it nor anything below it changed, clean subtrees don't have to be scanned.
+    """
+
+    def __init__(self, dirs, volatile=()):
+        """
+        Initializes the DirtySet.
+
+        Args:
+            dirs (iterable[str]): Directories whose entries changed.
+            volatile (iterable[str]): Directories whose whole subtree counts as changed (e.g. symlinks to directories,
+                their target isn't watched).
+        """
+        self.dirs = set(dirs)
+        self.volatile = set(volatile)
+        self.ancestors = set()
+        for rel in self.dirs | self.volatile:
+            while rel:
+                rel = rel.rpartition("/")[0]
+                if rel in self.ancestors:
+                    break
+                self.ancestors.add(rel)
+
+    def is_clean(self, rel):
+        """
+        Checks if a directory and everything below it is unchanged.
+
+        Args:
+            rel (str): Directory relative to the source with '/'.
+
+        Returns:
+            bool: True if the subtree doesn't have to be scanned.
+        """
+        if rel in self.dirs or rel in self.ancestors:
+            return False
+        while rel:
+            if rel in self.volatile:
+                return False
+            rel = rel.rpartition("/")[0]
+        return "" not in self.volatile
+
+    def __len__(self):
+        return len(self.dirs) + len(self.volatile)
+
+
+class ChangeJournal:
+    """
+    Persistent journal of the directories changed in the backup sources, written by the ChangeWatcher
+    (`main.py --watch`) and read by the file backup.
+
+    The journal can only be trusted for the time the watcher ran without interruption, so every source stores
+    the time since when it is watched ('since') and every dirty directory the time of its last change.
+    A backup uses the journal only if the watcher is alive and watched the source since the start of the
+    backup the unchanged subtrees are taken from, otherwise it scans everything.
+    """
+    VERSION = 1
+    FLUSH_INTERVAL = 2.0 # seconds between two writes of the journal by the watcher
+    SYNC_TIMEOUT = 5.0 # seconds a backup waits for the watcher to write the latest changes
+    MAX_AGE = 30 * 24 * 3600 # changes older than this are forgotten (the source counts as watched since then)
+    MAX_DIRS = 200000 # more dirty directories count as an overflow
+
+    def __init__(self, path):
+        """
+        Initializes the ChangeJournal.
+
+        Args:
+            path (str): Path of the journal file.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.path = str(path)
+        self.data = {"version": self.VERSION, "pid": None, "heartbeat": 0.0, "sources": {}}
+
+    def load(self):
+        """
+        Reads the journal file.
+
+        Returns:
+            bool: True if the journal exists and was readable.
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Couldn't read the change journal '{self.path}' ({e}).")
+            return False
+        if data.get("version") != self.VERSION:
+            return False
+        self.data = data
+        return True
+
+    def save(self):
+        """Writes the journal atomically (temporary file and rename)."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+
+    # ----------------------------- writing (watcher) -----------------------------
+
+    def start_source(self, source, now=None):
+        """Starts watching a source: its earlier changes are unknown, so it counts as watched from now on."""
+        self.data["sources"][source] = {"since": now or time.time(), "dirty": {}, "volatile": []}
+
+    def mark_dirty(self, source, rel, now=None):
+        """
+        Records a change in a directory.
+
+        Args:
+            source (str): The source (as configured).
+            rel (str): Directory relative to the source with '/'.
+        """
+        entry = self.data["sources"].get(source)
+        if entry is None:
+            return
+        entry["dirty"][rel] = now or time.time()
+        if len(entry["dirty"]) > self.MAX_DIRS:
+            self.logger.warning(f"Too many changed directories in '{source}', the next backup scans it completely.")
+            entry["since"] = now or time.time()
+            entry["dirty"] = {}
+
+    def set_volatile(self, source, rels):
+        """Stores the directories whose subtree is always scanned (symlinks to directories)."""
+        if source in self.data["sources"]:
+            self.data["sources"][source]["volatile"] = sorted(rels)
+
+    def prune(self, now=None):
+        """Forgets changes older than MAX_AGE, the sources count as watched since then."""
+        now = now or time.time()
+        cutoff = now - self.MAX_AGE
+        for entry in self.data["sources"].values():
+            if entry["since"] < cutoff:
+                entry["since"] = cutoff
+                entry["dirty"] = {rel: ts for rel, ts in entry["dirty"].items() if ts >= cutoff}
+
+    def heartbeat(self, now=None):
+        """Marks the watcher as alive."""
+        self.data["pid"] = os.getpid()
+        self.data["heartbeat"] = now or time.time()
+
+    # ----------------------------- reading (backup) -----------------------------
+
+    def is_alive(self):
+        """Checks if the watcher process of this journal is running."""
+        pid = self.data.get("pid")
+        if not pid:
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass # exists, but belongs to another user
+        return True
+
+    def sync(self):
+        """
+        Asks the watcher to write the changes it has read so far (SIGUSR1) and waits for it.
+
+        Returns:
+            bool: True if the journal is up to date.
+        """
+        if not hasattr(signal, "SIGUSR1") or not self.load() or not self.is_alive():
+            return False
+        requested = time.time()
+        try:
+            os.kill(self.data["pid"], signal.SIGUSR1)
+        except OSError:
+            return False
+        deadline = time.monotonic() + self.SYNC_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.1)
+            if self.load() and self.data["heartbeat"] >= requested:
+                return True
+        return False
+
+    def get_dirty(self, source, since):
+        """
+        Returns the directories of a source changed since a point in time.
+
+        Args:
+            source (str): The source (as configured).
+            since (float): Start of the backup the unchanged subtrees are taken from (epoch seconds).
+
+        Returns:
+            DirtySet or None: The changed directories, None if the journal doesn't cover the whole time.
+        """
+        entry = self.data["sources"].get(os.path.normpath(source))
+        if entry is None or entry["since"] > since:
+            return None
+        return DirtySet([rel for rel, ts in entry["dirty"].items() if ts >= since], entry.get("volatile", []))
+
+
+class Inotify:
+    """
+    Minimal ctypes binding of the Linux inotify API (no third-party package needed).
+    """
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_DONT_FOLLOW = 0x02000000
+    IN_EXCL_UNLINK = 0x04000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        """
+        Creates the inotify instance.
+
+        Raises:
+            OSError: If inotify isn't available.
+        """
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1: {os.strerror(err)}")
+
+    def add_watch(self, path, mask):
+        """
+        Watches a directory.
+
+        Returns:
+            int: The watch descriptor.
+
+        Raises:
+            OSError: E.g. ENOSPC if the limit `fs.inotify.max_user_watches` is reached.
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read(self, timeout):
+        """
+        Waits up to `timeout` seconds for events and reads all queued events.
+
+        Returns:
+            list[tuple]: (watch descriptor, mask, name)
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        events = []
+        while ready:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = self.EVENT.unpack_from(buffer, offset)
+                offset += self.EVENT.size
+                name = os.fsdecode(buffer[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        """Closes the inotify instance (removes all watches)."""
+        os.close(self.fd)
+
+
+class ChangeWatcher:
+    """
+    Watches the backup sources recursively with inotify and records the changed directories in the ChangeJournal.
+    Runs until it is stopped (SIGINT/SIGTERM), SIGUSR1 makes it write the journal immediately.
+    """
+    MASK = (Inotify.IN_MODIFY | Inotify.IN_ATTRIB | Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_FROM | Inotify.IN_MOVED_TO |
+            Inotify.IN_CREATE | Inotify.IN_DELETE | Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF |
+            Inotify.IN_ONLYDIR | Inotify.IN_DONT_FOLLOW | Inotify.IN_EXCL_UNLINK)
+
+    def __init__(self, journal_path, sources):
+        """
+        Initializes the ChangeWatcher.
+
+        Args:
+            journal_path (str): Path of the journal file.
+            sources (list[str]): Backup sources, only directories are watched (single files are always copied).
+        """
+        self.logger = logging.getLogger(__name__)
+        self.journal = ChangeJournal(journal_path)
+        self.sources = [os.path.normpath(src) for src in sources if os.path.isdir(src)]
+        self.watches = {} # wd: [(source, rel)]
+        self.running = False
+        self.flush_requested = False
+
+    def run(self):
+        """
+        Watches the sources until stopped.
+
+        Returns:
+            int: 0 if stopped normally, 1 if inotify isn't available.
+        """
+        try:
+            self.inotify = Inotify()
+        except (OSError, AttributeError) as e:
+            self.logger.error(f"watch: inotify isn't available ({e}).")
+            return 1
+        signal.signal(signal.SIGUSR1, self._request_flush)
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        self.journal.data["sources"] = {}
+        for source in self.sources:
+            self._watch_source(source)
+        self._flush()
+        self.logger.info(f"Watching {len(self.watches)} directories of {len(self.sources)} sources, journal: '{self.journal.path}'.")
+        self.running = True
+        last_flush = time.monotonic()
+        dirty = False
+        while self.running:
+            for wd, mask, name in self.inotify.read(0.5):
+                self._handle(wd, mask, name)
+                dirty = True
+            if self.flush_requested or (dirty and time.monotonic() - last_flush >= ChangeJournal.FLUSH_INTERVAL):
+                self._flush()
+                self.flush_requested = False
+                dirty = False
+                last_flush = time.monotonic()
+        self.journal.data["pid"] = None # a restarted watcher starts from scratch
+        self.journal.save()
+        self.inotify.close()
+        self.logger.info("Stopped watching.")
+        return 0
+
+    def _watch_source(self, source):
+        """(Re)starts watching a source: adds watches to all its directories."""
+        for wd in [wd for wd, owners in self.watches.items() if any(owner[0] == source for owner in owners)]:
+            self.watches[wd] = [owner for owner in self.watches[wd] if owner[0] != source]
+        self.journal.start_source(source)
+        volatile = set()
+        if not self._watch_tree(source, source, "", volatile):
+            self.logger.warning(f"watch: couldn't watch all directories of '{source}', it is always scanned completely.")
+            self.journal.data["sources"].pop(source, None)
+            return
+        self.journal.set_volatile(source, volatile)
+
+    def _watch_tree(self, source, path, rel, volatile):
+        """
+        Adds watches to a directory and everything below it.
+
+        Returns:
+            bool: False if the watch limit was reached.
+        """
+        stack = [(path, rel)]
+        while stack:
+            path, rel = stack.pop()
+            try:
+                wd = self.inotify.add_watch(path, self.MASK)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    return False
+                continue # vanished in the meantime, its parent is marked dirty
+            owners = self.watches.setdefault(wd, [])
+            if (source, rel) not in owners:
+                owners.append((source, rel))
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        child = f"{rel}/{entry.name}" if rel else entry.name
+                        if entry.is_symlink():
+                            if entry.is_dir():
+                                volatile.add(child) # the target isn't watched
+                        elif entry.is_dir(follow_symlinks=False):
+                            stack.append((entry.path, child))
+            except OSError:
+                pass
+        return True
+
+    def _handle(self, wd, mask, name):
+        """Records an inotify event as change of its directory (and of new subtrees)."""
+        if mask & Inotify.IN_Q_OVERFLOW:
+            self.logger.warning("watch: event queue overflowed, the next backup scans everything.")
+            for source in self.sources:
+                self._watch_source(source)
+            return
+        owners = self.watches.get(wd, [])
+        if mask & Inotify.IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        for source, rel in owners:
+            if mask & (Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF):
+                if not rel:
+                    self.logger.warning(f"watch: source '{source}' was removed or moved.")
+                continue # its parent gets the event for the entry
+            self.journal.mark_dirty(source, rel)
+            if mask & Inotify.IN_ISDIR and mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+                # a new subtree: watch it and mark all its directories, it may have been filled before the watch existed
+                child = f"{rel}/{name}" if rel else name
+                volatile = set()
+                path = os.path.join(source, *child.split("/"))
+                if not self._watch_tree(source, path, child, volatile):
+                    self.logger.warning(f"watch: watch limit reached in '{source}'.")
+                    self.journal.data["sources"].pop(source, None)
+                    continue
+                for root, dirs, _ in os.walk(path):
+                    sub = os.path.relpath(root, source).replace(os.sep, "/")
+                    self.journal.mark_dirty(source, sub)
+                entry = self.journal.data["sources"].get(source)
+                if entry is not None:
+                    entry["volatile"] = sorted(set(entry["volatile"]) | volatile)
+
+    def _flush(self):
+        """Writes the journal with a new heartbeat."""
+        self.journal.prune()
+        self.journal.heartbeat()
+        try:
+            self.journal.save()
+        except OSError as e:
+            self.logger.error(f"watch: couldn't write the journal ({e}).")
+
+    def _request_flush(self, signum, frame):
+        """Signal handler of SIGUSR1."""
+        self.flush_requested = True
+
+    def _stop(self, signum, frame):
+        """Signal handler of SIGINT/SIGTERM."""
+        self.running = False
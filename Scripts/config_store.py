@@ -0,0 +1,180 @@
+import os
+import copy
+import logging
+import threading
+import yaml
+
+
+# libyaml bindings are ~10x faster than the pure Python parser, not every PyYAML build has them
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+class ConfigStore:
+    """
+    Loads and saves 'config.yaml'.
+
+    Parsed files are cached per process, keyed by their mtime and size, so reloading an unchanged config
+    (e.g. by the scheduler before every run) doesn't parse it again. Hosts are indexed by hostname.
+    Saving only writes files whose content changed, through a temporary file and `os.replace`, so a crash
+    never leaves a half-written config.
+
+    With `hosts_dir: <dir>` in 'config.yaml' every host is stored in its own file `<dir>/<hostname>.yaml`
+    (relative to 'config.yaml'), so saving one host doesn't rewrite the profiles of the others. Hosts still listed
+    in `hosts_map` are moved to their file on the next save of that host.
+    """
+    _cache = {} # path: ((mtime_ns, size), parsed data)
+    _cache_lock = threading.Lock()
+
+    def __init__(self, path):
+        """
+        Initializes the ConfigStore.
+
+        Args:
+            path (str): Path of 'config.yaml'.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.path = str(path)
+        self.data = {"hosts_map": []}
+        self.hosts = {} # hostname: host dict
+        self.origin = {} # hostname: file the host was loaded from
+        self.baseline = {} # hostname: host as last read or written
+        self.saved = {} # path: content of the file as last read or written
+
+    def load(self):
+        """
+        Reads the config (and the host files), creates it if missing.
+
+        Returns:
+            dict: The config with all hosts in 'hosts_map'.
+
+        Raises:
+            ValueError: If the config isn't a mapping.
+        """
+        if not os.path.isfile(self.path):
+            self._write(self.path, {"hosts_map": []})
+        self.data = self._read(self.path)
+        if not isinstance(self.data, dict):
+            raise ValueError(f"'{self.path}' isn't a YAML mapping.")
+        self.data.setdefault("hosts_map", [])
+        self.saved = {self.path: copy.deepcopy(self.data)}
+        self.hosts = {}
+        self.origin = {}
+        for host in self.data["hosts_map"] or []:
+            self.hosts[host["hostname"]] = host
+            self.origin[host["hostname"]] = self.path
+        hosts_dir = self.get_hosts_dir()
+        if hosts_dir and os.path.isdir(hosts_dir):
+            for name in sorted(os.listdir(hosts_dir)):
+                if not name.endswith(".yaml"):
+                    continue
+                path = os.path.join(hosts_dir, name)
+                host = self._read(path)
+                if isinstance(host, dict) and host.get("hostname"):
+                    self.hosts[host["hostname"]] = host # the host file wins over an old entry in hosts_map
+                    self.origin[host["hostname"]] = path
+                    self.saved[path] = copy.deepcopy(host)
+        self.data["hosts_map"] = list(self.hosts.values())
+        self.baseline = copy.deepcopy(self.hosts)
+        return self.data
+
+    def get_hosts_dir(self):
+        """
+        Returns the directory of the host files.
+
+        Returns:
+            str or None: Absolute path, None if the hosts are stored in 'config.yaml'.
+        """
+        hosts_dir = self.data.get("hosts_dir") if isinstance(self.data, dict) else None
+        if not hosts_dir:
+            return None
+        return os.path.join(os.path.dirname(os.path.abspath(self.path)), hosts_dir)
+
+    def get_host(self, hostname):
+        """
+        Returns the profile of a host.
+
+        Args:
+            hostname (str): The hostname.
+
+        Returns:
+            dict or None: The host dict (changes to it are saved by `save`), None if unknown.
+        """
+        return self.hosts.get(hostname)
+
+    def add_host(self, host):
+        """
+        Adds a host profile.
+
+        Args:
+            host (dict): The host dict with the key 'hostname'.
+        """
+        self.hosts[host["hostname"]] = host
+        self.data["hosts_map"].append(host)
+        hosts_dir = self.get_hosts_dir()
+        self.origin[host["hostname"]] = self._host_path(host["hostname"]) if hosts_dir else self.path
+
+    def save(self):
+        """
+        Writes the files whose content changed.
+
+        Returns:
+            int: Number of written files.
+        """
+        hosts_dir = self.get_hosts_dir()
+        files = {}
+        main = {key: value for key, value in self.data.items() if key != "hosts_map"}
+        main["hosts_map"] = []
+        for hostname, host in self.hosts.items():
+            changed = self.baseline.get(hostname) != host
+            origin = self.origin.get(hostname)
+            if hosts_dir and (changed or origin != self.path):
+                if changed:
+                    path = origin if origin and origin != self.path else self._host_path(hostname)
+                    files[path] = host
+                    self.origin[hostname] = path
+            else:
+                main["hosts_map"].append(host) # unchanged hosts stay in 'config.yaml' until they are saved
+        if self.saved.get(self.path) != main:
+            files[self.path] = main
+        if hosts_dir and files:
+            os.makedirs(hosts_dir, exist_ok=True)
+        for path, content in files.items():
+            self._write(path, content)
+            self.saved[path] = copy.deepcopy(content)
+        self.baseline = copy.deepcopy(self.hosts)
+        return len(files)
+
+    # ----------------------------- helpers -----------------------------
+
+    def _host_path(self, hostname):
+        """Returns the file of a host in the hosts directory."""
+        safe = "".join(char if char.isalnum() or char in "-_." else "_" for char in hostname)
+        return os.path.join(self.get_hosts_dir(), f"{safe}.yaml")
+
+    def _read(self, path):
+        """Parses a YAML file, from the cache if it didn't change since it was parsed."""
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_size)
+        with self._cache_lock:
+            cached = self._cache.get(path)
+        if cached is not None and cached[0] == key:
+            return copy.deepcopy(cached[1])
+        with open(path, "r", encoding="utf-8") as f:
+            data = yaml.load(f, Loader=Loader)
+        with self._cache_lock:
+            self._cache[path] = (key, copy.deepcopy(data))
+        return data
+
+    def _write(self, path, content):
+        """Writes a YAML file atomically (temporary file and rename) and updates the cache."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            yaml.dump(content, f, Dumper=Dumper)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        st = os.stat(path)
+        with self._cache_lock:
+            self._cache[path] = ((st.st_mtime_ns, st.st_size), copy.deepcopy(content))
+        self.logger.info(f"Config written to '{path}'.")
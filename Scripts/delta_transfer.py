@@ -0,0 +1,272 @@
+import os
+import zlib
+import hashlib
+import logging
+
+
+class DeltaTransfer:
+    """
+    Updates a large file from an older copy of it (the basis) instead of rewriting it completely, for big files
+    that change only a little (game saves, browser databases, VM images).
+
+    The source is compared block by block with the basis at the same offsets. If the size changed (data was
+    inserted or removed), the mismatched regions are searched for shifted basis blocks with a rolling weak
+    checksum (adler32) confirmed by a strong hash (blake2b), like rsync. The new file is then either written
+    in place (only the changed ranges, if the basis is the destination itself, not hard-linked and all
+    matches are at the same offset) or assembled in a temporary file from basis ranges and source data.
+    """
+    BLOCK_SIZE = 64 * 1024
+    MAX_SEARCH = 1024 * 1024 # bytes searched byte by byte after a mismatch before continuing block by block
+    SEGMENT_SIZE = 16 * 1024 * 1024 # mismatched regions are searched in segments of this size
+    MOD_ADLER = 65521
+
+    def __init__(self, check_stop, block_size=None, throttle=None):
+        """
+        Initializes the DeltaTransfer.
+
+        Args:
+            check_stop (callable): Called regularly, raises an exception to stop the transfer.
+            block_size (int, optional): Size of the compared blocks.
+            throttle (callable, optional): Called with the number of bytes written from the source, waits for the bandwidth limit.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.check_stop = check_stop
+        self.block_size = block_size or self.BLOCK_SIZE
+        self.throttle = throttle or (lambda n: None)
+
+    def sync(self, src_path, basis_path, dst_path, on_bytes, on_reused=None):
+        """
+        Writes the content of src_path to dst_path, reusing the unchanged parts of basis_path.
+        If dst_path is basis_path, the changed ranges are written in place when possible, otherwise the new
+        content is assembled in a temporary file next to dst_path which replaces it.
+
+        Args:
+            src_path (str): Source file.
+            basis_path (str): Older copy of the file (destination or previous snapshot).
+            dst_path (str): Destination file.
+            on_bytes (callable): Called with the number of bytes done (transferred and reused) per range.
+            on_reused (callable, optional): Called with the number of bytes taken from the basis per range.
+
+        Returns:
+            tuple[int, int]: (transferred bytes, reused bytes)
+        """
+        src_size = os.path.getsize(src_path)
+        basis_st = os.stat(basis_path)
+        with open(src_path, "rb") as fsrc, open(basis_path, "rb") as fbasis:
+            ops = self._compare(fsrc, fbasis, src_size, basis_st.st_size)
+            if src_size != basis_st.st_size and any(op[0] == "data" for op in ops):
+                ops = self._search(fsrc, fbasis, basis_st.st_size, ops)
+        in_place = (os.path.exists(dst_path) and os.path.samefile(basis_path, dst_path) and basis_st.st_nlink <= 1
+                    and all(op[0] == "data" or op[1] == op[3] for op in ops))
+        transferred = sum(op[2] for op in ops if op[0] == "data")
+        reused = src_size - transferred
+        self.logger.debug(f"delta: '{src_path}' {transferred} bytes changed, {reused} reused "
+                          f"({'in place' if in_place else 'temporary file'}).")
+        if in_place:
+            self._apply_in_place(src_path, dst_path, ops, src_size, on_bytes, on_reused)
+        else:
+            self._apply_to_copy(src_path, basis_path, dst_path, ops, on_bytes, on_reused)
+        return transferred, reused
+
+    # ----------------------------- matching -----------------------------
+
+    def _compare(self, fsrc, fbasis, src_size, basis_size):
+        """
+        Compares source and basis block by block at the same offsets.
+
+        Returns:
+            list[tuple]: Ranges of the source as ('copy', src_offset, length, basis_offset) or
+                ('data', src_offset, length, None), adjacent ranges of the same kind merged.
+        """
+        ops = []
+        offset = 0
+        while offset < src_size:
+            self.check_stop()
+            src_block = fsrc.read(self.block_size)
+            if not src_block:
+                break
+            basis_block = fbasis.read(self.block_size) if offset < basis_size else b""
+            kind = "copy" if src_block == basis_block else "data"
+            self._append(ops, kind, offset, len(src_block), offset if kind == "copy" else None)
+            offset += len(src_block)
+        return ops
+
+    def _search(self, fsrc, fbasis, basis_size, ops):
+        """
+        Searches the mismatched regions for basis blocks at other offsets (shifted by an insertion or deletion).
+        The regions are read in segments, so large files don't have to fit into memory.
+
+        Returns:
+            list[tuple]: The ranges with the found matches as 'copy' ranges.
+        """
+        signatures = self._signatures(fbasis, basis_size)
+        result = []
+        for op in ops:
+            kind, offset, length, basis_offset = op
+            if kind == "copy" or length < self.block_size:
+                self._append(result, kind, offset, length, basis_offset)
+                continue
+            end = offset + length
+            while offset < end:
+                fsrc.seek(offset)
+                data = fsrc.read(min(self.SEGMENT_SIZE, end - offset))
+                for sub in self._rolling_match(data, offset, signatures):
+                    self._append(result, *sub)
+                offset += len(data)
+        return result
+
+    def _signatures(self, fbasis, basis_size):
+        """
+        Computes the weak and strong checksums of all full blocks of the basis.
+
+        Returns:
+            dict: adler32 as key and a list of (blake2b digest, basis offset) as value.
+        """
+        signatures = {}
+        fbasis.seek(0)
+        offset = 0
+        while offset + self.block_size <= basis_size:
+            self.check_stop()
+            block = fbasis.read(self.block_size)
+            if len(block) < self.block_size:
+                break
+            strong = hashlib.blake2b(block, digest_size=16).digest()
+            signatures.setdefault(zlib.adler32(block), []).append((strong, offset))
+            offset += self.block_size
+        return signatures
+
+    def _rolling_match(self, data, start, signatures):
+        """
+        Looks up the blocks of a mismatched region in the basis. After a mismatch the window slides byte by byte
+        with a rolling checksum (for at most `MAX_SEARCH` bytes, pure Python is slow), then block by block until
+        the next match. A match at the offset following the last match is preferred (the rest of a shifted range).
+
+        Args:
+            data (bytes): Content of the region (or a segment of it).
+            start (int): Offset of the data in the source.
+            signatures (dict): Checksums of the basis blocks.
+
+        Returns:
+            list[tuple]: Ranges of the data ('copy' or 'data', see `_compare`).
+        """
+        size = self.block_size
+        mod = self.MOD_ADLER
+        ops = []
+        literal = 0
+        pos = 0
+        expected = None
+        budget = self.MAX_SEARCH
+        rolling = False
+        while pos + size <= len(data):
+            if not rolling:
+                self.check_stop()
+                weak = zlib.adler32(data[pos:pos + size])
+                a, b = weak & 0xffff, weak >> 16
+            candidates = signatures.get((b << 16) | a)
+            match = None
+            if candidates:
+                strong = hashlib.blake2b(data[pos:pos + size], digest_size=16).digest()
+                for digest, basis_offset in candidates:
+                    if digest == strong and (match is None or basis_offset == expected):
+                        match = basis_offset
+            if match is not None:
+                if pos > literal:
+                    ops.append(("data", start + literal, pos - literal, None))
+                ops.append(("copy", start + pos, size, match))
+                pos += size
+                literal = pos
+                expected = match + size
+                budget = self.MAX_SEARCH
+                rolling = False
+            elif budget > 0 and pos + size < len(data):
+                out_byte, in_byte = data[pos], data[pos + size]
+                a = (a - out_byte + in_byte) % mod
+                b = (b - size * out_byte + a - 1) % mod
+                pos += 1
+                budget -= 1
+                rolling = True
+            else:
+                pos += size
+                rolling = False
+        if literal < len(data):
+            ops.append(("data", start + literal, len(data) - literal, None))
+        return ops
+
+    def _append(self, ops, kind, offset, length, basis_offset):
+        """Appends a range, merged with the last one if it continues it."""
+        if ops:
+            last_kind, last_offset, last_length, last_basis = ops[-1]
+            if last_kind == kind and last_offset + last_length == offset and \
+                    (kind == "data" or last_basis + last_length == basis_offset):
+                ops[-1] = (kind, last_offset, last_length + length, last_basis)
+                return
+        ops.append((kind, offset, length, basis_offset))
+
+    # ----------------------------- writing -----------------------------
+
+    def _apply_in_place(self, src_path, dst_path, ops, src_size, on_bytes, on_reused):
+        """Writes only the changed ranges into the destination and truncates it to the new size."""
+        with open(src_path, "rb") as fsrc, open(dst_path, "r+b") as fdst:
+            for kind, offset, length, _ in ops:
+                self.check_stop()
+                if kind == "data":
+                    fsrc.seek(offset)
+                    fdst.seek(offset)
+                    self._copy_range(fsrc, fdst, length, on_bytes)
+                else:
+                    on_bytes(length)
+                    if on_reused:
+                        on_reused(length)
+            fdst.truncate(src_size)
+
+    def _apply_to_copy(self, src_path, basis_path, dst_path, ops, on_bytes, on_reused):
+        """Assembles the new file from basis ranges and source data in a temporary file which replaces dst_path."""
+        tmp_path = os.path.join(os.path.dirname(dst_path), f".{os.path.basename(dst_path)}.partial")
+        try:
+            with open(src_path, "rb") as fsrc, open(basis_path, "rb") as fbasis, open(tmp_path, "wb") as fdst:
+                for kind, offset, length, basis_offset in ops:
+                    self.check_stop()
+                    if kind == "data":
+                        fsrc.seek(offset)
+                        self._copy_range(fsrc, fdst, length, on_bytes)
+                    else:
+                        fbasis.seek(basis_offset)
+                        self._copy_range(fbasis, fdst, length, on_bytes, reflink=True)
+                        if on_reused:
+                            on_reused(length)
+            os.replace(tmp_path, dst_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _copy_range(self, fin, fout, length, on_bytes, reflink=False):
+        """
+        Copies `length` bytes from the current position of fin to the current position of fout.
+        Ranges of the basis are copied with `os.copy_file_range` where possible (shares the blocks on CoW filesystems).
+        """
+        if reflink and hasattr(os, "copy_file_range"):
+            fout.flush()
+            try:
+                while length > 0:
+                    n = os.copy_file_range(fin.fileno(), fout.fileno(), length)
+                    if n == 0:
+                        break
+                    length -= n
+                    on_bytes(n)
+                # copy_file_range moved the file offsets, the file objects have to follow
+                fin.seek(os.lseek(fin.fileno(), 0, os.SEEK_CUR))
+                fout.seek(os.lseek(fout.fileno(), 0, os.SEEK_CUR))
+                return
+            except OSError:
+                fin.seek(os.lseek(fin.fileno(), 0, os.SEEK_CUR))
+                fout.seek(os.lseek(fout.fileno(), 0, os.SEEK_CUR))
+        while length > 0:
+            data = fin.read(min(length, 8 * 1024 * 1024))
+            if not data:
+                raise OSError(f"'{fin.name}' is shorter than expected.")
+            fout.write(data)
+            length -= len(data)
+            on_bytes(len(data))
+            if not reflink:
+                self.throttle(len(data)) # only the changed data counts, basis ranges stay on the destination
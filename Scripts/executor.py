@@ -1,28 +1,59 @@
 import os
-import re
 import shutil
 import logging
 import threading
+from datetime import datetime
 from tools import get_subdirs
+from parallel_copy import ParallelCopier
+from progress_bus import MessageEvent, TaskStartedEvent, PhaseStartedEvent, PercentEvent, BytesEvent, ErrorEvent, FinishedEvent
+from retention import write_snapshot_meta, read_snapshot_meta
+from reaper import Reaper
+from archive_writer import ArchiveWriter
+from manifest import Manifest
+from locks import DestinationLease
+from run_metrics import RunMetrics
+from run_journal import RunJournal
+from progress_model import ProgressModel
+import profiler
 
 
 # class for executing tasks from view
-# update_callback is a function from view to update its text area
+# progress is published as events on the bus, the view (or CLI) subscribes to it
 class Executor:
-    def __init__(self, subprocesshandler, update_text_callback, update_rdy_callback):
+    def __init__(self, subprocesshandler, bus):
         """Initializes the Executor.
 
         Args:
             subprocesshandler: Handler for subprocess-based operations like copy and delete.
-            update_text_callback: Function to update the text area in the view.
-            update_rdy_callback: Function to signal task execution in the view.
+            bus (ProgressBus): Bus to publish the progress events to (drained by the view, CLI, ...).
         """
         self.logger = logging.getLogger(__name__)
         self.subprocesshandler = subprocesshandler
-        self.update_text = update_text_callback
-        self.update_rdy = update_rdy_callback
+        self.bus = bus
         self.global_error = False
+        self.task_error = False # error of the running task, global_error stays set for the rest of the run
         self.stop = False
+        self.reaper = None
+        self.lease = None
+        self.metrics = RunMetrics() # replaced by set_metrics() to keep a history
+        self.progress = None
+
+    def update_text(self, text, tag=None, clear=False, update=False):
+        """Publishes a line for the log (and an ErrorEvent for errors).
+
+        Args:
+            text (str): The text of the line.
+            tag (str, optional): 'error', 'warning' or 'success'.
+            clear (bool): If True, the log is cleared.
+            update (bool): If True, the line replaces the last line.
+        """
+        self.bus.publish(MessageEvent(text, tag=tag, clear=clear, update=update))
+        if tag == "error":
+            self.bus.publish(ErrorEvent(text))
+
+    def update_rdy(self):
+        """Publishes that all tasks are finished."""
+        self.bus.publish(FinishedEvent())
         
     def set_details(self, task_infos):
         """Sets task-specific details for the executor.
@@ -32,26 +63,50 @@ class Executor:
         """
         self.task_infos = task_infos
 
+    def set_metrics(self, metrics):
+        """Sets the metrics of the run, started before preparing the tasks.
+
+        Args:
+            metrics (RunMetrics): Metrics written to the history (and the Prometheus textfile) when the run ends.
+        """
+        self.metrics = metrics
+
     def execute(self):
         """Executes all tasks provided in `task_infos` sequentially."""
         try:
             self.global_error = False
+            profiler.mark("tasks") # memory snapshot with 'main.py --profile-memory'
             total_tasks = len(self.task_infos)
+            self.start_progress()
+            with self.metrics.phase("lease_wait"):
+                self.acquire_lease()
             for current, task in enumerate(self.task_infos, start=1):
                 if self.stop:
-                    return
+                    break
+                self.bus.publish(TaskStartedEvent(task, current, total_tasks))
                 self.update_text(f"Now executing Task {current}/{total_tasks}...")
-                match task:
-                    case "clean":
-                        self.clean()
-                    case "smartphone_backup":
-                        self.smartphone_backup()
-                    case "virus_scan":
-                        self.virus_scan()
-                    case "health_scan":
-                        self.health_scan()
-                    case "file_backup":
-                        self.file_backup()  
+                self.task_error = False
+                with self.metrics.phase(task):
+                    match task:
+                        case "clean":
+                            self.clean()
+                        case "smartphone_backup":
+                            self.smartphone_backup()
+                        case "virus_scan":
+                            self.virus_scan()
+                        case "health_scan":
+                            self.health_scan()
+                        case "file_backup":
+                            self.file_backup()  
+                        case "verify":
+                            self.verify()
+                self.metrics.record(task, ok=not self.task_error)
+
+            with self.metrics.phase("reaper_wait"):
+                self.wait_reaper()
+            self.release_lease()
+            self.finish_progress()
+            self.finish_metrics("stopped" if self.stop else "error" if self.global_error else "success")
                         
             if self.stop:
                 self.update_text("Stopped all tasks.", "success")
@@ -64,19 +119,98 @@ class Executor:
             self.globsal_error = False
             
         except Exception as e:    
-            print(f"execute(): {e}")   
+            self.logger.error(f"execute(): {e}")
+            self.release_lease()
+            self.finish_progress()
+            self.finish_metrics("error")
+            self.update_rdy()
+
+    def start_progress(self):
+        """Starts the progress model of the run, which publishes the progress over all tasks and the ETA."""
+        self.progress = ProgressModel(self.get_progress_phases(), publish_callback=self.bus.publish)
+        self.bus.subscribe(self.progress.handle_event)
+
+    def finish_progress(self):
+        """Publishes the final progress of the run and stops the progress model."""
+        if self.progress is None:
+            return
+        self.progress.finish()
+        self.bus.unsubscribe(self.progress.handle_event)
+        self.progress = None
+
+    def get_progress_phases(self):
+        """Returns the work of every task for the progress model.
+
+        Returns:
+            list[tuple]: (task, amount of work, True if in bytes), tasks without measurable work are left out.
+        """
+        phases = []
+        for task, infos in self.task_infos.items():
+            match task:
+                case "clean":
+                    phases.append((task, infos.get("backupCount", len(infos["oldBackups"])), False))
+                case "file_backup":
+                    phases.append((task, infos.get("sourceBytes") or 0, True))
+                    if infos.get("manifest"):
+                        phases.append(("manifest", infos.get("sourceBytes") or 0, True)) # hashes the whole snapshot again
+                case "verify":
+                    if "file_backup" in self.task_infos:
+                        size = self.task_infos["file_backup"].get("sourceBytes") or 0
+                    elif infos.get("snapshot"):
+                        size = read_snapshot_meta(infos["snapshot"]).get("bytes") or 0
+                    else:
+                        size = 0
+                    phases.append((task, size * infos.get("sample", 1.0), True))
+        return phases
+
+    def finish_metrics(self, status):
+        """Ends the metrics of the run (history file and Prometheus textfile).
+
+        Args:
+            status (str): 'success', 'error' or 'stopped'.
+        """
+        try:
+            self.metrics.finish(status)
+        except Exception as e:
+            self.logger.warning(f"Couldn't write the run metrics: {e}")
+
+    def acquire_lease(self):
+        """Waits until this host may use the destination (other hosts backing up to it are queued)."""
+        infos = next((infos["lease"] for infos in self.task_infos.values() if isinstance(infos, dict) and infos.get("lease")), None)
+        if infos is None or not infos.get("root") or not os.path.isdir(infos["root"]):
+            return
+        resources = getattr(self.subprocesshandler, "resources", None)
+        self.lease = DestinationLease(infos["root"], infos["hostname"], slots=infos.get("slots", 1), bandwidth=infos.get("bandwidth", 0),
+                                      on_share=resources.set_shared_limit if resources else None)
+        def status(position, ahead):
+            self.update_text(f"Waiting for the destination, {position} ahead in the queue ({', '.join(ahead)})...", update=True)
+        if not self.lease.acquire(lambda: self.stop, status):
+            self.lease = None
+
+    def release_lease(self):
+        """Lets the next host in the queue use the destination."""
+        if self.lease is not None:
+            self.lease.release()
+            self.lease = None
 
     def clean(self):
-        """Deletes the contents of directories specified in `task_infos["clean"]`."""
+        """Deletes the contents of directories specified in `task_infos["clean"]`.
+
+        Old backups are moved to the trash and deleted in the background by the reaper, so the next tasks can start directly.
+        """
         self.update_text("Starting cleaning...")
         clean_paths = self.task_infos["clean"]["cleanPaths"]
         old_backup_paths = self.task_infos["clean"]["oldBackups"]
         try:
             #delete old backup data
-            self.update_text(f"Deleting {len(old_backup_paths)} old backups...")
-            if len(old_backup_paths) != 0:
-                for dir in old_backup_paths:
-                    result = self.subprocesshandler.delete(dir)
+            reclaim = self.task_infos["clean"].get("reclaimBytes", 0) / (1024 ** 3)
+            self.update_text(f"Deleting {self.task_infos['clean'].get('backupCount', len(old_backup_paths))} old backups ({reclaim:.2f} GB)...")
+            infos = self.task_infos["clean"]
+            self.reaper = Reaper(infos["trashDir"], threads=infos.get("reaperThreads", 4), rate=infos.get("reaperRate", 0))
+            for dir in self.reaper.trash(old_backup_paths):
+                result = self.subprocesshandler.delete(dir)
+            self.metrics.record("clean", backups=infos.get("backupCount", len(old_backup_paths)), reclaimable_bytes=infos.get("reclaimBytes", 0))
+            self.reaper.start() # also deletes what is left in the trash from earlier runs
             
             """ 
             #clean pc
@@ -90,6 +224,7 @@ class Executor:
             self.update_text("Cleaning ended successfull", "success")
         except Exception as e:
             self.global_error = True
+            self.task_error = True
             self.logger.error(f"Cleaning: {e}")
             self.update_text("An error occured on the 'Cleaning'-Task. See 'Task-Log.log' for detailed information.", "error")
 
@@ -154,57 +289,205 @@ class Executor:
         Shows live progress during copying.
         """
         self.update_text("Starting file backup...")
-        dest_dir = self.task_infos["file_backup"]["dstPath"]
-        backup_paths = self.task_infos["file_backup"]["backupPaths"]
+        infos = self.task_infos["file_backup"]
+        dest_dir = infos["dstPath"]
+        backup_paths = infos["backupPaths"]
+        started = datetime.now().isoformat(timespec="seconds")
         try:  
-            # make new backup
-            total_dirs_toBackup = len(backup_paths)
+            if infos.get("destMode") == "archive":
+                self.archive_backup(infos)
+                return
+            # resume an interrupted backup of today, the snapshot keeps the start of that run
+            journal = RunJournal(dest_dir)
+            resume = journal.load()
+            if resume:
+                started = journal.get_started() or started
+                self.update_text(f"Resuming the interrupted backup ({journal.count_done()} of {len(backup_paths)} sources done)...")
+            journal.start(started, resume=resume)
+            # make new backup, several sources at once
             self.update_text("---")
-            for dirNum, dir in enumerate(backup_paths):
-                if self.stop:
-                    return
-                with self.subprocesshandler.copy(dir, dest_dir) as process:
-                    total_files = sum(len(files) for _, _, files in os.walk(dir))
-                    copied_files = 0
-                    last_percent = -1 
-
-                    for line in process.stdout:
-                        #print(line)
-                        if re.search(r'\t[A-Z]:\\.*', line):  # robocopy: begins to copy new file
-                            copied_files += 1
-                        if '%' in line:
-                            percent = self.subprocesshandler.parse_progress(line, copied_files, total_files)
-                            if last_percent != percent:
-                                last_percent = percent
-                                self.update_text(f"Copying: {percent:.2f}% (Directory: {dirNum+1}/{total_dirs_toBackup})", update=True)
-                    for line in process.stderr:
-                        self.logger.error(f"copy: {line.strip()}")
-
-                    return_code = process.wait()
-                    self.logger.debug(f"Returncode is {return_code}.")
-                    msg = self.subprocesshandler.get_exitcode("backup", return_code)
-                    if msg:
-                        self.logger.debug(f"=> known!: {msg}")
-                    else:
-                        self.logger.warning(f"=> unknown!")
+            copier = ParallelCopier(self.subprocesshandler, self.update_text, lambda: self.stop, publish_callback=self.bus.publish,
+                                    max_parallel=infos.get("maxParallel", 1),
+                                    max_per_src_device=infos.get("maxPerSrcDevice", 1),
+                                    max_per_dst_device=infos.get("maxPerDstDevice", 1))
+            with self.metrics.phase("copy"):
+                return_codes = copier.copy_all(backup_paths, dest_dir, link_dest=infos.get("linkDest"), file_counts=infos.get("fileCounts"),
+                                               dirty_dirs=infos.get("dirtyDirs"), journal=journal, filters=infos.get("filters"),
+                                               source_bytes=infos.get("sourceSizes"))
+            self.record_transfer(infos)
             
             if not self.stop:       
+                # the change journal may only skip subtrees of a backup without failed files
+                complete = len(return_codes) == len(backup_paths) and not any(return_codes.values())
+                if complete:
+                    journal.complete()
+                self.write_meta(infos, started if complete else None)
+                with self.metrics.phase("manifest"):
+                    self.write_manifest(infos)
                 self.logger.info("File Backup ended successfull")
                 self.update_text(f"File Backup ended successfull", "success", update=True)
         
         except Exception as e:
             self.global_error = True
+            self.task_error = True
             self.logger.error(f"Backuping: {e}")
             self.update_text("An error occured on the 'file_backup'-Task. See 'Task-Log.log' for detailed information.", "error")
 
+    def archive_backup(self, infos):
+        """Streams all sources into one compressed archive (`dstPath`) instead of mirroring them.
+
+        Args:
+            infos (dict): Task details of the file backup.
+        """
+        def progress(event):
+            self.bus.publish(PercentEvent("file_backup", event["percent"]))
+            self.bus.publish(BytesEvent(infos["dstPath"], event["bytes"], event["total_bytes"]))
+            self.update_text(f"Archiving: {event['percent']:.2f}% ({event['files']} files)", update=True)
+
+        self.update_text("---")
+        writer = ArchiveWriter(infos["dstPath"], codec=infos.get("archiveCompression", "gzip"), level=infos.get("archiveLevel"),
+                               workers=infos.get("archiveWorkers"), stop_callback=lambda: self.stop, progress_callback=progress)
+        with self.metrics.phase("copy"):
+            rc = writer.write(infos["backupPaths"], total_bytes=infos.get("sourceBytes") or 0, filters=infos.get("filters"))
+        self.metrics.record("file_backup", bytes=writer.stats["bytes"], files=writer.stats["files"], compressed_bytes=writer.stats["compressed"],
+                            failed=writer.stats["failed"])
+        if rc == 23:
+            # the archive is kept, but the backup is incomplete
+            self.global_error = True
+            self.task_error = True
+            self.logger.error(f"Archiving: {writer.stats['failed']} entries couldn't be read.")
+            self.update_text(f"{writer.stats['failed']} entries couldn't be read, see 'Task-Log.log'.", "error")
+        if not self.stop:
+            self.write_meta(infos)
+            with self.metrics.phase("manifest"):
+                self.write_manifest(infos)
+            if rc != 23:
+                self.logger.info("File Backup ended successfull")
+                self.update_text("File Backup ended successfull", "success", update=True)
+
+    def write_meta(self, infos, started=None):
+        """Writes the metadata of the new snapshot, used by the retention policy to plan the deletion.
+
+        Args:
+            infos (dict): Task details of the file backup.
+            started (str, optional): Start of a complete copy (ISO format), the change journal compares with it.
+        """
+        meta = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "started": started,
+            "mode": infos.get("snapshotMode", "full"),
+            "bytes": infos.get("sourceBytes"),
+            "files": sum((infos.get("fileCounts") or {}).values()),
+        }
+        stats = getattr(self.subprocesshandler, "stats", None)
+        if infos.get("destMode") == "archive":
+            meta["mode"] = "archive"
+        elif stats is not None:
+            # the copy handlers know what was written (the rest was hard-linked)
+            meta["bytes_written"] = sum(stats.get(os.path.normpath(src), {}).get("bytes", 0) - stats.get(os.path.normpath(src), {}).get("reused", 0)
+                                      for src in infos["backupPaths"])
+        resources = getattr(self.subprocesshandler, "resources", None)
+        if resources is not None and infos.get("destMode") != "archive":
+            meta["resources"] = resources.get_stats()
+            self.logger.info(f"Copied with priority '{meta['resources']['priority']}', bandwidth limit "
+                             f"{meta['resources']['bandwidth_limit'] or 'none'} MB/s, {meta['resources']['throttled_seconds']:.1f}s throttled.")
+        try:
+            write_snapshot_meta(infos["dstPath"], meta)
+        except OSError as e:
+            self.logger.warning(f"Couldn't write snapshot metadata: {e}")
+
+    def wait_reaper(self):
+        """Waits until the reaper deleted the old backups (without rate limit, the copy is done)."""
+        if self.reaper is None:
+            return
+        if self.reaper.is_running() and not self.stop:
+            self.update_text("Waiting for old backups to be deleted...")
+            self.reaper.set_rate(0)
+        stats = self.reaper.wait()
+        self.metrics.record("clean", deleted_entries=stats["entries"], deleted_bytes=stats["bytes"], delete_seconds=round(stats["seconds"], 3))
+        if stats["errors"]:
+            self.update_text(f"{stats['errors']} entries of old backups couldn't be deleted, they are retried on the next run.", "warning")
+        self.reaper = None
+
+    def write_manifest(self, infos):
+        """Hashes the new snapshot into its manifest (files hard-linked from the previous snapshot reuse its hashes).
+
+        Args:
+            infos (dict): Task details of the file backup.
+        """
+        if not infos.get("manifest"):
+            return
+        def progress(done, total, files):
+            percent = 100 * done / total if total else 100
+            self.bus.publish(PercentEvent("manifest", percent))
+            self.update_text(f"Hashing: {percent:.2f}% ({files} files)", update=True)
+
+        self.bus.publish(PhaseStartedEvent("file_backup", "manifest"))
+        self.update_text("Creating the manifest of the backup...")
+        manifest = Manifest(threads=infos.get("hashThreads"), stop_callback=lambda: self.stop, progress_callback=progress)
+        stats = manifest.create(infos["dstPath"], previous=[infos["dstPath"], infos.get("linkDest")])
+        if stats:
+            self.metrics.record("file_backup", hashed_files=stats["hashed"])
+
+    def record_transfer(self, infos):
+        """Adds what the copy handler transferred for the sources of the backup to the metrics of the run.
+
+        Args:
+            infos (dict): Task details of the file backup.
+        """
+        stats = getattr(self.subprocesshandler, "stats", None) or {}
+        copied = [stats[os.path.normpath(src)] for src in infos["backupPaths"] if os.path.normpath(src) in stats]
+        self.metrics.record("file_backup", bytes=sum(s.get("bytes", 0) - s.get("reused", 0) for s in copied),
+                            reused_bytes=sum(s.get("reused", 0) for s in copied), files=sum(s.get("files", 0) for s in copied),
+                            linked_files=sum(s.get("linked", 0) for s in copied), failed=sum(s.get("failed", 0) for s in copied))
+
+    def verify(self):
+        """Re-hashes a backup and compares it with its manifest (all files or a random sample)."""
+        self.update_text("Starting verification...")
+        infos = self.task_infos["verify"]
+        try:
+            if not infos["snapshot"]:
+                raise FileNotFoundError("No backup with a manifest found.")
+            def progress(done, total, files):
+                percent = 100 * done / total if total else 100
+                self.bus.publish(PercentEvent("verify", percent))
+                self.update_text(f"Verifying: {percent:.2f}% ({files} files)", update=True)
+
+            sample = infos.get("sample", 1.0)
+            self.update_text(f"Verifying '{infos['snapshot']}'" + (f" (sample of {sample:.0%})..." if sample < 1.0 else "..."))
+            manifest = Manifest(threads=infos.get("threads"), stop_callback=lambda: self.stop, progress_callback=progress)
+            result = manifest.verify(infos["snapshot"], sample=sample)
+            if result is None:
+                return
+            self.metrics.record("verify", files=result.checked, problems=len(result.mismatched) + len(result.missing) + len(result.errors))
+            if result.is_ok():
+                self.update_text(f"Verification ended successfull ({result.checked} files checked)", "success")
+                return
+            self.global_error = True
+            self.task_error = True
+            self.update_text(f"Verification found problems: {len(result.mismatched)} changed, {len(result.missing)} missing, "
+                             f"{len(result.extra)} unknown, {len(result.errors)} unreadable files. See 'Task-Log.log' for the list.", "error")
+        except Exception as e:
+            self.global_error = True
+            self.task_error = True
+            self.logger.error(f"Verifying: {e}")
+            self.update_text("An error occured on the 'verify'-Task. See 'Task-Log.log' for detailed information.", "error")
+
     def start(self):
-        """Starts the task execution in a separate thread to keep the GUI responsive."""
+        """Starts the task execution in a separate thread to keep the GUI responsive.
+
+        Returns:
+            threading.Thread: The thread executing the tasks.
+        """
         executor_thread = threading.Thread(target=self.execute)
         executor_thread.start()
+        return executor_thread
 
     def stop_tasks(self):
         """Stops all running tasks."""
         self.logger.info("Stopping all tasks...")
         self.update_text("Stopping, please wait...", "warning")
+        self.stop = True # set first, so no new copy is started while the running ones are stopped
         self.subprocesshandler.stop_all_processes()
-        self.stop = True
\ No newline at end of file
+        if self.reaper:
+            self.reaper.stop()
\ No newline at end of file
@@ -2,8 +2,17 @@ from datetime import datetime
 import logging
 import os
 from pathlib import Path
-import yaml
-from dateutil import parser
+from config_store import ConfigStore
+from metadata_index import MetadataIndex
+from retention import RetentionPolicy, read_snapshot_meta
+from archive_writer import EXTENSIONS, get_codec
+from manifest import Manifest
+from resource_control import ResourceControl
+from change_journal import ChangeJournal
+from run_metrics import RunMetrics
+from run_journal import RunJournal
+from path_filter import PathFilter
+from tree_scanner import TreeScanner
 
 
 class FileHandler():
@@ -22,21 +31,54 @@ class FileHandler():
         basePath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.config_path = Path(basePath).joinpath("config.yaml")
         self.log_path =Path(basePath).joinpath("Task-Log.log")
+        self.index_path = Path(basePath).joinpath(f"index_{hostname}.sqlite")
+        self.journal_path = Path(basePath).joinpath(f"journal_{hostname}.json")
+        self.metrics_path = Path(basePath).joinpath(f"metrics_{hostname}.jsonl")
+        self.index = None
+        self.scanner = None
 
-        self.BACKUP_LIMIT = 3
         self.config_data = ""
+        self.store = None
+        self.filters = {} # patterns: compiled PathFilter
+        self.retention_plan = None
+        # per host overridable in 'config.yaml' under 'settings'
+        self.DEFAULT_SETTINGS = {
+            "max_parallel_copies": 4,
+            "max_copies_per_source_device": 1,
+            "max_copies_per_dest_device": 3,
+            "copy_backend": "shell", # 'shell' (rsync/robocopy) or 'native' (pure Python)
+            "snapshot_mode": "full", # 'full' or 'incremental' (hard-links unchanged files from the previous backup)
+            "retention": {"last": 3, "daily": 0, "weekly": 0, "monthly": 0, "yearly": 0}, # backups to keep (see retention.py)
+            "reaper_threads": 4, # threads deleting old backups in the background
+            "reaper_rate": 2000, # deleted files per second while the backup is copying, 0 for no limit
+            "dest_mode": "mirror", # 'mirror' (folder per backup) or 'archive' (one compressed tar per backup, see archive_writer.py)
+            "archive_compression": "gzip", # 'gzip', 'lzma', 'zstd' (needs 'zstandard') or 'none'
+            "archive_level": None, # compression level, None for the default of the codec
+            "archive_workers": None, # compressing processes, None for the number of CPUs
+            "manifest": True, # hash every backup into a manifest after copying (needed by the 'verify' task)
+            "verify_sample": 1.0, # share of the files checked by the 'verify' task, e.g. 0.05 for a quick check
+            "hash_threads": None, # threads hashing for the manifest and 'verify', None for min(16, 2 * CPUs)
+            "io_priority": "low", # CPU/IO priority of the copies: 'normal', 'low' (nice 10, best-effort 7) or 'idle'
+            "bandwidth_limit": 0, # MB/s of all copies together, 0 for no limit
+            "copy_timeout": 0, # minutes a single rsync/robocopy may run before it is stopped, 0 for no limit
+            "copy_idle_timeout": 0, # minutes rsync/robocopy may print nothing (e.g. hanging network share) before it is stopped, 0 for no limit
+            "compress": "auto", # rsync '-z': 'auto' (only for remote 'host:path' destinations), True or False
+            "dest_slots": 1, # hosts writing to the same destination at the same time, the others wait in a queue
+            "dest_bandwidth": 0, # MB/s of the destination shared equally by the writing hosts, 0 for no sharing
+            "exclude": [], # gitignore-style patterns excluded from every source, e.g. ['node_modules/', '.venv/', '*.pyc']
+            "source_exclude": {}, # source path: patterns for this source only (after the ones of 'exclude')
+            "metrics_textfile_dir": None, # directory of the node_exporter textfile collector for Prometheus metrics of every run
+            "schedule": None, # runs of 'main.py --daemon': {interval: hours, at: 'HH:MM' (optional), tasks: [...]}
+        }
     
     # ------------- YAML specific -----------------------------
 
     def parse_yaml(self):
-        """Parses the configuration YAML file and stores it in self.config_data.
+        """Parses the configuration YAML file (see config_store.py) and stores it in self.config_data.
         Creates it as a dict if not exists. """
         try:
-            if not os.path.isfile(self.config_path):
-                with open(self.config_path, "a") as file:
-                    yaml.dump({"hosts_map": []}, file)
-            with open(self.config_path, "r") as file:
-                self.config_data = yaml.safe_load(file)
+            self.store = ConfigStore(self.config_path)
+            self.config_data = self.store.load()
         except Exception as e:
             print(e)
             self.logger.error("Couldn't parse yaml.")
@@ -51,12 +93,8 @@ class FileHandler():
         if not isinstance(self.config_data, dict):
             self.logger.error("Error at the 'config.yaml' file! Delete the file to fix this.")
             exit()
-        for idx, host_dict in enumerate(self.config_data['hosts_map']):
-            if host_dict['hostname'] == self.hostname:
-                self.userDict = host_dict
-                self.userIndex = idx
-                return True 
-        return False
+        self.userDict = self.store.get_host(self.hostname)
+        return self.userDict is not None
     
     def get_userContent(self):
         """Extracts user-specific paths and information.
@@ -71,6 +109,16 @@ class FileHandler():
         
         return [self.info_dict, self.backupPaths_list, self.destPaths_list]
 
+    def get_settings(self):
+        """Returns the settings of the user, missing keys are filled with the defaults.
+
+        Returns:
+            dict: Settings from the 'settings' section of the host in 'config.yaml'.
+        """
+        settings = dict(self.DEFAULT_SETTINGS)
+        settings.update(self.userDict.get('settings') or {})
+        return settings
+
     def add_Host(self):
         """Adds a new host to the config data and writes it to the YAML file."""
         self.logger.debug(f"Adding new host entry for '{self.hostname}.")
@@ -89,11 +137,7 @@ class FileHandler():
         }
 
         self.userDict = new_host
-        if len(self.config_data['hosts_map']) > 0:
-            self.userIndex = self.config_data['hosts_map'][-1]
-        else:
-            self.userIndex = 0
-        self.config_data['hosts_map'].append(new_host)
+        self.store.add_host(new_host)
         self.write_yaml()
 
     def update_yaml(self, key_path, value, delete=False):
@@ -147,11 +191,10 @@ class FileHandler():
         return ref[last_key][index]
 
     def write_yaml(self):
-        """Writes the config data to the YAML file."""
+        """Writes the config data to the YAML file, only if something changed."""
         try:
-            with open(self.config_path, "w") as f:
-                yaml.safe_dump(self.config_data, f)
-            self.logger.info(f"Config written to '{self.config_path}'.")
+            if not self.store.save():
+                self.logger.debug("Config unchanged, not written.")
         except Exception as e:
             self.logger.error(f"write_yaml: {e}")
             raise e
@@ -211,30 +254,189 @@ class FileHandler():
         bool: True if yes, else false
         """
         self.backup_path = Path(self.destPath).joinpath(self.hostname, f"backup_{self.get_date()}")
-        if os.path.isdir(self.backup_path):
+        if os.path.isdir(self.backup_path) or any(os.path.isfile(f"{self.backup_path}{ext}") for ext in EXTENSIONS.values()):
             return True
         else:
             return False
 
+    def backup_isResumable(self):
+        """
+        Reports if the backup from today was interrupted (see run_journal.py), the next run continues it.
+
+        Returns:
+        bool: True if yes, else false
+        """
+        self.backup_path = Path(self.destPath).joinpath(self.hostname, f"backup_{self.get_date()}")
+        return os.path.isdir(self.backup_path) and RunJournal(self.backup_path).load()
+
     def create_backupPath(self):
         """Creates a backup directory path based on current date.
+        In archive mode only the host directory is created and the path of the archive is returned.
 
         Returns:
-            str: Full path to the backup directory.
+            str: Full path to the backup directory (or archive).
 
         Raises:
             Exception: If directory creation fails.
         """
         self.backup_path = Path(self.destPath).joinpath(self.hostname, f"backup_{self.get_date()}")
+        settings = self.get_settings()
         try:
+            if settings["dest_mode"] == "archive":
+                os.makedirs(self.backup_path.parent, exist_ok=True)
+                self.backup_path = Path(f"{self.backup_path}{EXTENSIONS[get_codec(settings['archive_compression'])]}")
+                return self.backup_path
             os.makedirs(self.backup_path, exist_ok=True)
         except Exception as e:
             self.logger.error(f"create_backup: {e}")
             raise e
         return self.backup_path
 
+    def get_retentionPolicy(self, prefix="backup"):
+        """Returns the retention policy of the user, missing counts are filled with the defaults.
+
+        Args:
+            prefix (str): Prefix of the backup folders.
+
+        Returns:
+            RetentionPolicy: Policy from the 'retention' setting.
+        """
+        retention = dict(self.DEFAULT_SETTINGS["retention"])
+        retention.update(self.get_settings().get("retention") or {})
+        return RetentionPolicy.from_settings(retention, prefix=prefix)
+
+    def get_resourceControl(self, os_type):
+        """Returns the resource control (priority, bandwidth limit, compression) of the copies of the user.
+
+        Args:
+            os_type (str): The operating system type ('linux' or 'windows').
+
+        Returns:
+            ResourceControl: Resource control from the 'io_priority', 'bandwidth_limit' and 'compress' settings.
+        """
+        return ResourceControl.from_settings(os_type, self.get_settings())
+
+    def get_copyTimeouts(self):
+        """Returns the timeouts of the rsync/robocopy processes.
+
+        Returns:
+            dict: 'timeout' and 'idle_timeout' in seconds (None for no limit), from the 'copy_timeout' and 'copy_idle_timeout' settings.
+        """
+        settings = self.get_settings()
+        return {"timeout": settings["copy_timeout"] * 60 or None, "idle_timeout": settings["copy_idle_timeout"] * 60 or None}
+
+    def get_runMetrics(self):
+        """Returns the metrics of a new run, appended to the history of this host when the run ends.
+
+        Returns:
+            RunMetrics: Metrics writing to 'metrics_<hostname>.jsonl' (and the textfile of the 'metrics_textfile_dir' setting).
+        """
+        return RunMetrics(self.hostname, history_path=self.metrics_path, textfile_dir=self.get_settings()["metrics_textfile_dir"])
+
+    def get_filters(self, path):
+        """Returns the include/exclude rules of a source: the 'exclude' setting followed by its 'source_exclude' entry.
+
+        Args:
+            path (str): Source path.
+
+        Returns:
+            PathFilter or None: Compiled rules, None if there are none.
+        """
+        settings = self.get_settings()
+        patterns = list(settings.get("exclude") or [])
+        for source, source_patterns in (settings.get("source_exclude") or {}).items():
+            if os.path.normpath(source) == os.path.normpath(path):
+                patterns += source_patterns or []
+        if not patterns:
+            return None
+        key = tuple(patterns)
+        if key not in self.filters:
+            self.filters[key] = PathFilter(patterns)
+        return self.filters[key]
+
+    def get_previous_backup(self, prefix="backup"):
+        """Returns the newest backup folder before the one of today.
+
+        Args:
+            prefix (str): Prefix of the backup folders.
+
+        Returns:
+            str or None: Path to the previous backup, None if there is none.
+        """
+        path = Path(self.destPath).joinpath(self.hostname)
+        if not os.path.isdir(path):
+            return None
+        today = datetime.now().date()
+        previous = [s for s in self.get_retentionPolicy(prefix).list_snapshots(path) if s.date < today and not s.is_archive]
+        if not previous:
+            return None
+        return previous[0].path
+
+    def get_leaseInfos(self):
+        """Returns the details of the destination lease, which coordinates the hosts sharing the destination.
+
+        Returns:
+            dict: 'root' (destination), 'hostname', 'slots' and 'bandwidth' (see locks.DestinationLease).
+        """
+        settings = self.get_settings()
+        return {"root": self.destPath, "hostname": self.hostname,
+                "slots": settings["dest_slots"], "bandwidth": settings["dest_bandwidth"]}
+
+    def get_dirtyDirs(self, backupDst, linkDest=None):
+        """Returns the directories changed since the last backup per source, from the journal of the watcher (`main.py --watch`).
+        The unchanged subtrees are kept from `backupDst` (complete backup of today) or else hard-linked from `linkDest`,
+        so the journal has to cover the time since the start of that backup. Sources it doesn't cover are scanned completely (None).
+
+        Args:
+            backupDst (str): Destination of the new backup.
+            linkDest (str, optional): Previous snapshot the new one hard-links from.
+
+        Returns:
+            dict: Source path as key and DirtySet (None for a full scan) as value, empty without usable journal.
+        """
+        if not os.path.isfile(self.journal_path):
+            return {}
+        meta = read_snapshot_meta(backupDst)
+        if not meta and os.path.isdir(backupDst) and os.listdir(backupDst):
+            self.logger.info("The backup of today is incomplete, scanning all sources.")
+            return {}
+        if not meta and linkDest:
+            meta = read_snapshot_meta(linkDest)
+        if not meta.get("started"):
+            return {} # nothing to take unchanged subtrees from, or from a backup that didn't finish cleanly
+        journal = ChangeJournal(self.journal_path)
+        if not journal.sync():
+            self.logger.info("The watcher isn't running (start it with 'main.py --watch'), scanning all sources.")
+            return {}
+        since = datetime.fromisoformat(meta["started"]).timestamp()
+        dirty = {path: journal.get_dirty(path, since) for path in self.backupPaths_list}
+        for path, dirs in dirty.items():
+            if dirs is None:
+                self.logger.info(f"Change journal: '{path}' isn't covered, scanning it completely.")
+            else:
+                self.logger.info(f"Change journal: {len(dirs)} directories of '{path}' changed since the last backup.")
+        return dirty
+
+    def get_verifiable_backup(self, prefix="backup"):
+        """Returns the newest backup with a manifest.
+
+        Args:
+            prefix (str): Prefix of the backup folders.
+
+        Returns:
+            str or None: Path to the backup, None if there is none.
+        """
+        path = Path(self.destPath).joinpath(self.hostname)
+        if not os.path.isdir(path):
+            return None
+        for snapshot in self.get_retentionPolicy(prefix).list_snapshots(path):
+            if os.path.isfile(Manifest.get_path(snapshot.path)):
+                return snapshot.path
+        return None
+
     def check_old_backups(self, prefix):
-        """Checks for outdated backup folders to delete.
+        """Checks for outdated backup folders to delete, according to the retention policy of the user.
+        The plan (with the reclaimable space) is stored in self.retention_plan.
 
         Args:
             prefix (str): Prefix of the backup folders.
@@ -244,34 +446,93 @@ class FileHandler():
         """
         path = Path(self.destPath).joinpath(self.hostname)
         self.logger.info(f"Now checking for old stuff to delete in '{path}' ...")
-        self.logger.debug(f"delete-prefix: {prefix}; num backups: {self.get_num_files(path)}")
-        to_delete_dirs = []
-        today = self.get_date()
-
+        policy = self.get_retentionPolicy(prefix)
+        self.retention_plan = policy.plan(path)
+        plan = self.retention_plan
+        self.logger.debug(f"delete-prefix: {prefix}; num backups: {len(plan.keep) + len(plan.delete)}; policy: {policy.counts}")
         for name in os.listdir(path):
-            #print(f"found in dir: {name}")
-            if name.endswith(".log"): #ignore logs
-                continue
-            full_path = os.path.join(path, name)
-            try:
-                date = parser.parse(name, fuzzy=True).date()
-            except Exception:
-                self.logger.warning(f"'{name}' has no date in it.")
-                continue
-
-            if name.startswith(prefix) and os.path.isdir(full_path):
-                to_delete_dirs.append((date, full_path))
-                if date.strftime("%Y-%m-%d") == today and any(Path(full_path).iterdir()): # ignore if newly created
-                    pass
-            elif os.path.isfile(full_path):
+            if os.path.isfile(os.path.join(path, name)) and not name.endswith(".log") and not name.startswith(f"{prefix}_"): #ignore logs and archives
                 self.logger.warning(f"Standalone file found in '{path}'. There shouldn't be any.")
 
-        to_delete_dirs.sort(reverse=True, key=lambda x: x[0])
-        to_delete_dirs = [path for _, path in to_delete_dirs[self.BACKUP_LIMIT:]]
-        self.logger.info(f"{len(to_delete_dirs)} dirs to be deleted saved in a list; will delete it short after.")
+        to_delete_dirs = [p for snapshot in plan.delete for p in snapshot.get_paths()]
+        unknown = f" (+{plan.unknown} backups without metadata)" if plan.unknown else ""
+        self.logger.info(f"{len(plan.delete)} backups to be deleted saved in a list; will delete it short after. "
+                         f"Reclaimable: {plan.reclaimable_bytes / (1024 ** 3):.2f} GB{unknown}.")
 
         return to_delete_dirs
 
+    def get_taskInfos(self, tasks):
+        """Builds the task details for the executor, same for GUI and headless runs.
+
+        Args:
+            tasks (list[str]): Names of the selected tasks ('clean', 'smartphone_backup',
+                'virus_scan', 'health_scan', 'file_backup', 'verify').
+
+        Returns:
+            dict: Task names as keys and their details as values, in execution order.
+        """
+        self.info_dict, self.backupPaths_list, self.destPaths_list = self.get_userContent()
+        backupDst = self.create_backupPath() #has to be called before check_old_backups()
+        settings = self.get_settings()
+        task_infos = {}
+        if "clean" in tasks:
+            task_infos["clean"] = {"cleanPaths": [],
+                                   "oldBackups": self.check_old_backups("backup"),
+                                   "backupCount": len(self.retention_plan.delete),
+                                   "reclaimBytes": self.retention_plan.reclaimable_bytes,
+                                   "trashDir": Path(self.destPath).joinpath(self.hostname, ".trash"),
+                                   "reaperThreads": settings["reaper_threads"],
+                                   "reaperRate": settings["reaper_rate"],
+                                   "lease": self.get_leaseInfos()
+                                   }
+        if "smartphone_backup" in tasks:
+            task_infos["smartphone_backup"] = {"None": "None"}
+        if "virus_scan" in tasks:
+            task_infos["virus_scan"] = {"None": "None"}
+        if "health_scan" in tasks:
+            task_infos["health_scan"] = {"None": "None"}
+        if "file_backup" in tasks:
+            linkDest = None
+            if settings["dest_mode"] == "archive":
+                if settings["snapshot_mode"] == "incremental":
+                    self.logger.info("Incremental snapshots aren't possible in archive mode. Making a full archive.")
+            elif settings["snapshot_mode"] == "incremental":
+                linkDest = self.get_previous_backup("backup")
+                if linkDest:
+                    self.logger.info(f"Incremental snapshot, hard-linking unchanged files from '{linkDest}'.")
+                else:
+                    self.logger.info("Incremental snapshot, but no previous backup found. Making a full copy.")
+            sourceSizes = {path: self.get_scanner().scan(path, filters=self.get_filters(path)).total_bytes for path in self.backupPaths_list}
+            task_infos["file_backup"] = {
+                "dstPath": backupDst,
+                "backupPaths": self.backupPaths_list,
+                "fileCounts": self.get_fileCounts(self.backupPaths_list),
+                "sourceBytes": sum(sourceSizes.values()),
+                "sourceSizes": sourceSizes,
+                "filters": {path: self.get_filters(path) for path in self.backupPaths_list},
+                "snapshotMode": "incremental" if linkDest else "full",
+                "linkDest": linkDest,
+                "dirtyDirs": self.get_dirtyDirs(backupDst, linkDest) if settings["dest_mode"] != "archive" else {},
+                "maxParallel": settings["max_parallel_copies"],
+                "maxPerSrcDevice": settings["max_copies_per_source_device"],
+                "maxPerDstDevice": settings["max_copies_per_dest_device"],
+                "destMode": settings["dest_mode"],
+                "archiveCompression": settings["archive_compression"],
+                "archiveLevel": settings["archive_level"],
+                "archiveWorkers": settings["archive_workers"],
+                "manifest": settings["manifest"],
+                "hashThreads": settings["hash_threads"],
+                "lease": self.get_leaseInfos()
+            }
+        if "verify" in tasks:
+            task_infos["verify"] = {
+                "snapshot": backupDst if "file_backup" in tasks else self.get_verifiable_backup("backup"),
+                "sample": settings["verify_sample"],
+                "threads": settings["hash_threads"],
+                "lease": self.get_leaseInfos()
+            }
+        return task_infos
+
     def norm(self, paths):
         """Normalizes file paths to UNIX Style. ("/")
 
@@ -317,8 +578,20 @@ class FileHandler():
             
         return path
 
+    def get_scanner(self):
+        """Returns the tree scanner of this session, opens the metadata index of this host on first use.
+
+        Returns:
+            TreeScanner: Scanner with session cache, backed by the metadata index.
+        """
+        if self.scanner is None:
+            self.index = MetadataIndex(self.index_path)
+            self.scanner = TreeScanner(index=self.index)
+        return self.scanner
+
     def get_size(self, path):
-        """Returns the size of a file or directory recursively.
+        """Returns the size of a file or directory recursively, without what its filters exclude.
+        Scanned once per session, only directories changed since the last session are listed.
 
         Args:
             path (str): Path to the file or directory.
@@ -326,23 +599,23 @@ class FileHandler():
         Returns:
             int: Size in GB.
         """
-        if os.path.isfile(path):
-            total_size = os.path.getsize(path)
-        elif os.path.isdir(path):
-            total_size = 0
-            for dirpath, dirnames, filenames in os.walk(path):
-                for f in filenames:
-                    fp = os.path.join(dirpath, f)
-                    try:
-                        total_size += os.path.getsize(fp)
-                    except FileNotFoundError:
-                        self.logger.info(f"get_size(): File not found (skipped): {fp}")
-                    except PermissionError:
-                        self.logger.info(f"get_size(): Permission denied (skipped): {fp}")
-        else:
+        if not os.path.exists(path):
             raise ValueError(f"Path '{path}' is neither a file nor a directory.")
+        total_size = self.get_scanner().scan(path, filters=self.get_filters(path)).total_bytes
         return total_size / (1024 * 1024 * 1024)  # Convert to GB
 
+    def get_fileCounts(self, paths):
+        """Returns the number of files of every path (from the scan of this session), without what its filters exclude.
+
+        Args:
+            paths (list[str]): Paths to files or directories.
+
+        Returns:
+            dict: Path as key and number of files as value.
+        """
+        scanner = self.get_scanner()
+        return {path: scanner.scan(path, filters=self.get_filters(path)).total_files for path in paths}
+
     # ------------------------------ Other -----------------------------
     def set_callback(self, callback):
         """Sets the callback function for updating text."""
@@ -0,0 +1,145 @@
+import sys
+import signal
+import logging
+
+from executor import Executor
+from progress_bus import ProgressBus, MessageEvent, EtaEvent, FinishedEvent
+from progress_model import format_eta
+from tools import get_copyHandler
+from file_handler import FileHandler
+from device_communicator import DeviceCommunicator
+
+
+class Headless:
+    """
+    Runs the backup tasks without a GUI (no tkinter, no screeninfo).
+    Loads the host profile like the View does and streams the progress of the Executor to stdout.
+    """
+    DEFAULT_TASKS = ["clean", "file_backup"]
+
+    def __init__(self, testing=False, tasks=None):
+        """
+        Initializes the headless runner by setting up logging and loading the host profile.
+
+        Args:
+            testing (bool): If True, sets the hostname to a test one for testing purposes.
+            tasks (list[str], optional): Tasks to execute. Defaults to the tasks preselected in the GUI.
+        """
+        dc = DeviceCommunicator()
+        if not testing:
+            self.hostname = dc.get_hostname()
+        else:
+            self.hostname = "test_win" if dc.get_os() == "windows" else "test_lin"
+        self.osType = dc.get_os()
+        self.userPath = dc.get_path("~")
+        self.tasks = tasks if tasks else self.DEFAULT_TASKS
+        self.filehandler = FileHandler(self.hostname, self.userPath)
+        self.filehandler.setup_logger()
+        self.logger = logging.getLogger(__name__)
+        self.filehandler.set_callback(self.update_log)
+        self.interactive = sys.stdout.isatty()
+        self.last_was_update = False
+        self.eta_text = None # progress of the whole run, appended to the progress lines
+
+        self.filehandler.parse_yaml()
+        if not self.filehandler.search_user():
+            self.logger.warning(f"Unknown Host '{self.hostname}'. A standard profile is created.")
+            self.filehandler.add_Host()
+        self.info_dict, self.backupPaths_list, self.destPaths_list = self.filehandler.get_userContent()
+
+    def update_log(self, text, tag=None, clear=False, update=False):
+        """
+        Prints a message to stdout.
+        Updates (e.g. progress) overwrite the current line when stdout is a terminal.
+        """
+        if clear:
+            return
+        prefix = f"[{tag}] " if tag else ""
+        if update and self.eta_text:
+            text = f"{text} | {self.eta_text}"
+        if self.interactive:
+            if update and self.last_was_update:
+                sys.stdout.write("\r\033[K")
+            elif self.last_was_update:
+                sys.stdout.write("\n")
+            sys.stdout.write(f"{prefix}{text}")
+            if not update:
+                sys.stdout.write("\n")
+        else:
+            sys.stdout.write(f"{prefix}{text}\n")
+        sys.stdout.flush()
+        self.last_was_update = update and self.interactive
+
+    def handle_event(self, event):
+        """Subscriber of the progress bus, prints the messages of the executor (progress lines with the ETA of the run)."""
+        if isinstance(event, MessageEvent):
+            self.update_log(event.text, tag=event.tag, clear=event.clear, update=event.update)
+        elif isinstance(event, EtaEvent):
+            self.eta_text = format_eta(event)
+        elif isinstance(event, FinishedEvent):
+            self.update_rdy()
+
+    def update_rdy(self):
+        """The tasks are finished."""
+        if self.last_was_update:
+            sys.stdout.write("\n")
+            self.last_was_update = False
+
+    def run(self):
+        """
+        Prepares the task infos, runs the executor and waits for it to finish.
+        SIGINT/SIGTERM stop the running tasks like the stop button in the GUI does.
+
+        Returns:
+            int: Exit code (0 = success, 1 = a task failed, 130 = stopped).
+        """
+        if not self.destPaths_list or not self.info_dict.get("last_selected_dest"):
+            self.logger.error("No destination configured for this host.")
+            return 1
+        metrics = self.filehandler.get_runMetrics()
+        try:
+            with metrics.phase("prepare"):
+                task_infos = self.filehandler.get_taskInfos(self.tasks)
+        except Exception as e:
+            self.logger.error(f"run: {e}")
+            self.update_log("Error at preparing. See 'Task-Log.log' for more information.", "error")
+            return 1
+        self.update_log("Successfully prepared everything.", "success")
+
+        self.subprocesshandler = get_copyHandler(self.osType, self.filehandler.get_settings()["copy_backend"],
+                                                 self.filehandler.get_resourceControl(self.osType), **self.filehandler.get_copyTimeouts())
+        self.bus = ProgressBus()
+        self.bus.subscribe(self.handle_event)
+        self.executor = Executor(self.subprocesshandler, self.bus)
+        self.executor.set_details(task_infos)
+        self.executor.set_metrics(metrics)
+        stopped = []
+
+        def handle_signal(signum, frame):
+            stopped.append(signum)
+            self.executor.stop_tasks()
+
+        signal.signal(signal.SIGINT, handle_signal)
+        signal.signal(signal.SIGTERM, handle_signal)
+        thread = self.executor.start()
+        while thread.is_alive():
+            thread.join(0.5)
+
+        if stopped:
+            return 130
+        return 1 if self.executor.global_error else 0
+
+    def watch(self):
+        """
+        Runs the change watcher for the backup sources of this host until SIGINT/SIGTERM (Linux only).
+        Later backups scan only the directories it recorded as changed.
+
+        Returns:
+            int: Exit code (0 = stopped normally, 1 = not possible).
+        """
+        if self.osType != "linux":
+            self.logger.error("The change watcher needs inotify (Linux).")
+            return 1
+        from change_journal import ChangeWatcher
+        self.update_log(f"Watching the backup sources of '{self.hostname}', stop with Ctrl+C.")
+        return ChangeWatcher(self.filehandler.journal_path, self.backupPaths_list).run()
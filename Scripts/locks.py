@@ -0,0 +1,329 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+
+
+def is_process_running(pid):
+    """
+    Checks if a process with this PID exists on this computer.
+
+    Args:
+        pid (int): The process ID.
+
+    Returns:
+        bool: True if it runs (or belongs to another user).
+    """
+    if pid == os.getpid():
+        return True
+    if os.name == "nt": # os.kill would terminate the process on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid) # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259 # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True # belongs to another user
+    return True
+
+
+class PidLock:
+    """
+    Lock file holding the PID of its owner, created atomically with O_EXCL.
+    A lock whose process doesn't run anymore (crash, reboot) is stale and taken over.
+    """
+
+    def __init__(self, path):
+        """
+        Initializes the PidLock.
+
+        Args:
+            path (str): Path of the lock file.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.path = str(path)
+        self.locked = False
+
+    def acquire(self):
+        """
+        Takes the lock.
+
+        Returns:
+            bool: True if the lock was taken, False if another running process holds it.
+        """
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                pid = self.get_owner()
+                if pid is not None and is_process_running(pid):
+                    return False
+                self.logger.info(f"Removing stale lock '{self.path}' (process {pid} isn't running).")
+                try:
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(str(os.getpid()))
+            self.locked = True
+            return True
+        return False
+
+    def release(self):
+        """Removes the lock file if this process holds it."""
+        if self.locked and self.get_owner() == os.getpid():
+            os.remove(self.path)
+        self.locked = False
+
+    def get_owner(self):
+        """
+        Returns the PID written in the lock file.
+
+        Returns:
+            int or None: The PID, None if the file is missing or unreadable.
+        """
+        try:
+            with open(self.path, "r") as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def __enter__(self):
+        if not self.acquire():
+            raise RuntimeError(f"'{self.path}' is locked by process {self.get_owner()}.")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class DestinationLease:
+    """
+    Coordinates several computers backing up to the same destination (e.g. one external SSD for all hosts).
+
+    Every host waiting for the destination puts a ticket into the queue directory `<destination>/.backup_lease/queue`
+    (named by time, so the queue is first come, first served). The first `slots` hosts of the queue may write: each
+    of them takes a free slot file with O_EXCL, which guarantees the exclusion even if the clocks of the hosts differ.
+    Tickets and slots contain a heartbeat counter increased every `HEARTBEAT` seconds. An entry whose counter didn't
+    change for `STALE_AFTER` seconds (measured with the own clock, so it works across computers) or whose process
+    doesn't run anymore on this computer is stale and removed by the next waiting host.
+    With a bandwidth for the destination, the hosts writing at the same time share it equally.
+    """
+    DIR = ".backup_lease"
+    HEARTBEAT = 10 # seconds
+    STALE_AFTER = 60 # seconds without heartbeat
+    POLL = 2 # seconds between two checks of the queue
+
+    def __init__(self, dest_root, hostname, slots=1, bandwidth=0, on_share=None):
+        """
+        Initializes the DestinationLease.
+
+        Args:
+            dest_root (str): Root of the destination (shared by the hosts).
+            hostname (str): Name of this host in 'config.yaml'.
+            slots (int): Number of hosts that may write at the same time.
+            bandwidth (float): MB/s of the destination shared by the writing hosts, 0 for no sharing.
+            on_share (callable, optional): Called with the MB/s share of this host whenever it changes.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.dir = os.path.join(str(dest_root), self.DIR)
+        self.queue_dir = os.path.join(self.dir, "queue")
+        self.hostname = hostname
+        self.slots = max(1, int(slots))
+        self.bandwidth = bandwidth or 0
+        self.on_share = on_share
+        self.node = socket.gethostname()
+        self.ticket = None
+        self.slot = None
+        self.beat = 0
+        self.share = None
+        self.seen = {} # path: (heartbeat, monotonic time it was first seen)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def acquire(self, stop_callback=None, status_callback=None):
+        """
+        Queues this host and waits until it may write to the destination.
+
+        Args:
+            stop_callback (callable, optional): Returns True to give up waiting.
+            status_callback (callable, optional): Called with the position in the queue and the hosts ahead while waiting.
+
+        Returns:
+            bool: True if the lease is held, False if stopped while waiting.
+        """
+        stop_callback = stop_callback or (lambda: False)
+        os.makedirs(self.queue_dir, exist_ok=True)
+        name = f"{time.time_ns():020d}_{self.hostname}_{os.getpid()}.json"
+        self.ticket = os.path.join(self.queue_dir, name)
+        self._write(self.ticket, exclusive=True)
+        last_beat = time.monotonic()
+        last_status = None
+        while not stop_callback():
+            if time.monotonic() - last_beat >= self.HEARTBEAT:
+                self._beat(self.ticket)
+                last_beat = time.monotonic()
+            busy = self._live_entries(self.dir, prefix="slot_") # ages the slots too, while waiting in the queue
+            queue = self._live_entries(self.queue_dir)
+            position = queue.index(name) if name in queue else len(queue)
+            if position < self.slots and self._take_slot(busy):
+                self.logger.info(f"Got the destination lease (slot {self.slot}).")
+                self.thread = threading.Thread(target=self._heartbeat, daemon=True)
+                self.thread.start()
+                self._update_share()
+                return True
+            ahead = [self._read(os.path.join(self.queue_dir, entry)).get("host", "?") for entry in queue[:position]]
+            if status_callback and (position, ahead) != last_status:
+                status_callback(position, ahead)
+                last_status = (position, ahead)
+            time.sleep(self.POLL)
+        self._remove(self.ticket)
+        self.ticket = None
+        return False
+
+    def release(self):
+        """Gives the destination to the next host in the queue."""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        for path in (self.slot_path() if self.slot is not None else None, self.ticket):
+            if path:
+                self._remove(path)
+        self.slot = None
+        self.ticket = None
+
+    def slot_path(self, slot=None):
+        """Returns the path of a slot file (default: the own slot)."""
+        return os.path.join(self.dir, f"slot_{self.slot if slot is None else slot}.lock")
+
+    # ----------------------------- helpers -----------------------------
+
+    def _take_slot(self, busy):
+        """Tries to take a slot that isn't in `busy` (the live slot files)."""
+        for slot in range(self.slots):
+            if f"slot_{slot}.lock" in busy:
+                continue
+            try:
+                self._write(self.slot_path(slot), exclusive=True)
+            except FileExistsError:
+                continue # taken in the meantime
+            self.slot = slot
+            return True
+        return False
+
+    def _live_entries(self, directory, prefix=""):
+        """
+        Lists the entries of a directory without the stale ones, which are removed.
+
+        Returns:
+            list[str]: Sorted names of the live entries.
+        """
+        live = []
+        now = time.monotonic()
+        try:
+            names = sorted(name for name in os.listdir(directory) if name.startswith(prefix) and not name.endswith(".tmp"))
+        except FileNotFoundError:
+            return live
+        for name in names:
+            path = os.path.join(directory, name)
+            if path in (self.ticket, self.slot_path() if self.slot is not None else None):
+                live.append(name)
+                continue
+            data = self._read(path)
+            beat = data.get("beat")
+            previous = self.seen.get(path)
+            if previous is None or previous[0] != beat:
+                self.seen[path] = (beat, now) # new or changed: alive
+                first_seen = now
+            else:
+                first_seen = previous[1]
+            dead = data.get("node") == self.node and data.get("pid") and not is_process_running(data["pid"])
+            if dead or now - first_seen > self.STALE_AFTER:
+                self.logger.warning(f"Removing stale lease entry '{name}' of '{data.get('host', '?')}'.")
+                self._remove(path, expected=data)
+                self.seen.pop(path, None)
+                continue
+            live.append(name)
+        return live
+
+    def _heartbeat(self):
+        """Keeps ticket and slot alive while the lease is held (thread) and updates the bandwidth share."""
+        while not self.stop_event.wait(self.HEARTBEAT):
+            for path in (self.ticket, self.slot_path()):
+                if self._read(path).get("pid") != os.getpid():
+                    self.logger.warning(f"The lease entry '{path}' was taken over by another host (no heartbeat for too long).")
+                    continue
+                self._beat(path)
+            self._update_share()
+
+    def _update_share(self):
+        """Divides the bandwidth of the destination by the number of writing hosts."""
+        if not self.bandwidth or not self.on_share:
+            return
+        writers = max(1, len(self._live_entries(self.dir, prefix="slot_")))
+        share = self.bandwidth / writers
+        if share != self.share:
+            self.share = share
+            self.logger.info(f"{writers} hosts write to the destination, using {share:.1f} MB/s.")
+            self.on_share(share)
+
+    def _write(self, path, exclusive=False):
+        """Writes an entry (host, computer, PID, heartbeat counter)."""
+        data = json.dumps({"host": self.hostname, "node": self.node, "pid": os.getpid(), "beat": self.beat,
+                           "since": time.time()})
+        if exclusive:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            with os.fdopen(fd, "w") as f:
+                f.write(data)
+        else:
+            with open(path + ".tmp", "w") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+
+    def _beat(self, path):
+        """Increases the heartbeat counter of an own entry."""
+        self.beat += 1
+        try:
+            self._write(path)
+        except OSError as e:
+            self.logger.warning(f"Couldn't update the lease entry '{path}' ({e}).")
+
+    def _read(self, path):
+        """Reads an entry, empty dict if missing or being written."""
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _remove(self, path, expected=None):
+        """
+        Removes an entry. With `expected` only if it still has that content: it is renamed away first (atomic) and
+        put back if another host recreated it in the meantime.
+        """
+        try:
+            if expected is None:
+                os.remove(path)
+                return
+            private = f"{path}.{self.node}.{os.getpid()}.tmp"
+            os.replace(path, private)
+            data = self._read(private)
+            if data and (data.get("pid"), data.get("node")) != (expected.get("pid"), expected.get("node")):
+                try:
+                    os.link(private, path) # fails if the slot was taken again
+                except OSError:
+                    pass
+            os.remove(private)
+        except FileNotFoundError:
+            pass
@@ -1,26 +1,55 @@
+import os
+import sys
 import argparse
-from view import View
 
 
 
 parser = argparse.ArgumentParser(description='A Backup Program.')
 parser.add_argument('--test', action='store_true', help="Activates test mode by setting the hostname to either 'test_win' or 'test_lin'.")
-parser.add_argument('--fast', action='store_true', help='Actibvates fast mode by making backups tasks directly')
-args = parser.parse_args()
+parser.add_argument('--fast', action='store_true', help='Activates fast mode by executing the backup tasks directly without GUI (headless).')
+parser.add_argument('--tasks', nargs='+', choices=["clean", "smartphone_backup", "virus_scan", "health_scan", "file_backup", "verify"],
+                    help="Tasks to execute in fast mode. Defaults to 'clean file_backup'.")
+parser.add_argument('--daemon', action='store_true', help="Runs the tasks periodically without GUI, following the host's 'schedule' setting.")
+parser.add_argument('--watch', action='store_true', help='Runs the change watcher (Linux), later backups only scan the changed directories.')
+parser.add_argument('--profile', action='store_true', help="Profiles the run with cProfile, writes 'profile_<time>.prof/.json' next to the log.")
+parser.add_argument('--profile-memory', action='store_true', help='Like --profile, but also traces the memory allocations (tracemalloc).')
 
 
 
 if __name__ == "__main__":
-    if args.test:
-        # Test mode
-        view = View(testing=True)
-        view.start()
-    elif args.fast:
-        # Fast mode
-        raise NotImplementedError("Fast mode is not implemented yet.")
-        view = View(fast=True)
-        view.start()
-    else:
-        # Normal mode
-        view = View()
-        view.start()
\ No newline at end of file
+    args = parser.parse_args() # not on import (the compressing processes of the archive mode import this module on Windows)
+    profiler = None
+    if args.profile or args.profile_memory:
+        from profiler import Profiler
+        profiler = Profiler(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), memory=args.profile_memory)
+        profiler.start() # before the imports below, they are part of the startup
+    code = 0
+    try:
+        if args.daemon:
+            from scheduler import Scheduler
+            scheduler = Scheduler(testing=args.test)
+            code = scheduler.run()
+        elif args.watch:
+            from headless import Headless
+            headless = Headless(testing=args.test)
+            code = headless.watch()
+        elif args.fast:
+            # Fast mode (no tkinter/screeninfo imports)
+            from headless import Headless
+            headless = Headless(testing=args.test, tasks=args.tasks)
+            code = headless.run()
+        elif args.test:
+            # Test mode
+            from view import View
+            view = View(testing=True)
+            view.start()
+        else:
+            # Normal mode
+            from view import View
+            view = View()
+            view.start()
+    finally:
+        if profiler:
+            profiler.stop()
+            profiler.report()
+    sys.exit(code)
@@ -0,0 +1,327 @@
+import os
+import json
+import mmap
+import stat
+import time
+import random
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+
+class VerifyResult:
+    """
+    Result of a verification.
+
+    Attributes:
+        snapshot (str): Verified snapshot.
+        checked (int): Number of hashed files.
+        bytes (int): Hashed bytes.
+        mismatched (list[str]): Files whose content differs from the manifest.
+        missing (list[str]): Files of the manifest missing in the snapshot.
+        extra (list[str]): Files in the snapshot missing in the manifest (only without sampling).
+        errors (list[str]): Files that couldn't be read.
+        seconds (float): Duration of the verification.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.checked = 0
+        self.bytes = 0
+        self.mismatched = []
+        self.missing = []
+        self.extra = []
+        self.errors = []
+        self.seconds = 0.0
+
+    def is_ok(self):
+        """Returns True if no problem was found."""
+        return not (self.mismatched or self.missing or self.extra or self.errors)
+
+
+class Manifest:
+    """
+    Checksummed list of the files of a snapshot (relative path, size, mtime, inode, blake2b), stored as JSON lines
+    in the snapshot ('.manifest.jsonl') or next to an archive ('<archive>.manifest.jsonl').
+
+    Files are hashed by a thread pool (hashlib releases the GIL), big files through `mmap`, so hashing runs at disk
+    speed instead of single-core speed. Files hard-linked from the previous snapshot (same inode, size and mtime)
+    take their hash from its manifest instead of being read again.
+    """
+    FILE = ".manifest.jsonl"
+    SKIP = {".manifest.jsonl", ".snapshot.json", ".run_journal.json"} # own files in the root of a snapshot
+    MMAP_MIN_SIZE = 8 * 1024 * 1024
+    CHUNK_SIZE = 64 * 1024 * 1024
+    PROGRESS_INTERVAL = 0.2
+
+    def __init__(self, threads=None, stop_callback=None, progress_callback=None):
+        """
+        Initializes the Manifest.
+
+        Args:
+            threads (int, optional): Number of hashing threads. Defaults to min(16, 2 * CPUs).
+            stop_callback (callable, optional): Returns True if the operation should stop.
+            progress_callback (callable, optional): Called with (done bytes, total bytes, done files).
+        """
+        self.logger = logging.getLogger(__name__)
+        self.threads = threads or min(16, (os.cpu_count() or 1) * 2)
+        self.stop_callback = stop_callback or (lambda: False)
+        self.progress_callback = progress_callback
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get_path(cls, snapshot_path):
+        """
+        Returns the path of the manifest of a snapshot: inside a directory, next to an archive.
+
+        Args:
+            snapshot_path (str): Path of the snapshot.
+
+        Returns:
+            str: Path of the manifest.
+        """
+        snapshot_path = str(snapshot_path)
+        if os.path.isdir(snapshot_path):
+            return os.path.join(snapshot_path, cls.FILE)
+        return snapshot_path + cls.FILE
+
+    @classmethod
+    def load(cls, snapshot_path):
+        """
+        Reads the manifest of a snapshot.
+
+        Args:
+            snapshot_path (str): Path of the snapshot.
+
+        Returns:
+            dict: Relative path as key and the entry (size, mtime_ns, inode, hash) as value, empty if there is no manifest.
+        """
+        entries = {}
+        try:
+            with open(cls.get_path(snapshot_path), "r", encoding="utf-8") as f:
+                next(f, None) # header
+                for line in f:
+                    entry = json.loads(line)
+                    entries[entry.pop("path")] = entry
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def create(self, snapshot_path, previous=None):
+        """
+        Hashes all files of a snapshot and writes its manifest.
+
+        Args:
+            snapshot_path (str): Snapshot directory (or archive).
+            previous (list[str], optional): Snapshots whose manifests are reused for unchanged hard-linked files.
+
+        Returns:
+            dict: Statistics (files, bytes, hashed, reused, seconds), None if stopped.
+        """
+        start = time.monotonic()
+        snapshot_path = str(snapshot_path)
+        files = self._list_files(snapshot_path)
+        known = {}
+        for path in previous or []:
+            if path and os.path.exists(path):
+                for rel, entry in self.load(path).items():
+                    known.setdefault(rel, entry)
+
+        entries = {}
+        to_hash = []
+        for rel, full, st in files:
+            entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "inode": st.st_ino}
+            old = known.get(rel)
+            if old and st.st_ino and all(old.get(key) == entry[key] for key in ("size", "mtime_ns", "inode")):
+                entry["hash"] = old["hash"]
+            else:
+                to_hash.append((rel, full, st.st_size))
+            entries[rel] = entry
+
+        hashes = self._hash_all(to_hash)
+        if hashes is None:
+            return None
+        for rel, digest in hashes.items():
+            if digest is None:
+                entries.pop(rel) # unreadable, reported by _hash_all
+            else:
+                entries[rel]["hash"] = digest
+
+        manifest_path = self.get_path(snapshot_path)
+        with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(json.dumps({"version": 1, "algorithm": "blake2b-256", "created": datetime.now().isoformat(timespec="seconds")}) + "\n")
+            for rel in sorted(entries):
+                f.write(json.dumps({"path": rel, **entries[rel]}) + "\n")
+        os.replace(manifest_path + ".tmp", manifest_path)
+        stats = {"files": len(entries), "bytes": sum(entry["size"] for entry in entries.values()),
+                 "hashed": len(to_hash), "reused": len(files) - len(to_hash), "seconds": time.monotonic() - start}
+        self.logger.info(f"Manifest of '{snapshot_path}': {stats['files']} files, {stats['hashed']} hashed, "
+                         f"{stats['reused']} taken from the previous manifest, in {stats['seconds']:.1f}s.")
+        return stats
+
+    def verify(self, snapshot_path, sample=1.0):
+        """
+        Re-hashes a snapshot and compares it with its manifest.
+
+        Args:
+            snapshot_path (str): Snapshot directory (or archive).
+            sample (float): Share of the files to check (chosen randomly), 1.0 checks everything.
+
+        Returns:
+            VerifyResult: The found problems, None if stopped.
+        """
+        start = time.monotonic()
+        snapshot_path = str(snapshot_path)
+        result = VerifyResult(snapshot_path)
+        entries = self.load(snapshot_path)
+        if not entries:
+            raise FileNotFoundError(f"'{snapshot_path}' has no manifest.")
+        names = sorted(entries)
+        if sample < 1.0:
+            names = random.sample(names, max(1, round(len(names) * sample)))
+        else:
+            present = {rel for rel, _, _ in self._list_files(snapshot_path)}
+            result.extra = sorted(present.difference(entries))
+
+        to_hash = []
+        for rel in names:
+            full = self._full_path(snapshot_path, rel)
+            try:
+                st = os.stat(full)
+            except FileNotFoundError:
+                result.missing.append(rel)
+                continue
+            except OSError as e:
+                result.errors.append(f"{rel}: {e}")
+                continue
+            if st.st_size != entries[rel]["size"]:
+                result.mismatched.append(rel)
+                continue
+            to_hash.append((rel, full, st.st_size))
+
+        hashes = self._hash_all(to_hash)
+        if hashes is None:
+            return None
+        for rel, full, size in to_hash:
+            digest = hashes[rel]
+            if digest is None:
+                result.errors.append(rel)
+            elif digest != entries[rel]["hash"]:
+                result.mismatched.append(rel)
+            result.checked += 1
+            result.bytes += size
+        result.seconds = time.monotonic() - start
+        self.logger.info(f"Verified {result.checked} files ({result.bytes / (1024 * 1024):.1f} MB) of '{snapshot_path}' in "
+                         f"{result.seconds:.1f}s: {len(result.mismatched)} mismatched, {len(result.missing)} missing, "
+                         f"{len(result.extra)} not in the manifest, {len(result.errors)} unreadable.")
+        for kind in ("mismatched", "missing", "extra", "errors"):
+            for rel in getattr(result, kind):
+                self.logger.warning(f"verify: {kind}: {rel}")
+        return result
+
+    # ----------------------------- helpers -----------------------------
+
+    def _full_path(self, snapshot_path, rel):
+        """Returns the path of a manifest entry (an archive has only itself as entry)."""
+        if os.path.isdir(snapshot_path):
+            return os.path.join(snapshot_path, *rel.split("/"))
+        return snapshot_path
+
+    def _list_files(self, snapshot_path):
+        """
+        Lists the regular files of a snapshot.
+
+        Returns:
+            list[tuple]: (relative path with '/', full path, stat_result)
+        """
+        if not os.path.isdir(snapshot_path):
+            return [(os.path.basename(snapshot_path), snapshot_path, os.stat(snapshot_path))]
+        files = []
+        stack = [(snapshot_path, "")]
+        while stack:
+            path, rel_dir = stack.pop()
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if not rel_dir and entry.name in self.SKIP:
+                            continue
+                        rel = f"{rel_dir}{entry.name}"
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append((entry.path, rel + "/"))
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                        if stat.S_ISREG(st.st_mode):
+                            # DirEntry.stat has no inode on Windows
+                            files.append((rel, entry.path, st if st.st_ino else os.stat(entry.path)))
+            except OSError as e:
+                self.logger.warning(f"manifest: skipped '{path}' ({e})")
+        return files
+
+    def _hash_all(self, files):
+        """
+        Hashes files in the thread pool.
+
+        Args:
+            files (list[tuple]): (relative path, full path, size)
+
+        Returns:
+            dict: Relative path as key and hex digest (None if unreadable) as value, None if stopped.
+        """
+        self.done = [0, 0]
+        self.total = sum(size for _, _, size in files)
+        self.last_event = 0.0
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            digests = list(pool.map(lambda item: self._hash_file(item[1], item[2]), files))
+        if self.stop_callback():
+            return None
+        self._report(force=True)
+        return {rel: digest for (rel, _, _), digest in zip(files, digests)}
+
+    def _hash_file(self, path, size):
+        """Returns the blake2b hex digest of a file, big files are read through mmap."""
+        if self.stop_callback():
+            return None
+        digest = hashlib.blake2b(digest_size=32)
+        try:
+            with open(path, "rb") as f:
+                if size >= self.MMAP_MIN_SIZE:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        view = memoryview(mm)
+                        try:
+                            for offset in range(0, len(mm), self.CHUNK_SIZE):
+                                if self.stop_callback():
+                                    return None
+                                digest.update(view[offset:offset + self.CHUNK_SIZE])
+                                self._add_bytes(min(self.CHUNK_SIZE, len(mm) - offset), 0)
+                        finally:
+                            view.release()
+                else:
+                    data = f.read()
+                    digest.update(data)
+                    self._add_bytes(len(data), 0)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"manifest: couldn't read '{path}' ({e})")
+            return None
+        self._add_bytes(0, 1)
+        return digest.hexdigest()
+
+    def _add_bytes(self, n, files):
+        """Counts hashed bytes and files and reports the progress."""
+        with self.lock:
+            self.done[0] += n
+            self.done[1] += files
+        self._report()
+
+    def _report(self, force=False):
+        """Calls the progress callback, at most every `PROGRESS_INTERVAL` seconds."""
+        if not self.progress_callback:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self.last_event < self.PROGRESS_INTERVAL:
+                return
+            self.last_event = now
+            done_bytes, done_files = self.done
+        self.progress_callback(done_bytes, self.total, done_files)
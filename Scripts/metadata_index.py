@@ -0,0 +1,195 @@
+import os
+import time
+import logging
+import sqlite3
+import threading
+
+
+class MetadataIndex:
+    """
+    Persistent index of the backup sources (SQLite, one file per host next to the 'config.yaml').
+    Stores size, mtime and inode of every file and the mtime of every directory.
+    Paths are stored as bytes (`os.fsencode`), so file names that aren't valid UTF-8 can be indexed too.
+
+    The TreeScanner only lists directories whose mtime changed since the last scan (a file was added, removed or renamed).
+    Files changed in place don't touch the mtime of their directory, so their size is updated when their directory
+    changes next time or with the full scan of their source, which is due every `FULL_SCAN_DAYS` days.
+    """
+    VERSION = 2 # schema version, older indexes are rebuilt
+    FULL_SCAN_DAYS = 7
+
+    def __init__(self, db_path):
+        """
+        Opens (and creates if missing) the index.
+
+        Args:
+            db_path (str): Path to the SQLite file.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.db_path = str(db_path)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            if self.conn.execute("PRAGMA user_version").fetchone()[0] < self.VERSION:
+                # paths were stored as text before, the index is only a cache, so it is built again
+                for table in ("dirs", "files", "roots"):
+                    self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+                self.conn.execute(f"PRAGMA user_version = {self.VERSION}")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS dirs (path BLOB PRIMARY KEY, parent BLOB, mtime_ns INTEGER)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS files (path BLOB PRIMARY KEY, dir BLOB, size INTEGER, mtime_ns INTEGER, inode INTEGER)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS roots (path BLOB PRIMARY KEY, full_scan REAL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS files_dir ON files (dir)")
+
+    def _subtree(self, path):
+        """
+        Returns the bounds to select everything below a path with a range query (faster than LIKE and no escaping).
+
+        Args:
+            path (str): Directory path.
+
+        Returns:
+            tuple[bytes, bytes]: Lower (inclusive) and upper (exclusive) bound.
+        """
+        sep = os.sep.encode()
+        base = os.fsencode(path)
+        base = base if base.endswith(sep) else base + sep
+        return base, base[:-1] + bytes([sep[0] + 1])
+
+    def needs_full_scan(self, root):
+        """
+        Returns if a source is due for a full scan (never fully scanned or longer ago than `FULL_SCAN_DAYS`).
+
+        Args:
+            root (str): Source path.
+
+        Returns:
+            bool: True if every directory of the source should be listed again.
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT full_scan FROM roots WHERE path = ?", (os.fsencode(root),)).fetchone()
+        return row is None or time.time() - row[0] > self.FULL_SCAN_DAYS * 24 * 3600
+
+    def set_full_scan(self, root):
+        """
+        Stores that a source was fully scanned now.
+
+        Args:
+            root (str): Source path.
+        """
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO roots VALUES (?, ?)", (os.fsencode(root), time.time()))
+
+    def get_dir(self, path, mtime_ns):
+        """
+        Returns the indexed content of a directory if it is unchanged.
+
+        Args:
+            path (str): Directory path.
+            mtime_ns (int): Current mtime of the directory.
+
+        Returns:
+            tuple or None: (list of (file path, size), list of subdirectories), None if unknown or changed.
+        """
+        key = os.fsencode(path)
+        with self.lock:
+            row = self.conn.execute("SELECT mtime_ns FROM dirs WHERE path = ?", (key,)).fetchone()
+            if row is None or row[0] != mtime_ns:
+                return None
+            files = [(os.fsdecode(p), size) for p, size in self.conn.execute("SELECT path, size FROM files WHERE dir = ?", (key,))]
+            subdirs = [os.fsdecode(sub) for (sub,) in self.conn.execute("SELECT path FROM dirs WHERE parent = ?", (key,))]
+        return files, subdirs
+
+    def store_dir(self, path, parent, mtime_ns, files, subdirs):
+        """
+        Stores the listed content of a directory and removes vanished files and subdirectories.
+
+        Args:
+            path (str): Directory path.
+            parent (str): Parent directory.
+            mtime_ns (int): Current mtime of the directory.
+            files (list[tuple]): (path, size, mtime_ns, inode) of the regular files in the directory.
+            subdirs (list[str]): Subdirectories of the directory.
+
+        Returns:
+            dict: Changed files with the keys 'added', 'removed' and 'modified'.
+        """
+        changes = {"added": [], "removed": [], "modified": []}
+        key = os.fsencode(path)
+        with self.lock:
+            old_files = {os.fsdecode(p): (size, mtime) for p, size, mtime in
+                         self.conn.execute("SELECT path, size, mtime_ns FROM files WHERE dir = ?", (key,))}
+            old_dirs = {os.fsdecode(sub) for (sub,) in self.conn.execute("SELECT path FROM dirs WHERE parent = ?", (key,))}
+            for file_path, size, file_mtime, _ in files:
+                old = old_files.pop(file_path, None)
+                if old is None:
+                    changes["added"].append(file_path)
+                elif old != (size, file_mtime):
+                    changes["modified"].append(file_path)
+            self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                                  [(os.fsencode(file_path), key, size, file_mtime, inode) for file_path, size, file_mtime, inode in files])
+            if old_files:
+                changes["removed"].extend(old_files)
+                self.conn.executemany("DELETE FROM files WHERE path = ?", [(os.fsencode(p),) for p in old_files])
+            for gone in old_dirs.difference(subdirs):
+                self._forget(gone, changes)
+            # subdirectories not scanned (e.g. excluded by a filter) are known without mtime, so they are listed when needed
+            self.conn.executemany("INSERT OR IGNORE INTO dirs VALUES (?, ?, NULL)", [(os.fsencode(sub), key) for sub in subdirs])
+            self.conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", (key, os.fsencode(parent), mtime_ns))
+        return changes
+
+    def store_file(self, path, st):
+        """
+        Stores a single file source.
+
+        Args:
+            path (str): File path.
+            st (os.stat_result): Stat of the file.
+
+        Returns:
+            dict: Changes with the keys 'added', 'removed' and 'modified'.
+        """
+        changes = {"added": [], "removed": [], "modified": []}
+        with self.lock:
+            row = self.conn.execute("SELECT size, mtime_ns FROM files WHERE path = ?", (os.fsencode(path),)).fetchone()
+            if row is None:
+                changes["added"].append(path)
+            elif row != (st.st_size, st.st_mtime_ns):
+                changes["modified"].append(path)
+            self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                              (os.fsencode(path), os.fsencode(os.path.dirname(path)), st.st_size, st.st_mtime_ns, st.st_ino))
+        return changes
+
+    def forget(self, path):
+        """
+        Removes a path and everything below it from the index (e.g. a deleted source).
+
+        Returns:
+            dict: Changes with the removed files under the key 'removed'.
+        """
+        changes = {"added": [], "removed": [], "modified": []}
+        with self.lock:
+            self._forget(path, changes)
+        return changes
+
+    def _forget(self, path, changes):
+        """Removes a path and everything below it, the lock must be held."""
+        key = os.fsencode(path)
+        low, high = self._subtree(path)
+        removed = [os.fsdecode(p) for (p,) in self.conn.execute("SELECT path FROM files WHERE path = ? OR (path >= ? AND path < ?)", (key, low, high))]
+        changes["removed"].extend(removed)
+        self.conn.execute("DELETE FROM files WHERE path = ? OR (path >= ? AND path < ?)", (key, low, high))
+        self.conn.execute("DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)", (key, low, high))
+        self.conn.execute("DELETE FROM roots WHERE path = ?", (key,))
+
+    def commit(self):
+        """Writes the changes of the last scan to disk."""
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        """Closes the database connection."""
+        with self.lock:
+            self.conn.close()
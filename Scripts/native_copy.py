@@ -0,0 +1,685 @@
+import os
+import stat
+import time
+import errno
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from delta_transfer import DeltaTransfer
+from resource_control import ResourceControl
+
+
+class CopyStopped(Exception):
+    """Raised inside the copy workers when the copy was stopped."""
+
+
+class NativeCopier:
+    """
+    Pure Python copy backend, an alternative to the ShellCommunicator (rsync/robocopy).
+    Mirrors like `rsync -a --mkpath --delete --copy-unsafe-links` and transfers the data
+    zero-copy with `os.copy_file_range`/`os.sendfile` where the OS supports it.
+    Small files are copied by a thread pool, progress is reported as structured events.
+    Large files with an older copy in the destination (or the previous snapshot) are updated with a delta transfer.
+    """
+    SMALL_FILE_SIZE = 1024 * 1024 # files below are copied by the thread pool
+    CHUNK_SIZE = 8 * 1024 * 1024
+    MODIFY_WINDOW = 1 # seconds, FAT/exFAT only store coarse timestamps (like rsync's --modify-window)
+    PROGRESS_INTERVAL = 0.2 # seconds between two progress events
+    DELTA_MIN_SIZE = 16 * 1024 * 1024 # changed files from this size are delta-transferred from their older copy
+
+    def __init__(self, os_type, resources=None):
+        """
+        Initialize the native copier.
+
+        Args:
+            os_type (str): The operating system type ('linux' or 'windows').
+            resources (ResourceControl, optional): Priority and bandwidth limit of the copy threads.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.os_type = os_type
+        self.resources = resources or ResourceControl(os_type, priority="normal")
+        self.threads_to_use = min(8, (os.cpu_count() or 1) * 2)
+        self.stop_event = threading.Event()
+        self.hardlinks = True # set to False if the destination doesn't support hard links
+        self.stats = {}
+        self.logger.info(f"Using the native copy backend with {self.threads_to_use} threads for small files.")
+        self.exitcodes_native = {
+            0: "No errors occurred.",
+            20: "Copy was stopped manually.",
+            23: "Some files could not be copied or deleted (see log)."
+        }
+
+    def get_exitcode(self, mode, exitcode):
+        """
+        Returns a human-readable message based on the exit code of the last copy.
+
+        Args:
+            mode (str): The mode of operation ('clean' or 'backup').
+            exitcode (int): The exit code of `run_copy`.
+
+        Returns:
+            str: A message describing the exit code when it is in dictionary.
+            None: If the exit code is not found in the dictionary.
+        """
+        match mode:
+            case "clean":
+                return NotImplementedError("get_exitcode(): Clean mode not implemented.")
+            case "backup":
+                return self.exitcodes_native.get(exitcode, None)
+            case _:
+                raise ValueError(f"get_exitcode(): Unknown mode '{mode}'.")
+
+    def delete(self, dir, is_file=False):
+        """
+        Deletes a file or directory.
+
+        Args:
+            dir (str): Path to the file or directory.
+            is_file (bool): If True, delete as file; otherwise as directory.
+        """
+        self.logger.debug(f"Now deleting '{dir}' ...")
+        try:
+            if is_file:
+                os.remove(dir)
+            else:
+                shutil.rmtree(dir)
+            self.logger.debug("Deleted success.")
+        except Exception as e:
+            self.logger.error(f"delete(): {e}.")
+            raise e
+
+    def run_copy(self, src, dst, progress_callback=None, link_dest=None, total_files=None, dirty=None, checkpoint=None, filters=None, total_bytes=None):
+        """
+        Mirrors src into dst (`dst/<basename of src>`) and blocks until the copy is finished.
+        With `link_dest` files unchanged since that snapshot are hard-linked from it instead of copied (like rsync `--link-dest`).
+
+        Progress events are dicts with the keys 'percent', 'bytes', 'total_bytes', 'reused', 'files', 'total_files' and 'file'
+        ('bytes' counts the reused bytes of delta transfers too).
+        With `dirty` (from the change journal) unchanged subtrees aren't scanned: they are kept if they already exist
+        in dst or hard-linked from link_dest.
+        With `checkpoint` (run journal) first-level subtrees finished by an interrupted run aren't scanned again, and every
+        first-level subtree is reported to it as soon as all its files are copied.
+        Statistics of the copy (bytes, reused, files, linked, clean_dirs, seconds, failed) are stored in `self.stats[src]`.
+        The copy runs with the priority and bandwidth limit of `self.resources`.
+
+        Args:
+            src (str): Source path (file or directory).
+            dst (str): Destination directory, created if missing.
+            progress_callback (callable, optional): Called with progress events.
+            link_dest (str, optional): Previous snapshot directory (same layout as dst).
+            total_files (int, optional): Unused, the native copier counts the files itself.
+            dirty (DirtySet, optional): Directories changed since the backup in dst (or link_dest), None to scan everything.
+            checkpoint (SourceCheckpoint, optional): Finished subtrees of this source, None to copy without checkpoints.
+            filters (PathFilter, optional): Include/exclude rules, excluded entries are neither walked nor kept in dst.
+            total_bytes (int, optional): Unused, the progress is weighted by the bytes the copier planned itself.
+
+        Returns:
+            int: 0 on success, 20 if stopped, 23 if some files failed (see `get_exitcode`).
+        """
+        self.logger.debug(f"Now backupping '{src}' to '{dst}' (native) ...")
+        start = time.monotonic()
+        self.resources.lower_current_thread() # inherited by the thread pool of this copy
+        src = os.path.normpath(src)
+        target = os.path.join(dst, os.path.basename(src))
+        link_target = os.path.join(link_dest, os.path.basename(src)) if link_dest else None
+        state = self._new_state(src, progress_callback, checkpoint, filters)
+        try:
+            os.makedirs(dst, exist_ok=True)
+            if os.path.isdir(src):
+                jobs = self._sync_tree(src, target, state, link_target, dirty)
+            else:
+                jobs = self._sync_file(src, target, os.stat(src), state, link_path=link_target)
+            state["total_bytes"] = sum(job[2].st_size for job in jobs)
+            state["total_files"] = len(jobs)
+            self._plan_checkpoints(jobs, state)
+            self._run_jobs([(job, state) for job in jobs])
+        except CopyStopped:
+            pass
+        seconds = time.monotonic() - start
+        self.stats[src] = self._get_stats(state, seconds)
+        self.logger.info(f"Copied {state['files']} files ({state['bytes'] / (1024 * 1024):.1f} MB, {state['reused'] / (1024 * 1024):.1f} MB "
+                         f"reused by delta transfer) of '{src}' in {seconds:.1f}s ({state['bytes'] / (1024 * 1024) / max(seconds, 1e-6):.1f} MB/s), "
+                         f"hard-linked {state['linked']} unchanged files"
+                         + (f", skipped {state['clean_dirs']} unchanged directory trees (change journal)" if dirty is not None else "")
+                         + (f", resumed after {state['resumed']} directory trees finished by the interrupted run." if state["resumed"] else "."))
+        return self._get_code(state)
+
+    def run_batch(self, files, dst, progress_callback=None, link_dest=None):
+        """
+        Copies several single-file sources into dst (`dst/<basename of src>`) with one thread pool and blocks until
+        all are finished, instead of one `run_copy` per file. Each file gets its own progress events and statistics.
+
+        Args:
+            files (list[str]): Source files.
+            dst (str): Destination directory, created if missing.
+            progress_callback (callable, optional): Called with the source file and its progress event.
+            link_dest (str, optional): Previous snapshot directory (same layout as dst).
+
+        Returns:
+            dict: Source file as key and its return code as value (see `get_exitcode`).
+        """
+        self.logger.debug(f"Now backupping {len(files)} files to '{dst}' (native batch) ...")
+        start = time.monotonic()
+        self.resources.lower_current_thread()
+        states = {}
+        jobs = []
+        os.makedirs(dst, exist_ok=True)
+        for src in files:
+            callback = (lambda event, src=src: progress_callback(src, event)) if progress_callback else None
+            state = states[src] = self._new_state(os.path.normpath(src), callback)
+            name = os.path.basename(state["root"])
+            try:
+                file_jobs = self._sync_file(state["root"], os.path.join(dst, name), os.stat(state["root"]), state,
+                                            link_path=os.path.join(link_dest, name) if link_dest else None)
+            except OSError as e:
+                self._fail(state, f"'{src}': {e}")
+                continue
+            state["total_bytes"] = sum(job[2].st_size for job in file_jobs)
+            state["total_files"] = len(file_jobs)
+            jobs += [(job, state) for job in file_jobs]
+        try:
+            self._run_jobs(jobs)
+        except CopyStopped:
+            pass
+        seconds = time.monotonic() - start
+        for state in states.values():
+            self.stats[state["root"]] = self._get_stats(state, seconds)
+        copied = sum(state["files"] for state in states.values())
+        self.logger.info(f"Copied {copied} of {len(files)} single files ({sum(state['bytes'] for state in states.values()) / (1024 * 1024):.1f} MB) "
+                         f"in {seconds:.1f}s, hard-linked {sum(state['linked'] for state in states.values())} unchanged files.")
+        return {src: self._get_code(state) for src, state in states.items()}
+
+    def _new_state(self, src, progress_callback=None, checkpoint=None, filters=None):
+        """Returns the counters of a new copy of src."""
+        return {"failed": 0, "bytes": 0, "reused": 0, "files": 0, "linked": 0, "clean_dirs": 0, "total_bytes": 0, "total_files": 0,
+                "last_event": 0.0, "lock": threading.Lock(), "callback": progress_callback,
+                "root": src, "checkpoint": checkpoint, "resumed": 0, "pending": {}, "failed_subtrees": set(), "filters": filters or None}
+
+    def _get_stats(self, state, seconds):
+        """Returns the statistics of a finished copy (see `self.stats`)."""
+        return {"bytes": state["bytes"], "reused": state["reused"], "files": state["files"], "linked": state["linked"],
+                "clean_dirs": state["clean_dirs"], "seconds": seconds, "failed": state["failed"]}
+
+    def _get_code(self, state):
+        """Returns the return code of a finished copy, sends the final progress event on success."""
+        if self.stop_event.is_set():
+            return 20
+        if state["failed"]:
+            return 23
+        self._emit(state, "", force=True)
+        return 0
+
+    # ----------------------------- tree walk -----------------------------
+
+    def _sync_tree(self, src_root, dst_root, state, link_root=None, dirty=None):
+        """
+        Walks the source tree, creates directories and symlinks, deletes extraneous entries in the destination
+        and returns the files that have to be copied (size or mtime differ).
+
+        Args:
+            src_root (str): Source directory.
+            dst_root (str): Destination directory mirroring the source.
+            state (dict): Counters of the current copy.
+            link_root (str, optional): Directory in the previous snapshot to hard-link unchanged files from.
+            dirty (DirtySet, optional): Changed directories, clean subtrees are skipped.
+
+        Returns:
+            list[tuple]: (src_path, dst_path, stat_result, basis_path) of the files to copy.
+        """
+        jobs = []
+        stack = [(src_root, dst_root, link_root, "")]
+        while stack:
+            if self.stop_event.is_set():
+                raise CopyStopped()
+            src_dir, dst_dir, link_dir, rel = stack.pop()
+            if dirty is not None and dirty.is_clean(rel) and self._keep_clean(dst_dir, link_dir, state, rel):
+                continue
+            if rel and "/" not in rel and state["checkpoint"] is not None:
+                if state["checkpoint"].is_done(rel) and os.path.isdir(dst_dir) and not os.path.islink(dst_dir):
+                    state["resumed"] += 1
+                    continue
+                state["pending"][rel] = 0 # first-level subtree, finished when its files are copied
+            try:
+                self._make_dir(dst_dir)
+                dst_entries = {entry.name: entry for entry in os.scandir(dst_dir)}
+                src_entries = list(os.scandir(src_dir))
+            except OSError as e:
+                self._fail(state, f"'{src_dir}': {e}", rel)
+                continue
+
+            for entry in src_entries:
+                if state["filters"] and state["filters"].is_excluded(f"{rel}/{entry.name}" if rel else entry.name, entry.is_dir(follow_symlinks=False)):
+                    continue # excluded: not copied, an older copy in dst is deleted below
+                dst_path = os.path.join(dst_dir, entry.name)
+                link_path = os.path.join(link_dir, entry.name) if link_dir else None
+                dst_entry = dst_entries.pop(entry.name, None)
+                try:
+                    if entry.is_symlink():
+                        link = os.readlink(entry.path)
+                        if self._is_safe_link(src_root, entry.path, link):
+                            self._sync_symlink(link, dst_path, dst_entry)
+                            continue
+                        st = os.stat(entry.path) # unsafe link: copy the referent
+                    else:
+                        st = entry.stat(follow_symlinks=False)
+                    if stat.S_ISDIR(st.st_mode):
+                        if dst_entry is not None and not dst_entry.is_dir(follow_symlinks=False):
+                            self._remove(dst_entry.path)
+                        stack.append((entry.path, dst_path, link_path, f"{rel}/{entry.name}" if rel else entry.name))
+                    elif stat.S_ISREG(st.st_mode):
+                        jobs.extend(self._sync_file(entry.path, dst_path, st, state, dst_entry, link_path))
+                    else:
+                        self.logger.debug(f"copy: skipping special file '{entry.path}'.")
+                except OSError as e:
+                    self._fail(state, f"'{entry.path}': {e}", rel)
+
+            for dst_entry in dst_entries.values(): # --delete
+                try:
+                    self._remove(dst_entry.path)
+                except OSError as e:
+                    self._fail(state, f"delete '{dst_entry.path}': {e}", rel)
+        return jobs
+
+    def _keep_clean(self, dst_dir, link_dir, state, rel=""):
+        """
+        Takes an unchanged subtree without scanning the source: keeps it if it exists in the destination,
+        otherwise hard-links it from the previous snapshot (without what the filters exclude now).
+
+        Args:
+            dst_dir (str): Directory in the destination.
+            link_dir (str or None): Same directory in the previous snapshot.
+            state (dict): Counters of the current copy.
+            rel (str): Path of the subtree relative to the source ('/' as separator).
+
+        Returns:
+            bool: True if the subtree is done, False if it has to be scanned.
+        """
+        if os.path.isdir(dst_dir) and not os.path.islink(dst_dir):
+            with state["lock"]:
+                state["clean_dirs"] += 1
+            return True
+        if not link_dir or not self.hardlinks or not os.path.isdir(link_dir):
+            return False
+        try:
+            linked = self._link_tree(link_dir, dst_dir, rel, state["filters"])
+        except OSError as e:
+            if e.errno in (errno.EPERM, errno.EXDEV, errno.EMLINK, errno.EOPNOTSUPP, errno.ENOTSUP):
+                self.hardlinks = False
+                self.logger.warning(f"copy: hard links not possible on the destination ({e}), making full copies.")
+            else:
+                self.logger.debug(f"copy: couldn't link '{link_dir}' ({e}), scanning it.")
+            return False
+        with state["lock"]:
+            state["linked"] += linked
+            state["clean_dirs"] += 1
+        return True
+
+    def _link_tree(self, link_dir, dst_dir, rel="", filters=None):
+        """
+        Recreates a directory tree of the previous snapshot in the destination, files as hard links.
+        Entries excluded by the filters (e.g. a rule added since the previous snapshot) are left out.
+
+        Returns:
+            int: Number of hard-linked files.
+        """
+        linked = 0
+        stack = [(link_dir, dst_dir, rel)]
+        while stack:
+            if self.stop_event.is_set():
+                raise CopyStopped()
+            link_path, dst_path, rel = stack.pop()
+            self._make_dir(dst_path)
+            with os.scandir(link_path) as entries:
+                for entry in entries:
+                    entry_rel = f"{rel}/{entry.name}" if rel else entry.name
+                    if filters and filters.is_excluded(entry_rel, entry.is_dir(follow_symlinks=False)):
+                        continue
+                    target = os.path.join(dst_path, entry.name)
+                    if entry.is_symlink():
+                        os.symlink(os.readlink(entry.path), target)
+                    elif entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, target, entry_rel))
+                    elif entry.is_file(follow_symlinks=False):
+                        os.link(entry.path, target)
+                        linked += 1
+        return linked
+
+    def _sync_file(self, src_path, dst_path, st, state, dst_entry=None, link_path=None):
+        """
+        Compares a source file with its destination (quick check on size and mtime).
+        If it changed but matches the file in the previous snapshot, it is hard-linked from there.
+
+        Args:
+            src_path (str): Source file.
+            dst_path (str): Destination file.
+            st (os.stat_result): Stat of the source file.
+            state (dict): Counters of the current copy.
+            dst_entry (os.DirEntry, optional): Destination entry if already scanned.
+            link_path (str, optional): Same file in the previous snapshot.
+
+        Returns:
+            list[tuple]: The copy job, empty if the destination is up to date or was hard-linked.
+                Its basis is an older copy of the file (destination or previous snapshot) for a delta transfer, or None.
+        """
+        try:
+            dst_st = dst_entry.stat(follow_symlinks=False) if dst_entry is not None else os.lstat(dst_path)
+        except FileNotFoundError:
+            dst_st = None
+        if dst_st is not None:
+            if not stat.S_ISREG(dst_st.st_mode):
+                self._remove(dst_path)
+            elif self._unchanged(st, dst_st):
+                return []
+        if link_path and self.hardlinks and self._link_previous(link_path, dst_path, st, dst_st is not None):
+            with state["lock"]:
+                state["linked"] += 1
+            return []
+        basis = None
+        if st.st_size >= self.DELTA_MIN_SIZE:
+            if dst_st is not None and stat.S_ISREG(dst_st.st_mode):
+                basis = dst_path
+            elif link_path and os.path.isfile(link_path):
+                basis = link_path
+        return [(src_path, dst_path, st, basis)]
+
+    def _unchanged(self, st, other_st):
+        """Quick check like rsync: same size and same mtime (within `MODIFY_WINDOW`)."""
+        return other_st.st_size == st.st_size and abs(other_st.st_mtime - st.st_mtime) < self.MODIFY_WINDOW
+
+    def _link_previous(self, link_path, dst_path, st, dst_exists):
+        """
+        Hard-links a file from the previous snapshot if it is unchanged.
+        Disables hard-linking for this copier if the filesystem doesn't support it (e.g. FAT/exFAT).
+
+        Args:
+            link_path (str): Same file in the previous snapshot.
+            dst_path (str): Destination file.
+            st (os.stat_result): Stat of the source file.
+            dst_exists (bool): True if dst_path exists and has to be replaced.
+
+        Returns:
+            bool: True if the file was hard-linked.
+        """
+        try:
+            link_st = os.lstat(link_path)
+        except OSError:
+            return False
+        if not stat.S_ISREG(link_st.st_mode) or not self._unchanged(st, link_st):
+            return False
+        try:
+            if dst_exists:
+                os.remove(dst_path)
+            os.link(link_path, dst_path)
+            return True
+        except OSError as e:
+            if e.errno in (errno.EPERM, errno.EXDEV, errno.EMLINK, errno.EOPNOTSUPP, errno.ENOTSUP):
+                self.hardlinks = False
+                self.logger.warning(f"copy: hard links not possible on the destination ({e}), making full copies.")
+            return False
+
+    def _sync_symlink(self, link, dst_path, dst_entry):
+        """
+        Recreates a safe symlink in the destination if it is missing or points somewhere else.
+
+        Args:
+            link (str): Target of the source symlink.
+            dst_path (str): Path of the symlink in the destination.
+            dst_entry (os.DirEntry or None): Existing destination entry.
+        """
+        if dst_entry is not None:
+            if dst_entry.is_symlink() and os.readlink(dst_path) == link:
+                return
+            self._remove(dst_path)
+        os.symlink(link, dst_path)
+
+    def _is_safe_link(self, src_root, link_path, link):
+        """
+        Checks if a symlink stays inside the copied tree (rsync's definition of a safe link).
+
+        Args:
+            src_root (str): Root of the copied tree.
+            link_path (str): Path of the symlink.
+            link (str): Target of the symlink.
+
+        Returns:
+            bool: True if the link is relative and doesn't leave the tree.
+        """
+        if os.path.isabs(link):
+            return False
+        rel_dir = os.path.relpath(os.path.dirname(link_path), src_root)
+        resolved = os.path.normpath(os.path.join(rel_dir, link))
+        return resolved != ".." and not resolved.startswith(".." + os.sep)
+
+    def _make_dir(self, path):
+        """Creates a directory, replacing a file or symlink with the same name."""
+        if os.path.islink(path) or os.path.isfile(path):
+            os.remove(path)
+        os.makedirs(path, exist_ok=True)
+
+    def _remove(self, path):
+        """Removes a file, symlink or directory tree."""
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+    # ----------------------------- checkpoints -----------------------------
+
+    def _get_rel(self, state, path):
+        """Returns the path relative to the source with '/' as separator."""
+        return os.path.relpath(path, state["root"]).replace(os.sep, "/")
+
+    def _plan_checkpoints(self, jobs, state):
+        """Counts the files to copy per first-level subtree, reports the subtrees without any to the checkpoint."""
+        if state["checkpoint"] is None:
+            return
+        for job in jobs:
+            rel = self._get_rel(state, job[0])
+            if "/" in rel:
+                state["pending"][rel.split("/")[0]] += 1
+        for rel, count in state["pending"].items():
+            if count == 0 and rel not in state["failed_subtrees"]:
+                state["checkpoint"].mark_done(rel)
+
+    def _job_done(self, state, src_path):
+        """Counts a copied (or failed) file, reports its first-level subtree to the checkpoint when all its files are done."""
+        if state["checkpoint"] is None:
+            return
+        rel = self._get_rel(state, src_path)
+        if "/" not in rel:
+            return # file in the root of the source
+        subtree = rel.split("/")[0]
+        with state["lock"]:
+            state["pending"][subtree] -= 1
+            done = state["pending"][subtree] == 0 and subtree not in state["failed_subtrees"]
+        if done:
+            state["checkpoint"].mark_done(subtree)
+
+    # ----------------------------- data transfer -----------------------------
+
+    def _run_jobs(self, jobs):
+        """
+        Copies the planned files, small ones in the thread pool and large ones chunked in this thread.
+
+        Args:
+            jobs (list[tuple]): (job, state) of the files to copy, the job is (src_path, dst_path, stat_result, basis_path)
+                and the state holds the counters of the copy it belongs to.
+        """
+        small = [(job, state) for job, state in jobs if job[2].st_size < self.SMALL_FILE_SIZE]
+        large = [(job, state) for job, state in jobs if job[2].st_size >= self.SMALL_FILE_SIZE]
+        with ThreadPoolExecutor(max_workers=self.threads_to_use) as pool:
+            futures = [pool.submit(self._copy_job, job, state) for job, state in small]
+            for job, state in large:
+                self._copy_job(job, state)
+            for future in futures:
+                future.result()
+
+    def _copy_job(self, job, state):
+        """
+        Copies one file into a temporary file next to the destination and replaces the destination with it.
+
+        Args:
+            job (tuple): (src_path, dst_path, stat_result, basis_path).
+            state (dict): Counters of the current copy.
+        """
+        src_path, dst_path, st, basis = job
+        if self.stop_event.is_set():
+            return
+        if basis is not None:
+            self._delta_job(job, state)
+            return
+        tmp_path = os.path.join(os.path.dirname(dst_path), f".{os.path.basename(dst_path)}.partial")
+        try:
+            with open(src_path, "rb") as fsrc, open(tmp_path, "wb") as fdst:
+                self._copy_data(fsrc, fdst, lambda n: self._add_bytes(state, n, src_path, throttle=True))
+            os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+            os.replace(tmp_path, dst_path)
+            with state["lock"]:
+                state["files"] += 1
+            self._job_done(state, src_path)
+        except CopyStopped:
+            self._discard(tmp_path)
+        except OSError as e:
+            self._discard(tmp_path)
+            self._fail(state, f"'{src_path}': {e}", self._get_rel(state, src_path))
+            self._job_done(state, src_path)
+
+    def _delta_job(self, job, state):
+        """
+        Updates one file from its older copy with a delta transfer (see delta_transfer.py).
+        Falls back to a full copy if the delta transfer fails.
+
+        Args:
+            job (tuple): (src_path, dst_path, stat_result, basis_path).
+            state (dict): Counters of the current copy.
+        """
+        src_path, dst_path, st, basis = job
+        done = []
+        def on_bytes(n):
+            done.append(n)
+            self._add_bytes(state, n, src_path)
+        def on_reused(n):
+            with state["lock"]:
+                state["reused"] += n
+        try:
+            DeltaTransfer(self._check_stop, throttle=self.resources.throttle).sync(src_path, basis, dst_path, on_bytes, on_reused)
+            os.utime(dst_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+            with state["lock"]:
+                state["files"] += 1
+            self._job_done(state, src_path)
+        except CopyStopped:
+            pass
+        except OSError as e:
+            self.logger.warning(f"copy: delta transfer of '{src_path}' failed ({e}), copying it completely.")
+            with state["lock"]:
+                state["bytes"] -= sum(done)
+            self._copy_job((src_path, dst_path, st, None), state)
+
+    def _check_stop(self):
+        """Raises CopyStopped if the copy was stopped."""
+        if self.stop_event.is_set():
+            raise CopyStopped()
+
+    def _copy_data(self, fsrc, fdst, on_bytes):
+        """
+        Copies the content of fsrc to fdst. Tries `os.copy_file_range` (in-kernel, zero-copy and reflinks on
+        CoW filesystems), then `os.sendfile`, then a buffered read/write loop.
+
+        Args:
+            fsrc (file): Source file opened in binary mode.
+            fdst (file): Destination file opened in binary mode.
+            on_bytes (callable): Called with the number of bytes copied per chunk.
+        """
+        infd, outfd = fsrc.fileno(), fdst.fileno()
+        copied = 0
+        for zero_copy in ("copy_file_range", "sendfile"):
+            if not hasattr(os, zero_copy):
+                continue
+            try:
+                while True:
+                    if self.stop_event.is_set():
+                        raise CopyStopped()
+                    if zero_copy == "copy_file_range":
+                        n = os.copy_file_range(infd, outfd, self.CHUNK_SIZE)
+                    else:
+                        n = os.sendfile(outfd, infd, copied, self.CHUNK_SIZE)
+                    if n == 0:
+                        return
+                    copied += n
+                    on_bytes(n)
+            except OSError as e:
+                # not supported for this pair of files (e.g. cross-device on old kernels): try the next method
+                if copied or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF):
+                    raise
+        buffer = bytearray(self.CHUNK_SIZE)
+        view = memoryview(buffer)
+        while True:
+            if self.stop_event.is_set():
+                raise CopyStopped()
+            n = fsrc.readinto(buffer)
+            if not n:
+                return
+            fdst.write(view[:n])
+            on_bytes(n)
+
+    def _discard(self, tmp_path):
+        """Removes a partially written temporary file."""
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+    # ----------------------------- progress -----------------------------
+
+    def _add_bytes(self, state, n, path, throttle=False):
+        """Counts copied bytes, emits a progress event and waits for the bandwidth limit if throttle is True."""
+        with state["lock"]:
+            state["bytes"] += n
+        self._emit(state, path)
+        if throttle:
+            self.resources.throttle(n)
+
+    def _fail(self, state, msg, rel=None):
+        """Logs a failed file and counts it, its first-level subtree (of `rel`) isn't checkpointed."""
+        self.logger.error(f"copy: {msg}")
+        with state["lock"]:
+            state["failed"] += 1
+            if rel:
+                state["failed_subtrees"].add(rel.split("/")[0])
+
+    def _emit(self, state, path, force=False):
+        """
+        Calls the progress callback with a progress event, at most every `PROGRESS_INTERVAL` seconds.
+
+        Args:
+            state (dict): Counters of the current copy.
+            path (str): File currently copied.
+            force (bool): Emit even if the last event was just sent.
+        """
+        callback = state["callback"]
+        if not callback:
+            return
+        now = time.monotonic()
+        with state["lock"]:
+            if not force and now - state["last_event"] < self.PROGRESS_INTERVAL:
+                return
+            state["last_event"] = now
+            total = state["total_bytes"]
+            event = {
+                "percent": 100 * state["bytes"] / total if total else 100,
+                "bytes": state["bytes"],
+                "total_bytes": total,
+                "reused": state["reused"],
+                "files": state["files"],
+                "total_files": state["total_files"],
+                "file": path
+            }
+        callback(event)
+
+    def stop_all_processes(self):
+        """
+        Stops all running copies (they finish their current chunk and return).
+        """
+        self.logger.debug("Stopping all native copies...")
+        self.stop_event.set()
@@ -0,0 +1,245 @@
+import os
+import logging
+import threading
+from progress_bus import PercentEvent, BytesEvent, FileEvent
+
+
+class ParallelCopier:
+    """
+    Runs the copy processes of several backup sources at once.
+    The number of simultaneous copies is limited in total, per source device and per destination device
+    (devices are grouped by `st_dev`), so two sources on the same disk don't thrash it.
+    Single-file sources are copied together as one batch (`run_batch` of the backend), so they don't start
+    a copy process each.
+    """
+
+    def __init__(self, subprocesshandler, update_text_callback, stop_callback, publish_callback=None,
+                 max_parallel=4, max_per_src_device=1, max_per_dst_device=3):
+        """
+        Initializes the ParallelCopier.
+
+        Args:
+            subprocesshandler: Copy backend (ShellCommunicator or NativeCopier).
+            update_text_callback: Function to update the text area in the view.
+            stop_callback: Function returning True if the tasks should be stopped.
+            publish_callback (callable, optional): Function to publish progress events (`ProgressBus.publish`).
+            max_parallel (int): Maximum number of copies running at the same time.
+            max_per_src_device (int): Maximum number of copies reading from the same device.
+            max_per_dst_device (int): Maximum number of copies writing to the same device.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.subprocesshandler = subprocesshandler
+        self.update_text = update_text_callback
+        self.is_stopped = stop_callback
+        self.publish = publish_callback
+        self.max_parallel = max(1, max_parallel)
+        self.max_per_src_device = max(1, max_per_src_device)
+        self.max_per_dst_device = max(1, max_per_dst_device)
+        self.condition = threading.Condition()
+        self.text_lock = threading.Lock()
+
+    def get_device(self, path):
+        """
+        Returns the device id of a path.
+
+        Args:
+            path (str): Path to a file or directory.
+
+        Returns:
+            int or str: The `st_dev` of the path, or the path itself if it can't be stat'ed.
+        """
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            return path
+
+    def copy_all(self, backup_paths, dest_dir, link_dest=None, file_counts=None, dirty_dirs=None, journal=None, filters=None, source_bytes=None):
+        """
+        Copies every path of `backup_paths` into `dest_dir` and blocks until all copies are finished.
+
+        Args:
+            backup_paths (list[str]): Paths to back up.
+            dest_dir (str): Destination directory.
+            link_dest (str, optional): Previous snapshot to hard-link unchanged files from.
+            file_counts (dict, optional): Number of files per source (from the metadata index).
+            dirty_dirs (dict, optional): Changed directories per source (DirtySet from the change journal, None to scan it).
+            journal (RunJournal, optional): Run journal of the snapshot, sources finished by an interrupted run are skipped.
+            filters (dict, optional): Include/exclude rules per source (PathFilter or None).
+            source_bytes (dict, optional): Scanned size per source, the combined progress weights every source by it.
+
+        Returns:
+            dict: Source path as key and the return code of its copy as value.
+                  Sources that were not started (stopped) or failed to start are missing.
+
+        Raises:
+            RuntimeError: If at least one copy failed with an exception.
+        """
+        self.total = len(backup_paths)
+        self.percents = {src: 0 for src in backup_paths}
+        self.reused = {src: 0 for src in backup_paths}
+        self.source_bytes = source_bytes or {}
+        self.weights = {src: self.source_bytes.get(src, 0) for src in backup_paths}
+        if not any(self.weights.values()):
+            self.weights = {src: 1 for src in backup_paths} # sizes unknown, every source counts the same
+        self.total_weight = sum(self.weights.values()) or 1
+        self.finished = 0
+        self.last_text = None
+        self.return_codes = {}
+        self.errors = []
+        self.file_counts = file_counts or {}
+        self.dirty_dirs = dirty_dirs or {}
+        self.journal = journal
+        self.filters = filters or {}
+        files = [src for src in backup_paths if os.path.isfile(src)] if hasattr(self.subprocesshandler, "run_batch") else []
+        pending = [src for src in backup_paths if src not in files]
+        running = {}
+        src_devices = {src: self.get_device(src) for src in pending}
+        if len(files) > 1:
+            batch = tuple(files) # one job for all files
+            pending.insert(0, batch)
+            src_devices[batch] = self.get_device(files[0])
+        else:
+            pending += files
+            src_devices.update({src: self.get_device(src) for src in files})
+        # every copy of a run writes to the same destination device
+        slots = min(self.max_parallel, self.max_per_dst_device)
+        self.logger.debug(f"Copying {self.total} sources with up to {slots} processes to device {self.get_device(dest_dir)}.")
+
+        with self.condition:
+            while pending or running:
+                if self.is_stopped():
+                    pending.clear()
+                started = None
+                if len(running) < slots:
+                    for src in pending:
+                        busy = sum(1 for dev in running.values() if dev == src_devices[src])
+                        if busy < self.max_per_src_device:
+                            started = src
+                            break
+                if started:
+                    pending.remove(started)
+                    running[started] = src_devices[started]
+                    target = self._run_batch if isinstance(started, tuple) else self._run_copy
+                    thread = threading.Thread(target=target, args=(started, dest_dir, running, link_dest), daemon=True)
+                    thread.start()
+                    continue
+                if pending or running:
+                    self.condition.wait()
+
+        if self.errors:
+            raise RuntimeError("; ".join(self.errors))
+        return self.return_codes
+
+    def _run_copy(self, src, dest_dir, running, link_dest=None):
+        """
+        Runs a single copy process and forwards its progress (executed in its own thread).
+
+        Args:
+            src (str): Source path.
+            dest_dir (str): Destination directory.
+            running (dict): Running copies of the scheduler, `src` is removed when finished.
+            link_dest (str, optional): Previous snapshot to hard-link unchanged files from.
+        """
+        try:
+            if self.is_stopped():
+                return
+            if self.journal is not None and self.journal.is_done(src):
+                self.logger.info(f"'{src}' was finished by the interrupted run, skipping it.")
+                self.return_codes[src] = 0
+                return
+            return_code = self.subprocesshandler.run_copy(src, dest_dir, lambda event: self._set_progress(src, event["percent"], event),
+                                                          link_dest=link_dest, total_files=self.file_counts.get(src),
+                                                          dirty=self.dirty_dirs.get(src),
+                                                          checkpoint=self.journal.get_checkpoint(src) if self.journal is not None else None,
+                                                          filters=self.filters.get(src), total_bytes=self.weights.get(src) if self.source_bytes else None)
+            if self.journal is not None:
+                self.journal.finish_source(src, return_code)
+            self.logger.debug(f"Returncode of '{src}' is {return_code}.")
+            msg = self.subprocesshandler.get_exitcode("backup", return_code)
+            if msg:
+                self.logger.debug(f"=> known!: {msg}")
+            else:
+                self.logger.warning("=> unknown!")
+            self.return_codes[src] = return_code
+        except Exception as e:
+            self.logger.error(f"copy of '{src}': {e}")
+            self.errors.append(f"'{src}': {e}")
+        finally:
+            with self.condition:
+                self.finished += 1
+            self._set_progress(src, 100)
+            with self.condition:
+                running.pop(src, None)
+                self.condition.notify_all()
+
+    def _run_batch(self, batch, dest_dir, running, link_dest=None):
+        """
+        Copies the single-file sources with one call of the backend (executed in its own thread).
+
+        Args:
+            batch (tuple[str]): Source files.
+            dest_dir (str): Destination directory.
+            running (dict): Running copies of the scheduler, `batch` is removed when finished.
+            link_dest (str, optional): Previous snapshot to hard-link unchanged files from.
+        """
+        files = list(batch)
+        try:
+            if self.is_stopped():
+                return
+            if self.journal is not None:
+                for src in [src for src in files if self.journal.is_done(src)]:
+                    self.logger.info(f"'{src}' was finished by the interrupted run, skipping it.")
+                    self.return_codes[src] = 0
+                    files.remove(src)
+                for src in files:
+                    self.journal.start_source(src)
+            if not files:
+                return
+            return_codes = self.subprocesshandler.run_batch(files, dest_dir, lambda src, event: self._set_progress(src, event["percent"], event),
+                                                            link_dest=link_dest)
+            for src, return_code in return_codes.items():
+                if self.journal is not None:
+                    self.journal.finish_source(src, return_code)
+                self.logger.debug(f"Returncode of '{src}' is {return_code}.")
+                if not self.subprocesshandler.get_exitcode("backup", return_code):
+                    self.logger.warning("=> unknown!")
+                self.return_codes[src] = return_code
+        except Exception as e:
+            self.logger.error(f"copy of {len(files)} files: {e}")
+            self.errors.append(f"{len(files)} files: {e}")
+        finally:
+            with self.condition:
+                self.finished += len(batch)
+            for src in batch:
+                self._set_progress(src, 100)
+            with self.condition:
+                running.pop(batch, None)
+                self.condition.notify_all()
+
+    def _set_progress(self, src, percent, event=None):
+        """
+        Stores the progress of one source and shows the combined progress of all sources.
+
+        Args:
+            src (str): Source path.
+            percent (float): Progress of this source in percent.
+            event (dict, optional): Progress event of the copy backend (may contain 'bytes', 'total_bytes', 'reused' and 'file').
+        """
+        with self.text_lock:
+            self.percents[src] = max(self.percents[src], min(percent, 100))
+            if event and event.get("reused"):
+                self.reused[src] = event["reused"]
+            total_percent = sum(percent * self.weights[src] for src, percent in self.percents.items()) / self.total_weight
+            text = f"Copying: {total_percent:.2f}% (Sources done: {self.finished}/{self.total})"
+            reused = sum(self.reused.values())
+            if reused:
+                text += f", {reused / (1024 * 1024):.1f} MB reused by delta transfer"
+            if self.publish:
+                self.publish(PercentEvent("file_backup", total_percent))
+                if event and "bytes" in event:
+                    self.publish(BytesEvent(src, event["bytes"], event["total_bytes"], event.get("reused", 0)))
+                if event and event.get("file"):
+                    self.publish(FileEvent(src, event["file"]))
+            if text != self.last_text:
+                self.last_text = text
+                self.update_text(text, update=True)
@@ -0,0 +1,194 @@
+import os
+import re
+import logging
+
+
+class FilterRule:
+    """
+    One gitignore-style pattern.
+
+    Attributes:
+        pattern (str): The pattern as written (without '!' and trailing '/').
+        negated (bool): True for '!pattern' (includes again what an earlier rule excluded).
+        dir_only (bool): True for 'pattern/' (only matches directories).
+        anchored (bool): True if the pattern contains a '/' (relative to the source), otherwise it matches names at any depth.
+        regex (str): The pattern translated to a regular expression on the path relative to the source.
+    """
+
+    def __init__(self, line):
+        """
+        Parses a pattern.
+
+        Args:
+            line (str): The pattern, e.g. 'node_modules/', '*.pyc', '/build', 'docs/**/*.pdf' or '!keep.log'.
+        """
+        self.negated = line.startswith("!")
+        if self.negated:
+            line = line[1:]
+        elif line.startswith("\\"):
+            line = line[1:] # '\!name' and '\#name' are literal
+        self.dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        self.anchored = "/" in line
+        self.pattern = line.lstrip("/")
+        self.regex = ("" if self.anchored else "(?:.*/)?") + self._translate(self.pattern)
+
+    def _translate(self, pattern):
+        """Translates the glob to a regular expression ('*' and '?' don't match '/', '**' matches any number of directories)."""
+        parts = pattern.split("/")
+        regex = ""
+        for i, part in enumerate(parts):
+            last = i == len(parts) - 1
+            if part == "**":
+                regex += ".*" if last else "(?:[^/]*/)*"
+                continue
+            j = 0
+            while j < len(part):
+                char = part[j]
+                if char == "*":
+                    regex += "[^/]*"
+                elif char == "?":
+                    regex += "[^/]"
+                elif char == "[" and part.find("]", j + 2) != -1: # a ']' right after '[' belongs to the class
+                    end = part.find("]", j + 2)
+                    content = part[j + 1:end]
+                    if content.startswith("!"):
+                        content = "^" + content[1:]
+                    regex += f"[{content.replace(chr(92), chr(92) * 2)}]"
+                    j = end
+                else:
+                    regex += re.escape(char)
+                j += 1
+            if not last:
+                regex += "/"
+        return regex
+
+
+class PathFilter:
+    """
+    Include/exclude rules in gitignore style, compiled once into two regular expressions (one for directories,
+    one for files), so checking a path is a single match however many rules there are.
+    Like in gitignore the last matching rule decides and '!pattern' includes again; the content of an excluded
+    directory isn't looked at (it can't be included again), which lets the scan prune the whole subtree.
+
+    The same rules are translated for the copy tools: rsync `--exclude-from` and robocopy `/XD` `/XF`.
+    """
+
+    def __init__(self, patterns):
+        """
+        Compiles the rules.
+
+        Args:
+            patterns (list[str]): Patterns in gitignore style, empty lines and lines starting with '#' are ignored.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.rules = [FilterRule(line.strip()) for line in patterns if line and line.strip() and not line.strip().startswith("#")]
+        self.key = tuple((rule.negated, rule.dir_only, rule.anchored, rule.pattern) for rule in self.rules) # hashable, for caches
+        self.dir_regex = self._compile(self.rules)
+        self.file_regex = self._compile([rule if not rule.dir_only else None for rule in self.rules])
+        self._check_negations()
+
+    def _compile(self, rules):
+        """Combines the rules into one regex, the last rule first: the first alternative matching the whole path wins."""
+        alternatives = [f"(?P<r{i}>{rule.regex})" for i, rule in reversed(list(enumerate(rules))) if rule is not None]
+        return re.compile("|".join(alternatives)) if alternatives else None
+
+    def _check_negations(self):
+        """Warns about '!' rules below an excluded directory, which can't include anything (e.g. '/build' and '!build/keep.txt')."""
+        for rule in self.rules:
+            if not rule.negated or not rule.anchored:
+                continue
+            parts = rule.pattern.split("/")[:-1]
+            for depth in range(1, len(parts) + 1):
+                if re.search(r"[*?\[]", parts[depth - 1]):
+                    break # wildcards: the directories can't be checked
+                parent = "/".join(parts[:depth])
+                if self.is_excluded(parent, is_dir=True):
+                    self.logger.warning(f"The filter rule '!{rule.pattern}' has no effect: its directory '{parent}' is excluded, "
+                                        f"exclude '{parent}/*' instead.")
+                    break
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def is_excluded(self, rel, is_dir=False):
+        """
+        Checks a path.
+
+        Args:
+            rel (str): Path relative to the source with '/' as separator.
+            is_dir (bool): True if the path is a directory.
+
+        Returns:
+            bool: True if the path is excluded.
+        """
+        regex = self.dir_regex if is_dir else self.file_regex
+        if regex is None:
+            return False
+        match = regex.fullmatch(rel)
+        if match is None:
+            return False
+        return not self.rules[int(match.lastgroup[1:])].negated
+
+    # ----------------------------- copy tools -----------------------------
+
+    def to_rsync(self, src):
+        """
+        Translates the rules to lines for rsync `--exclude-from` ('- ' exclude, '+ ' include). rsync takes the first
+        matching rule, so the order is reversed; anchored patterns get the base name of the source in front,
+        because rsync anchors them at the transfer root (the parent of the source).
+
+        Args:
+            src (str): Source path (copied without trailing slash).
+
+        Returns:
+            list[str]: The lines.
+        """
+        base = os.path.basename(os.path.normpath(src))
+        lines = []
+        for rule in reversed(self.rules):
+            pattern = f"/{base}/{rule.pattern}" if rule.anchored else rule.pattern
+            lines.append(f"{'+' if rule.negated else '-'} {pattern}{'/' if rule.dir_only else ''}")
+        return lines
+
+    def to_robocopy(self, src):
+        """
+        Translates the rules to robocopy `/XD` and `/XF` arguments. robocopy only knows names with wildcards and
+        full paths, so rules with '**', character classes or wildcards in an anchored path and '!' rules are left out.
+        Earlier rules that a '!' rule overrides (they match an example path of it) are left out as well, so robocopy
+        rather copies too much than skips files the user included again.
+
+        Args:
+            src (str): Source path.
+
+        Returns:
+            list[str]: The arguments, e.g. ['/XD', 'node_modules', '/XF', '*.pyc'].
+        """
+        overridden = set()
+        for i, rule in enumerate(self.rules):
+            if rule.negated:
+                example = self._example(rule.pattern)
+                overridden.update(j for j, earlier in enumerate(self.rules[:i]) if not earlier.negated and re.fullmatch(earlier.regex, example))
+        dirs, files = [], []
+        for i, rule in enumerate(self.rules):
+            if i in overridden:
+                self.logger.warning(f"robocopy can't express the filter rule '{rule.pattern}' with its '!' exceptions, it isn't applied.")
+                continue
+            if rule.negated or "**" in rule.pattern or "[" in rule.pattern or rule.anchored and re.search(r"[*?]", rule.pattern):
+                self.logger.warning(f"robocopy can't express the filter rule '{'!' if rule.negated else ''}{rule.pattern}', it isn't applied.")
+                continue
+            name = os.path.join(os.path.normpath(src), *rule.pattern.split("/")) if rule.anchored else rule.pattern
+            dirs.append(name)
+            if not rule.dir_only:
+                files.append(name)
+        args = []
+        if dirs:
+            args += ["/XD"] + dirs
+        if files:
+            args += ["/XF"] + files
+        return args
+
+    def _example(self, pattern):
+        """Returns a path matched by a pattern (wildcards replaced by 'x', character classes by their first character)."""
+        example = re.sub(r"\[!?(.)[^\]]*\]", lambda match: match.group(1), pattern)
+        return re.sub(r"\*\*|\*|\?", "x", example)
@@ -0,0 +1,230 @@
+import os
+import re
+import codecs
+import signal
+import asyncio
+import locale
+import logging
+import threading
+import subprocess
+from collections import deque
+
+
+class ProcessResult:
+    """
+    Outcome of a process run by the ProcessManager.
+
+    Attributes:
+        returncode (int): Exit code of the process (negative signal number if it was killed on Linux).
+        stderr (list[str]): The last lines written to stderr (at most `ProcessManager.STDERR_LINES`).
+        timed_out (str or None): 'timeout' or 'idle' if the watchdog stopped the process, None otherwise.
+    """
+
+    def __init__(self, returncode, stderr, timed_out=None):
+        self.returncode = returncode
+        self.stderr = stderr
+        self.timed_out = timed_out
+
+
+class ProcessManager:
+    """
+    Runs child processes (rsync, robocopy, rm, ...) on one asyncio event loop in a background thread.
+
+    stdout and stderr of every process are read at the same time in chunks and split into lines ('\\n' and the '\\r'
+    of progress output), so a process writing thousands of errors never blocks on a full pipe. Lines longer than
+    `MAX_LINE` are split and only the last `STDERR_LINES` lines of stderr are kept, the memory per process is bounded.
+    A watchdog stops processes that run longer than their timeout or print nothing for their idle timeout
+    (e.g. rsync hanging on an unreachable network share). Finished processes are forgotten.
+
+    `run` blocks the calling thread until the process finished; the line callbacks are called in the thread of the loop,
+    so they must not block.
+    """
+    CHUNK_SIZE = 64 * 1024
+    MAX_LINE = 64 * 1024 # characters, longer lines are split
+    STDERR_LINES = 1000 # last lines of stderr kept for the result
+    KILL_GRACE = 10 # seconds between interrupting and killing a process
+    WATCH_INTERVAL = 1 # seconds between two checks of the watchdog
+
+    def __init__(self, os_type):
+        """
+        Initializes the ProcessManager, the event loop is started with the first process.
+
+        Args:
+            os_type (str): The operating system type ('linux' or 'windows').
+        """
+        self.logger = logging.getLogger(__name__)
+        self.os_type = os_type
+        self.loop = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.running = {} # pid: asyncio process, only touched in the loop
+
+    def run(self, cmd, on_stdout=None, on_stderr=None, input=None, timeout=None, idle_timeout=None, shell=False, encoding=None, **kwargs):
+        """
+        Runs a process and blocks until it finished.
+
+        Args:
+            cmd (list[str]): The command.
+            on_stdout (callable, optional): Called with every line of stdout (without line break).
+            on_stderr (callable, optional): Called with every line of stderr (without line break).
+            input (str, optional): Text written to stdin, which is closed afterwards (no stdin if None).
+            timeout (float, optional): Seconds the process may run, it is stopped afterwards.
+            idle_timeout (float, optional): Seconds the process may print nothing, it is stopped afterwards.
+            shell (bool): If True, the command is run by the shell (Windows builtins like 'RD').
+            encoding (str, optional): Encoding of the output, defaults to the one of the locale.
+            **kwargs: Further arguments for the process, e.g. 'creationflags'.
+
+        Returns:
+            ProcessResult: Exit code, the last lines of stderr and if the watchdog stopped it.
+
+        Raises:
+            OSError: If the process can't be started.
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self._run(cmd, on_stdout, on_stderr, input, timeout, idle_timeout, shell, encoding or locale.getpreferredencoding(False), kwargs),
+            self._get_loop())
+        return future.result()
+
+    def stop_all(self):
+        """Interrupts all running processes (Ctrl+C to their process group) and waits until they finished."""
+        with self.lock:
+            loop = self.loop
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._stop_all(), loop).result()
+
+    def count_running(self):
+        """
+        Returns the number of running processes.
+
+        Returns:
+            int: Processes started and not finished yet.
+        """
+        return len(self.running)
+
+    # ----------------------------- event loop -----------------------------
+
+    def _get_loop(self):
+        """Returns the event loop, starts it in a daemon thread on the first call."""
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop() # a ProactorEventLoop on Windows, which supports subprocesses
+                self.thread = threading.Thread(target=self.loop.run_forever, name="process-manager", daemon=True)
+                self.thread.start()
+            return self.loop
+
+    async def _run(self, cmd, on_stdout, on_stderr, input, timeout, idle_timeout, shell, encoding, kwargs):
+        """Starts the process, reads both streams concurrently and waits for it (runs in the loop)."""
+        if self.os_type == "linux":
+            kwargs.setdefault("start_new_session", True) # own process group, Ctrl+C reaches the whole group
+        stdin = subprocess.PIPE if input is not None else subprocess.DEVNULL
+        if shell:
+            process = await asyncio.create_subprocess_shell(subprocess.list2cmdline(cmd), stdin=stdin, stdout=subprocess.PIPE,
+                                                            stderr=subprocess.PIPE, **kwargs)
+        else:
+            process = await asyncio.create_subprocess_exec(*cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+        self.running[process.pid] = process
+        activity = [asyncio.get_running_loop().time()]
+        stderr = deque(maxlen=self.STDERR_LINES)
+        result = {"timed_out": None}
+        watchdog = None
+        try:
+            if timeout or idle_timeout:
+                watchdog = asyncio.ensure_future(self._watch(process, timeout, idle_timeout, activity, result))
+            def on_error(line):
+                stderr.append(line)
+                if on_stderr:
+                    on_stderr(line)
+            # stdin is written while the output is read, a process answering before it read everything can't block
+            await asyncio.gather(self._write(process.stdin, input, encoding),
+                                 self._read(process.stdout, on_stdout, encoding, activity),
+                                 self._read(process.stderr, on_error, encoding, activity))
+            returncode = await process.wait()
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            self.running.pop(process.pid, None)
+        return ProcessResult(returncode, list(stderr), result["timed_out"])
+
+    async def _write(self, stream, input, encoding):
+        """Writes the input to stdin and closes it (nothing to do without input)."""
+        if input is None:
+            return
+        try:
+            stream.write(input.encode(encoding))
+            await stream.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass # exited before reading everything, its exit code tells why
+        stream.close()
+
+    async def _read(self, stream, callback, encoding, activity):
+        """Reads a stream in chunks until it is closed and calls the callback with every line."""
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        loop = asyncio.get_running_loop()
+        pending = ""
+        while True:
+            chunk = await stream.read(self.CHUNK_SIZE)
+            activity[0] = loop.time()
+            pending += decoder.decode(chunk, final=not chunk)
+            lines = re.split(r"\r\n|\r|\n", pending)
+            pending = lines.pop()
+            if len(pending) > self.MAX_LINE:
+                lines.append(pending)
+                pending = ""
+            if not chunk and pending:
+                lines.append(pending)
+            for line in lines:
+                if callback:
+                    try:
+                        callback(line)
+                    except Exception as e: # the stream has to be drained anyway
+                        self.logger.error(f"_read(): line callback failed ({e})")
+            if not chunk:
+                return
+
+    async def _watch(self, process, timeout, idle_timeout, activity, result):
+        """Stops the process when it runs longer than `timeout` or prints nothing for `idle_timeout` seconds."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        while process.returncode is None:
+            await asyncio.sleep(self.WATCH_INTERVAL)
+            now = loop.time()
+            if timeout and now - start > timeout:
+                result["timed_out"] = "timeout"
+                self.logger.error(f"Process {process.pid} runs longer than {timeout:.0f}s, stopping it.")
+            elif idle_timeout and now - activity[0] > idle_timeout:
+                result["timed_out"] = "idle"
+                self.logger.error(f"Process {process.pid} printed nothing for {idle_timeout:.0f}s, stopping it.")
+            else:
+                continue
+            await self._terminate(process)
+            return
+
+    async def _stop_all(self):
+        """Stops all running processes at the same time."""
+        await asyncio.gather(*(self._terminate(process) for process in list(self.running.values())))
+
+    async def _terminate(self, process):
+        """Interrupts a process (Ctrl+C/Ctrl+Break to its group), kills it if it is still running after `KILL_GRACE` seconds."""
+        if process.returncode is not None:
+            return
+        try:
+            if self.os_type == "linux":
+                os.killpg(os.getpgid(process.pid), signal.SIGINT)
+            else:
+                process.send_signal(signal.CTRL_BREAK_EVENT)
+        except ProcessLookupError:
+            return # finished in the meantime
+        try:
+            await asyncio.wait_for(process.wait(), self.KILL_GRACE)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Process {process.pid} didn't stop, killing it.")
+            try:
+                if self.os_type == "linux":
+                    os.killpg(os.getpgid(process.pid), signal.SIGKILL)
+                else:
+                    process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+        self.logger.debug(f"Stopped process {process.pid}")
@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import time
+import pstats
+import logging
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime
+
+
+_active = None # the running Profiler, checked by mark()
+
+
+def mark(label):
+    """
+    Takes a memory snapshot of the running profiler (`main.py --profile-memory`), does nothing otherwise.
+    Called at points of the pipeline worth comparing, e.g. when the tasks start after preparing.
+
+    Args:
+        label (str): Name of the snapshot.
+    """
+    if _active is not None:
+        _active.snapshot(label)
+
+
+class Profiler:
+    """
+    Profiling mode of `main.py --profile`: runs the startup and the task pipeline under cProfile and optionally
+    tracemalloc, then writes 'profile_<time>.prof' (for pstats/snakeviz) and 'profile_<time>.json' next to the log
+    and prints the hottest functions and allocation sites.
+
+    cProfile only sees the thread that enabled it before Python 3.12, so every thread started while profiling
+    (executor, parallel copies, hashing) gets its own profiler through `threading.setprofile`; the results are merged.
+    Without `--profile` nothing of this is active, the pipeline only checks `mark()` once.
+    """
+    TOP = 25 # functions and allocation sites printed and stored
+    FRAMES = 10 # frames stored per allocation by tracemalloc
+
+    def __init__(self, output_dir, memory=False, top=None):
+        """
+        Initializes the Profiler.
+
+        Args:
+            output_dir (str): Directory of the result files (next to 'Task-Log.log').
+            memory (bool): If True, allocations are traced too (slows the run down noticeably).
+            top (int, optional): Number of functions and allocation sites to report.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.output_dir = str(output_dir)
+        self.memory = memory
+        self.top = top or self.TOP
+        self.profiles = []
+        self.lock = threading.Lock()
+        self.snapshots = [] # (label, tracemalloc snapshot)
+        self.start_time = None
+        self.seconds = 0.0
+        self.peak_memory = None
+
+    def start(self):
+        """Starts profiling this thread and all threads started from now on."""
+        global _active
+        if self.memory:
+            tracemalloc.start(self.FRAMES)
+        self.start_time = time.monotonic()
+        profile = cProfile.Profile()
+        self.profiles.append(profile)
+        if sys.version_info < (3, 12): # from 3.12 on one profiler sees all threads (sys.monitoring)
+            threading.setprofile(self._profile_thread)
+        profile.enable()
+        _active = self
+
+    def stop(self):
+        """Stops profiling, takes the last memory snapshot."""
+        global _active
+        _active = None
+        self.profiles[0].disable()
+        threading.setprofile(None)
+        self.seconds = time.monotonic() - self.start_time
+        if self.memory:
+            self.snapshot("end")
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def snapshot(self, label):
+        """
+        Takes a tracemalloc snapshot (only with memory tracing).
+
+        Args:
+            label (str): Name of the snapshot.
+        """
+        if self.memory and tracemalloc.is_tracing():
+            with self.lock:
+                self.snapshots.append((label, tracemalloc.take_snapshot()))
+
+    def report(self, stream=None):
+        """
+        Writes the result files and prints the summary.
+
+        Args:
+            stream (file, optional): Where to print the summary, defaults to stdout.
+
+        Returns:
+            dict: The summary also stored in the JSON file.
+        """
+        stream = stream or sys.stdout
+        name = f"profile_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+        prof_path = os.path.join(self.output_dir, f"{name}.prof")
+        json_path = os.path.join(self.output_dir, f"{name}.json")
+        with self.lock:
+            profiles = list(self.profiles)
+        stats = pstats.Stats(*profiles, stream=stream)
+        stats.dump_stats(prof_path)
+        summary = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "seconds": round(self.seconds, 3),
+            "threads": len(profiles),
+            "functions": self._get_functions(stats),
+            "allocations": self._get_allocations(),
+            "allocation_growth": self._get_growth(),
+            "peak_traced_memory": self.peak_memory,
+        }
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+        stream.write(f"\n---- Profile ({summary['seconds']:.1f}s, {len(profiles)} threads) ----\n")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        stream.write(f"Top {self.top} functions by own time:\n")
+        for function in summary["functions"]:
+            stream.write(f"  {function['tottime']:9.3f}s own {function['cumtime']:9.3f}s total {function['calls']:9d} calls  {function['function']}\n")
+        if self.memory:
+            stream.write(f"\nPeak traced memory: {summary['peak_traced_memory'] / (1024 * 1024):.1f} MB. Top allocation sites (at the end):\n")
+            for site in summary["allocations"]:
+                stream.write(f"  {site['size'] / 1024:10.1f} KB {site['count']:8d} blocks  {site['site']}\n")
+            if summary["allocation_growth"]:
+                stream.write(f"Growth since '{self.snapshots[0][0]}':\n")
+                for site in summary["allocation_growth"]:
+                    stream.write(f"  {site['size_diff'] / 1024:+10.1f} KB {site['count_diff']:+8d} blocks  {site['site']}\n")
+        stream.write(f"Written '{prof_path}' and '{json_path}'.\n")
+        stream.flush()
+        return summary
+
+    # ----------------------------- helpers -----------------------------
+
+    def _profile_thread(self, frame, event, arg):
+        """Profile function of new threads: replaces itself by a cProfile profiler of that thread on the first event."""
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def _get_functions(self, stats):
+        """Returns the functions with the most own time."""
+        functions = []
+        for (filename, line, function), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            functions.append({"function": f"{filename}:{line}({function})", "calls": calls,
+                              "tottime": round(tottime, 4), "cumtime": round(cumtime, 4)})
+        functions.sort(key=lambda entry: entry["tottime"], reverse=True)
+        return functions[:self.top]
+
+    def _get_allocations(self):
+        """Returns the allocation sites holding the most memory at the end."""
+        if not self.snapshots:
+            return []
+        snapshot = self._filter(self.snapshots[-1][1])
+        return [{"site": self._format(stat.traceback), "size": stat.size, "count": stat.count}
+                for stat in snapshot.statistics("lineno")[:self.top]]
+
+    def _get_growth(self):
+        """Returns the allocation sites that grew the most between the first and the last snapshot."""
+        if len(self.snapshots) < 2:
+            return []
+        first, last = self._filter(self.snapshots[0][1]), self._filter(self.snapshots[-1][1])
+        return [{"site": self._format(stat.traceback), "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+                for stat in last.compare_to(first, "lineno")[:self.top]]
+
+    def _filter(self, snapshot):
+        """Removes the allocations of tracemalloc and the import machinery."""
+        return snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                       tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                                       tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>")))
+
+    @staticmethod
+    def _format(traceback):
+        """Formats the innermost frame of an allocation."""
+        frame = traceback[0]
+        return f"{frame.filename}:{frame.lineno}"
@@ -0,0 +1,220 @@
+import queue
+import logging
+import threading
+
+
+class ProgressEvent:
+    """Base class of the events the executor publishes."""
+
+    def __repr__(self):
+        fields = ", ".join(f"{key}={value!r}" for key, value in vars(self).items())
+        return f"{type(self).__name__}({fields})"
+
+
+class MessageEvent(ProgressEvent):
+    """A line for the log (same arguments as `View.update_log`)."""
+
+    def __init__(self, text, tag=None, clear=False, update=False):
+        self.text = text
+        self.tag = tag
+        self.clear = clear
+        self.update = update
+
+
+class TaskStartedEvent(ProgressEvent):
+    """A task of the executor started."""
+
+    def __init__(self, task, current, total):
+        self.task = task
+        self.current = current
+        self.total = total
+
+
+class PhaseStartedEvent(ProgressEvent):
+    """A step of the running task started that the progress of the run weighs on its own (e.g. the manifest of the file backup)."""
+
+    def __init__(self, task, phase):
+        self.task = task
+        self.phase = phase
+
+
+class PercentEvent(ProgressEvent):
+    """Overall progress of the running task in percent."""
+
+    def __init__(self, task, percent):
+        self.task = task
+        self.percent = percent
+
+
+class BytesEvent(ProgressEvent):
+    """Bytes done for one source (only from backends which report them), `reused` of them taken from an older copy."""
+
+    def __init__(self, source, bytes, total_bytes, reused=0):
+        self.source = source
+        self.bytes = bytes
+        self.total_bytes = total_bytes
+        self.reused = reused
+
+
+class EtaEvent(ProgressEvent):
+    """Progress of the whole run (see ProgressModel): percent, smoothed throughput of the running task and remaining time."""
+
+    def __init__(self, task, percent, bytes_per_second=None, eta_seconds=None):
+        self.task = task
+        self.percent = percent
+        self.bytes_per_second = bytes_per_second
+        self.eta_seconds = eta_seconds
+
+
+class FileEvent(ProgressEvent):
+    """File currently copied for one source."""
+
+    def __init__(self, source, path):
+        self.source = source
+        self.path = path
+
+
+class ErrorEvent(ProgressEvent):
+    """A task failed."""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FinishedEvent(ProgressEvent):
+    """The executor finished (or stopped) all tasks."""
+
+
+class Subscription:
+    """Queue of the events for one consumer, drained by the consumer at its own pace."""
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.queue = queue.SimpleQueue()
+
+    def drain(self, coalesce=True):
+        """
+        Returns all events published since the last call.
+
+        Args:
+            coalesce (bool): If True, superseded progress events are dropped (see `ProgressBus.coalesce`).
+
+        Returns:
+            list[ProgressEvent]: The events in publishing order.
+        """
+        events = []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return ProgressBus.coalesce(events) if coalesce else events
+
+    def close(self):
+        """Stops receiving events."""
+        self.bus.unsubscribe(self)
+
+
+class ProgressBus:
+    """
+    Thread-safe publish/subscribe channel between the executor (worker threads) and its consumers (GUI, CLI, metrics).
+    Consumers either get a queue they drain themselves (the GUI on a `root.after` timer) or a callback that is
+    called in the publishing thread.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.subscriptions = []
+        self.callbacks = []
+
+    def subscribe(self, callback=None):
+        """
+        Subscribes to all events.
+
+        Args:
+            callback (callable, optional): Called with every event in the publishing thread.
+                If None, the events are queued in the returned subscription.
+
+        Returns:
+            Subscription or callable: The subscription to drain, or the callback.
+        """
+        with self.lock:
+            if callback:
+                self.callbacks.append(callback)
+                return callback
+            subscription = Subscription(self)
+            self.subscriptions.append(subscription)
+            return subscription
+
+    def unsubscribe(self, subscriber):
+        """
+        Removes a subscription or callback.
+
+        Args:
+            subscriber (Subscription or callable): Returned by `subscribe`.
+        """
+        with self.lock:
+            if subscriber in self.subscriptions:
+                self.subscriptions.remove(subscriber)
+            if subscriber in self.callbacks:
+                self.callbacks.remove(subscriber)
+
+    def publish(self, event):
+        """
+        Publishes an event to all subscribers.
+
+        Args:
+            event (ProgressEvent): The event.
+        """
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+            callbacks = list(self.callbacks)
+        for subscription in subscriptions:
+            subscription.queue.put(event)
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                self.logger.error(f"publish(): subscriber failed ({e})")
+
+    @staticmethod
+    def coalesce(events):
+        """
+        Drops events that are superseded by a later one: consecutive updating messages, percent and ETA events
+        are reduced to the last one, bytes and file events to the last one per source.
+
+        Args:
+            events (list[ProgressEvent]): Events in publishing order.
+
+        Returns:
+            list[ProgressEvent]: The remaining events in publishing order.
+        """
+        kept = []
+        latest = {}
+        for event in events:
+            if isinstance(event, (BytesEvent, FileEvent)):
+                key = (type(event), event.source)
+                if key in latest:
+                    kept[latest[key]] = None
+            elif isinstance(event, PercentEvent):
+                key = (PercentEvent, event.task)
+                if key in latest:
+                    kept[latest[key]] = None
+            elif isinstance(event, EtaEvent):
+                key = EtaEvent
+                if key in latest:
+                    kept[latest[key]] = None
+            elif isinstance(event, MessageEvent) and event.update:
+                # an update replaces the last line, so a preceding update is only dropped if no normal message came in between
+                key = MessageEvent
+                if key in latest:
+                    kept[latest[key]] = None
+            else:
+                if isinstance(event, MessageEvent):
+                    latest.pop(MessageEvent, None)
+                kept.append(event)
+                continue
+            latest[key] = len(kept)
+            kept.append(event)
+        return [event for event in kept if event is not None]
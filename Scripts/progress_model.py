@@ -0,0 +1,159 @@
+import time
+import logging
+import threading
+from progress_bus import TaskStartedEvent, PhaseStartedEvent, PercentEvent, EtaEvent
+
+
+def format_eta(event):
+    """
+    Formats the progress of the whole run for a status line.
+
+    Args:
+        event (EtaEvent): The progress.
+
+    Returns:
+        str: E.g. 'Total: 42.1%, 53.2 MB/s, 0:04:12 left'.
+    """
+    text = f"Total: {event.percent:.1f}%"
+    if event.bytes_per_second:
+        text += f", {event.bytes_per_second / (1024 * 1024):.1f} MB/s"
+    if event.eta_seconds is not None:
+        seconds = int(round(event.eta_seconds))
+        text += f", {seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d} left"
+    return text
+
+
+class ProgressModel:
+    """
+    Progress of the whole run over all tasks, weighted by the work they have to do instead of counting tasks or sources.
+
+    Every task is a phase with its amount of work (bytes for the file backup, its manifest and the verification, old backups for
+    cleaning) and an estimated rate; a phase weighs as much as the seconds it is expected to take. While a phase runs,
+    its throughput is measured from the progress it reports and smoothed with an exponentially weighted moving average
+    (EWMA), so a short stall or burst doesn't make the ETA jump. Phases that didn't start yet are estimated with `RATES`.
+
+    The model subscribes to the progress bus (task and phase starts, percent events) and publishes EtaEvents.
+    """
+    RATES = {"clean": 2, "file_backup": 50 * 1024 * 1024, "manifest": 150 * 1024 * 1024, "verify": 150 * 1024 * 1024} # estimated units per second
+    ALPHA = 0.3 # weight of the newest throughput sample
+    SAMPLE_INTERVAL = 1.0 # seconds between two throughput samples
+    PUBLISH_INTERVAL = 0.5 # seconds between two EtaEvents
+
+    def __init__(self, phases, publish_callback=None):
+        """
+        Initializes the ProgressModel.
+
+        Args:
+            phases (list[tuple]): (task, amount of work, True if the work is in bytes) in execution order.
+            publish_callback (callable, optional): Function to publish the EtaEvents (`ProgressBus.publish`).
+        """
+        self.logger = logging.getLogger(__name__)
+        self.publish = publish_callback
+        self.phases = {}
+        for task, total, is_bytes in phases:
+            self.phases[task] = {"total": max(0, total or 0), "done": 0, "rate": None, "is_bytes": is_bytes, "finished": False}
+        self.current = None
+        self.sample = None # (time, done) of the current phase at the last throughput sample
+        self.last_publish = 0.0
+        self.lock = threading.Lock()
+
+    def handle_event(self, event):
+        """
+        Subscriber of the progress bus.
+
+        Args:
+            event (ProgressEvent): A published event, task and phase starts and percent events update the model.
+        """
+        if isinstance(event, TaskStartedEvent):
+            self.start_phase(event.task)
+        elif isinstance(event, PhaseStartedEvent):
+            self.start_phase(event.phase)
+        elif isinstance(event, PercentEvent):
+            self.update(event.task, event.percent)
+
+    def start_phase(self, task):
+        """
+        Starts a phase, the running one counts as finished.
+
+        Args:
+            task (str): Name of the task.
+        """
+        with self.lock:
+            self._finish_current()
+            if task in self.phases:
+                self.current = task
+                self.sample = (time.monotonic(), 0)
+        self._publish(force=True)
+
+    def update(self, task, percent):
+        """
+        Stores the progress of a phase and samples its throughput.
+
+        Args:
+            task (str): Name of the task.
+            percent (float): Progress of the task in percent.
+        """
+        with self.lock:
+            phase = self.phases.get(task)
+            if phase is None:
+                return
+            phase["done"] = max(phase["done"], phase["total"] * min(percent, 100) / 100)
+            now = time.monotonic()
+            if task == self.current and self.sample is not None and now - self.sample[0] >= self.SAMPLE_INTERVAL:
+                rate = (phase["done"] - self.sample[1]) / (now - self.sample[0])
+                phase["rate"] = rate if phase["rate"] is None else self.ALPHA * rate + (1 - self.ALPHA) * phase["rate"]
+                self.sample = (now, phase["done"])
+        self._publish()
+
+    def finish(self):
+        """Finishes the running phase (at the end of the run)."""
+        with self.lock:
+            self._finish_current()
+        self._publish(force=True)
+
+    def get_state(self):
+        """
+        Returns the progress of the whole run.
+
+        Returns:
+            EtaEvent: Percent over all phases, smoothed throughput of the running phase (if it counts bytes and was measured)
+                and the estimated remaining seconds.
+        """
+        with self.lock:
+            expected = done = remaining = 0.0
+            for task, phase in self.phases.items():
+                estimate = self.RATES.get(task, 1)
+                expected += phase["total"] / estimate
+                done += min(phase["done"], phase["total"]) / estimate
+                if not phase["finished"]:
+                    # the measured rate once there is one, the estimate for the phases to come
+                    rate = phase["rate"] if task == self.current and phase["rate"] else estimate
+                    remaining += max(0, phase["total"] - phase["done"]) / rate
+            current = self.phases.get(self.current)
+            measured = current is not None and current["rate"] is not None
+            percent = 100 * done / expected if expected else 100.0 if all(p["finished"] for p in self.phases.values()) else 0.0
+            return EtaEvent(self.current, percent,
+                            bytes_per_second=current["rate"] if measured and current["is_bytes"] else None,
+                            eta_seconds=remaining)
+
+    # ----------------------------- helpers -----------------------------
+
+    def _finish_current(self):
+        """Marks the running phase as done (call with the lock held)."""
+        if self.current is not None:
+            phase = self.phases[self.current]
+            phase["done"] = phase["total"]
+            phase["finished"] = True
+        self.current = None
+        self.sample = None
+
+    def _publish(self, force=False):
+        """Publishes the current state, at most every `PUBLISH_INTERVAL` seconds."""
+        if not self.publish:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self.last_publish < self.PUBLISH_INTERVAL:
+                return
+            self.last_publish = now
+        self.publish(self.get_state())
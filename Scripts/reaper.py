@@ -0,0 +1,202 @@
+import os
+import stat
+import time
+import queue
+import logging
+import threading
+
+
+class Reaper:
+    """
+    Deletes old backups in the background.
+    Expired backups are first renamed into a trash directory on the same volume (instant), then removed by a
+    pool of scandir workers while the new backup is copying. The unlinks are rate-limited so the deletion
+    doesn't starve the copy. Whatever is left in the trash (stopped or crashed run) is removed on the next run.
+    """
+
+    def __init__(self, trash_dir, threads=4, rate=2000):
+        """
+        Initializes the Reaper.
+
+        Args:
+            trash_dir (str): Trash directory, must be on the same volume as the backups.
+            threads (int): Number of worker threads.
+            rate (int): Maximum number of deleted entries per second, 0 for no limit.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.trash_dir = str(trash_dir)
+        self.threads = max(1, threads)
+        self.rate = rate
+        self.rate_lock = threading.Lock()
+        self.next_slot = 0.0
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {"entries": 0, "bytes": 0, "errors": 0, "seconds": 0.0}
+
+    def trash(self, paths):
+        """
+        Moves backups into the trash directory.
+
+        Args:
+            paths (list[str]): Backups to delete.
+
+        Returns:
+            list[str]: Paths that couldn't be moved (e.g. other volume), they have to be deleted directly.
+        """
+        os.makedirs(self.trash_dir, exist_ok=True)
+        failed = []
+        for path in paths:
+            name = os.path.basename(os.path.normpath(path))
+            target = os.path.join(self.trash_dir, f"{name}.{time.time_ns()}")
+            try:
+                os.rename(path, target)
+                self.logger.debug(f"Moved '{path}' to the trash.")
+            except OSError as e:
+                self.logger.warning(f"Couldn't move '{path}' to the trash ({e}), deleting it directly.")
+                failed.append(path)
+        return failed
+
+    def start(self):
+        """
+        Starts deleting the content of the trash directory in a background thread.
+
+        Returns:
+            threading.Thread: The deleting thread.
+        """
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._reap, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def set_rate(self, rate):
+        """
+        Changes the rate limit (e.g. lifts it once the copy finished).
+
+        Args:
+            rate (int): Maximum number of deleted entries per second, 0 for no limit.
+        """
+        with self.rate_lock:
+            self.rate = rate
+
+    def wait(self):
+        """
+        Waits until the trash is empty (or the reaper was stopped).
+
+        Returns:
+            dict: Statistics (entries, bytes, errors, seconds).
+        """
+        if self.thread:
+            self.thread.join()
+        return self.stats
+
+    def stop(self):
+        """Stops deleting, the rest stays in the trash for the next run."""
+        self.stop_event.set()
+
+    def is_running(self):
+        """Returns True while the trash is being deleted."""
+        return self.thread is not None and self.thread.is_alive()
+
+    def _throttle(self):
+        """Blocks until the next delete is allowed by the rate limit."""
+        with self.rate_lock:
+            if not self.rate:
+                return
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + 1 / self.rate
+            delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def _reap(self):
+        """Deletes everything in the trash directory: files in parallel, then the emptied directories bottom-up."""
+        if not os.path.isdir(self.trash_dir):
+            return
+        start = time.monotonic()
+        dirs = queue.Queue()
+        lock = threading.Lock()
+        emptied = []
+        dirs.put(self.trash_dir)
+
+        def worker():
+            while True:
+                path = dirs.get()
+                if path is None:
+                    dirs.task_done()
+                    return
+                try:
+                    if not self.stop_event.is_set():
+                        entries, size, errors = self._clear_dir(path, dirs)
+                        with lock:
+                            emptied.append(path)
+                            self.stats["entries"] += entries
+                            self.stats["bytes"] += size
+                            self.stats["errors"] += errors
+                except OSError as e:
+                    self.logger.info(f"reap(): skipped '{path}' ({e})")
+                    with lock:
+                        self.stats["errors"] += 1
+                finally:
+                    dirs.task_done()
+
+        workers = [threading.Thread(target=worker, daemon=True) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        dirs.join()
+        for _ in workers:
+            dirs.put(None)
+        for thread in workers:
+            thread.join()
+
+        # deepest first, so every directory is empty when it is removed; the trash directory itself stays
+        emptied.sort(key=lambda path: path.count(os.sep), reverse=True)
+        for path in emptied:
+            if self.stop_event.is_set():
+                break
+            if path == self.trash_dir:
+                continue
+            try:
+                self._throttle()
+                os.rmdir(path)
+                self.stats["entries"] += 1
+            except OSError as e:
+                self.logger.info(f"reap(): couldn't remove '{path}' ({e})")
+                self.stats["errors"] += 1
+        self.stats["seconds"] = time.monotonic() - start
+        state = "stopped" if self.stop_event.is_set() else "finished"
+        self.logger.info(f"Reaper {state}: deleted {self.stats['entries']} entries ({self.stats['bytes'] / (1024 ** 3):.2f} GB) "
+                         f"in {self.stats['seconds']:.1f}s, {self.stats['errors']} errors.")
+
+    def _clear_dir(self, path, dirs):
+        """
+        Deletes the files of one directory and queues its subdirectories.
+
+        Returns:
+            tuple: (deleted entries, deleted bytes, errors)
+        """
+        entries = size = errors = 0
+        with os.scandir(path) as scan:
+            for entry in scan:
+                if self.stop_event.is_set():
+                    break
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.put(entry.path)
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                    self._throttle()
+                    try:
+                        os.unlink(entry.path)
+                    except PermissionError:
+                        # read-only files can't be deleted on Windows
+                        os.chmod(entry.path, stat.S_IWRITE)
+                        os.unlink(entry.path)
+                    entries += 1
+                    # hard-linked files (incremental snapshots) only free space with their last link
+                    if st.st_nlink <= 1:
+                        size += st.st_size
+                except OSError as e:
+                    self.logger.info(f"reap(): couldn't delete '{entry.path}' ({e})")
+                    errors += 1
+        return entries, size, errors
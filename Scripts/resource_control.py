@@ -0,0 +1,241 @@
+import os
+import re
+import time
+import shutil
+import logging
+import threading
+import subprocess
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting the bytes per second of all native copy threads together.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        Initializes the TokenBucket.
+
+        Args:
+            rate (float): Bytes per second.
+            burst (float, optional): Bytes that may be used at once after an idle time. Defaults to one second of rate.
+        """
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+        self.waited = 0.0
+
+    def consume(self, n):
+        """
+        Takes n bytes from the bucket, sleeps until they are available.
+
+        Args:
+            n (int): Number of bytes transferred.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.waited += delay
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ResourceControl:
+    """
+    Keeps backups from slowing down foreground work: lowers the CPU and I/O priority of the copy tools and of the
+    native copy threads, caps the bandwidth (rsync `--bwlimit`, robocopy `/IPG`, token bucket for the native engine)
+    and only lets rsync compress (`-z`) for remote destinations, where it saves network traffic.
+    """
+    PRIORITIES = {
+        # name: (nice, ionice class, ionice level, Windows priority class, Windows thread priority)
+        "normal": (0, None, None, 0, 0),
+        "low": (10, "2", "7", 0x00004000, -1), # BELOW_NORMAL_PRIORITY_CLASS, THREAD_PRIORITY_BELOW_NORMAL
+        "idle": (19, "3", None, 0x00000040, 0x00010000), # IDLE_PRIORITY_CLASS, THREAD_MODE_BACKGROUND_BEGIN (low I/O too)
+    }
+
+    def __init__(self, os_type, priority="low", bandwidth_limit=0, compress="auto"):
+        """
+        Initializes the ResourceControl.
+
+        Args:
+            os_type (str): The operating system type ('linux' or 'windows').
+            priority (str): 'normal', 'low' or 'idle'.
+            bandwidth_limit (float): Maximum MB/s of all copies together, 0 for no limit.
+            compress (str or bool): 'auto' (only for remote destinations), True or False.
+        """
+        if priority not in self.PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}'.")
+        self.logger = logging.getLogger(__name__)
+        self.os_type = os_type
+        self.priority = priority
+        self.bandwidth_limit = bandwidth_limit or 0
+        self.shared_limit = 0 # share of the destination's bandwidth (see locks.DestinationLease)
+        self.compress = compress
+        self.bucket = TokenBucket(self.bandwidth_limit * 1024 * 1024) if self.bandwidth_limit else None
+
+    @classmethod
+    def from_settings(cls, os_type, settings):
+        """
+        Creates the resource control from the settings of a host.
+
+        Args:
+            os_type (str): The operating system type ('linux' or 'windows').
+            settings (dict): Settings with 'io_priority', 'bandwidth_limit' and 'compress'.
+
+        Returns:
+            ResourceControl: The resource control.
+        """
+        return cls(os_type, priority=settings.get("io_priority", "low"),
+                   bandwidth_limit=settings.get("bandwidth_limit", 0), compress=settings.get("compress", "auto"))
+
+    def get_limit(self):
+        """
+        Returns the bandwidth limit in effect: the own limit or the share of the destination, whichever is lower.
+
+        Returns:
+            float: MB/s, 0 for no limit.
+        """
+        limits = [limit for limit in (self.bandwidth_limit, self.shared_limit) if limit]
+        return min(limits) if limits else 0
+
+    def set_shared_limit(self, limit):
+        """
+        Sets the share of the destination's bandwidth of this host. Applies to the native engine immediately,
+        to rsync/robocopy from their next start.
+
+        Args:
+            limit (float): MB/s, 0 for no limit.
+        """
+        self.shared_limit = limit or 0
+        rate = self.get_limit() * 1024 * 1024
+        if not rate:
+            return # throttle() only waits with a limit
+        if self.bucket is None:
+            self.bucket = TokenBucket(rate)
+        else:
+            with self.bucket.lock:
+                self.bucket.rate = rate
+                self.bucket.burst = rate
+
+    # ----------------------------- spawned tools -----------------------------
+
+    def wrap_command(self, cmd):
+        """
+        Prefixes a Linux command with `nice`/`ionice` for the configured priority.
+
+        Args:
+            cmd (list[str]): The command.
+
+        Returns:
+            list[str]: The command to run.
+        """
+        nice, io_class, io_level, _, _ = self.PRIORITIES[self.priority]
+        prefix = []
+        if io_class and shutil.which("ionice"):
+            prefix += ["ionice", "-c", io_class] + (["-n", io_level] if io_level else [])
+        if nice and shutil.which("nice"):
+            prefix += ["nice", "-n", str(nice)]
+        return prefix + cmd
+
+    def get_creationflags(self):
+        """
+        Returns the Windows priority class for spawned processes.
+
+        Returns:
+            int: Flag to add to the `creationflags` of subprocess.Popen.
+        """
+        return self.PRIORITIES[self.priority][3]
+
+    def get_rsync_args(self, dst):
+        """
+        Returns the rsync options for compression and bandwidth.
+
+        Args:
+            dst (str): Destination of the copy.
+
+        Returns:
+            list[str]: Options like '-z' and '--bwlimit=...'.
+        """
+        args = ["-z"] if self.use_compression(dst) else []
+        if self.get_limit():
+            args.append(f"--bwlimit={int(self.get_limit() * 1024)}") # KiB/s
+        return args
+
+    def get_robocopy_args(self):
+        """
+        Returns the robocopy options for the bandwidth: `/IPG` waits between two 64 KB blocks.
+
+        Returns:
+            list[str]: Options like '/IPG:...'.
+        """
+        if not self.get_limit():
+            return []
+        gap = int(64 * 1000 / (self.get_limit() * 1024)) # ms per 64 KB block
+        return [f"/IPG:{max(1, gap)}"]
+
+    def use_compression(self, dst):
+        """
+        Decides if rsync should compress. Compression only helps over a network connection of rsync itself
+        (`host:path`), for local disks and mounted shares it only costs CPU.
+
+        Args:
+            dst (str): Destination of the copy.
+
+        Returns:
+            bool: True if '-z' should be used.
+        """
+        if self.compress == "auto":
+            return re.match(r"^[^/\\]{2,}:", str(dst)) is not None # 'host:path', not 'C:\...'
+        return bool(self.compress)
+
+    # ----------------------------- native engine -----------------------------
+
+    def lower_current_thread(self):
+        """
+        Lowers the CPU and I/O priority of the calling thread (threads started by it inherit it on Linux).
+        Used by the native engine, which copies in the threads of this process.
+        """
+        nice, io_class, io_level, _, thread_priority = self.PRIORITIES[self.priority]
+        if self.priority == "normal":
+            return
+        try:
+            if self.os_type == "linux":
+                os.setpriority(os.PRIO_PROCESS, 0, max(os.getpriority(os.PRIO_PROCESS, 0), nice)) # 0: calling thread on Linux
+                if io_class and shutil.which("ionice"):
+                    cmd = ["ionice", "-c", io_class] + (["-n", io_level] if io_level else []) + ["-p", str(threading.get_native_id())]
+                    subprocess.run(cmd, check=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            elif self.os_type == "windows":
+                import ctypes
+                kernel32 = ctypes.windll.kernel32
+                kernel32.SetThreadPriority(kernel32.GetCurrentThread(), thread_priority)
+        except Exception as e:
+            self.logger.warning(f"Couldn't lower the priority of the copy thread ({e}).")
+
+    def throttle(self, n):
+        """
+        Waits as long as needed to stay below the bandwidth limit (native engine).
+
+        Args:
+            n (int): Number of bytes just transferred.
+        """
+        if self.bucket and self.get_limit():
+            self.bucket.consume(n)
+
+    def get_stats(self):
+        """
+        Returns the settings in effect and the time spent waiting for the bandwidth limit.
+
+        Returns:
+            dict: 'priority', 'bandwidth_limit' (MB/s), 'compress' and 'throttled_seconds'.
+        """
+        return {
+            "priority": self.priority,
+            "bandwidth_limit": self.get_limit(),
+            "compress": self.compress,
+            "throttled_seconds": round(self.bucket.waited, 3) if self.bucket else 0.0,
+        }
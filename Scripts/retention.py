@@ -0,0 +1,237 @@
+import os
+import re
+import json
+import logging
+from datetime import datetime
+from manifest import Manifest
+
+
+class Snapshot:
+    """
+    A dated backup in the host directory of a destination: a directory (`backup_YYYY-MM-DD`)
+    or an archive (`backup_YYYY-MM-DD.tar.gz`, see archive_writer.py).
+
+    Attributes:
+        path (str): Full path of the snapshot.
+        name (str): Name of the snapshot.
+        date (datetime.date): Date parsed from the name.
+        meta (dict): Content of the metadata file, empty if missing.
+        is_archive (bool): True if the snapshot is an archive file.
+    """
+
+    def __init__(self, path, name, date, meta):
+        self.path = path
+        self.name = name
+        self.date = date
+        self.meta = meta
+        self.is_archive = not os.path.isdir(path)
+
+    def get_paths(self):
+        """
+        Returns the paths belonging to the snapshot (an archive has its index and metadata next to it).
+
+        Returns:
+            list[str]: Existing paths.
+        """
+        if not self.is_archive:
+            return [self.path]
+        sidecars = [self.path + ".index.json", get_meta_path(self.path), Manifest.get_path(self.path)]
+        return [self.path] + [path for path in sidecars if os.path.exists(path)]
+
+    def get_reclaimable(self):
+        """
+        Returns the bytes freed by deleting this snapshot, taken from its metadata (size of the file for archives).
+        Incremental snapshots only free the data they wrote themselves, the rest is hard-linked.
+
+        Returns:
+            int or None: Bytes, None if the snapshot has no metadata.
+        """
+        if self.is_archive:
+            return sum(os.path.getsize(path) for path in self.get_paths())
+        if self.meta.get("mode") == "incremental" and self.meta.get("bytes_written") is not None:
+            return self.meta["bytes_written"]
+        return self.meta.get("bytes")
+
+
+class RetentionPlan:
+    """
+    Result of a retention policy: snapshots to keep and to delete.
+
+    Attributes:
+        keep (list[Snapshot]): Snapshots to keep, newest first.
+        delete (list[Snapshot]): Snapshots to delete, newest first.
+        reclaimable_bytes (int): Bytes freed by the deletion (from the snapshot metadata).
+        unknown (int): Number of snapshots to delete without metadata (not in `reclaimable_bytes`).
+    """
+
+    def __init__(self, keep, delete):
+        self.keep = keep
+        self.delete = delete
+        sizes = [snapshot.get_reclaimable() for snapshot in delete]
+        self.reclaimable_bytes = sum(size for size in sizes if size is not None)
+        self.unknown = sum(1 for size in sizes if size is None)
+
+
+class RetentionPolicy:
+    """
+    Grandfather-father-son retention of the dated backups.
+    Keeps the newest `last` snapshots, plus the newest snapshot of each of the most recent `daily` days,
+    `weekly` ISO weeks, `monthly` months and `yearly` years. Names are parsed strictly (`backup_%Y-%m-%d`,
+    archives with a '.tar', '.tar.gz', '.tar.xz' or '.tar.zst' suffix), everything else in the host directory is ignored.
+    """
+    META_FILE = ".snapshot.json"
+
+    def __init__(self, prefix="backup", last=3, daily=0, weekly=0, monthly=0, yearly=0):
+        """
+        Initializes the RetentionPolicy.
+
+        Args:
+            prefix (str): Prefix of the snapshot names.
+            last (int): Number of newest snapshots to keep.
+            daily (int): Number of days to keep a snapshot of.
+            weekly (int): Number of weeks to keep a snapshot of.
+            monthly (int): Number of months to keep a snapshot of.
+            yearly (int): Number of years to keep a snapshot of.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.prefix = prefix
+        self.pattern = re.compile(rf"^{re.escape(prefix)}_(\d{{4}}-\d{{2}}-\d{{2}})(\.tar(\.gz|\.xz|\.zst)?)?$")
+        self.counts = {"last": last, "daily": daily, "weekly": weekly, "monthly": monthly, "yearly": yearly}
+
+    @classmethod
+    def from_settings(cls, settings, prefix="backup"):
+        """
+        Creates a policy from the 'retention' setting of a host.
+
+        Args:
+            settings (dict): e.g. {'last': 3, 'weekly': 4, 'monthly': 6}.
+            prefix (str): Prefix of the snapshot names.
+
+        Returns:
+            RetentionPolicy: The policy.
+        """
+        counts = {key: int(settings.get(key, 0)) for key in ("last", "daily", "weekly", "monthly", "yearly")}
+        return cls(prefix=prefix, **counts)
+
+    def parse_name(self, name, archive=None):
+        """
+        Parses the date of a snapshot name.
+
+        Args:
+            name (str): Name of a directory entry.
+            archive (bool, optional): If given, only archive (True) or directory (False) names match.
+
+        Returns:
+            datetime.date or None: The date, None if the name is not a snapshot name.
+        """
+        match = self.pattern.match(name)
+        if not match or (archive is not None and bool(match.group(2)) != archive):
+            return None
+        try:
+            return datetime.strptime(match.group(1), "%Y-%m-%d").date()
+        except ValueError:
+            return None
+
+    def list_snapshots(self, host_dir):
+        """
+        Lists the snapshots in a host directory, newest first.
+
+        Args:
+            host_dir (str): Directory with the snapshots of one host.
+
+        Returns:
+            list[Snapshot]: The snapshots.
+        """
+        snapshots = []
+        with os.scandir(host_dir) as entries:
+            for entry in entries:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                date = self.parse_name(entry.name, archive=not is_dir)
+                if date is None:
+                    continue
+                snapshots.append(Snapshot(entry.path, entry.name, date, read_snapshot_meta(entry.path)))
+        snapshots.sort(key=lambda snapshot: snapshot.date, reverse=True)
+        return snapshots
+
+    def plan(self, host_dir, today=None):
+        """
+        Decides which snapshots to keep and which to delete. The snapshot of today is always kept.
+
+        Args:
+            host_dir (str): Directory with the snapshots of one host.
+            today (datetime.date, optional): Date of today (for testing).
+
+        Returns:
+            RetentionPlan: Snapshots to keep and to delete.
+        """
+        today = today or datetime.now().date()
+        snapshots = self.list_snapshots(host_dir)
+        keep = {snapshot.path for snapshot in snapshots if snapshot.date == today}
+        keep.update(snapshot.path for snapshot in snapshots[:self.counts["last"]])
+        periods = {
+            "daily": lambda date: date,
+            "weekly": lambda date: date.isocalendar()[:2],
+            "monthly": lambda date: (date.year, date.month),
+            "yearly": lambda date: date.year,
+        }
+        for bucket, period_of in periods.items():
+            seen = set()
+            for snapshot in snapshots:
+                if len(seen) >= self.counts[bucket]:
+                    break
+                period = period_of(snapshot.date)
+                if period not in seen:
+                    seen.add(period)
+                    keep.add(snapshot.path)
+        plan = RetentionPlan([s for s in snapshots if s.path in keep], [s for s in snapshots if s.path not in keep])
+        self.logger.debug(f"Retention {self.counts}: keeping {[s.name for s in plan.keep]}, deleting {[s.name for s in plan.delete]}.")
+        return plan
+
+
+def get_meta_path(snapshot_path):
+    """
+    Returns the path of the metadata file of a snapshot: inside a directory, next to an archive.
+
+    Args:
+        snapshot_path (str): Path of the snapshot.
+
+    Returns:
+        str: Path of the metadata file.
+    """
+    snapshot_path = str(snapshot_path)
+    if os.path.isdir(snapshot_path):
+        return os.path.join(snapshot_path, RetentionPolicy.META_FILE)
+    return snapshot_path + RetentionPolicy.META_FILE
+
+
+def read_snapshot_meta(snapshot_path):
+    """
+    Reads the metadata file of a snapshot.
+
+    Args:
+        snapshot_path (str): Path of the snapshot.
+
+    Returns:
+        dict: The metadata, empty if missing or unreadable.
+    """
+    try:
+        with open(get_meta_path(snapshot_path), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_snapshot_meta(snapshot_path, meta):
+    """
+    Writes the metadata file of a snapshot (merged with existing metadata).
+
+    Args:
+        snapshot_path (str): Path of the snapshot.
+        meta (dict): Values to store, e.g. 'bytes', 'files', 'mode', 'bytes_written'.
+    """
+    data = read_snapshot_meta(snapshot_path)
+    data.update(meta)
+    meta_path = get_meta_path(snapshot_path)
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(meta_path + ".tmp", meta_path)
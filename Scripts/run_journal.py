@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+
+
+class SourceCheckpoint:
+    """
+    Finished first-level subtrees of one source, handed to the copy handler.
+    The native engine skips the finished ones when resuming and reports every subtree whose files are all copied.
+    """
+
+    def __init__(self, journal, src):
+        """
+        Initializes the SourceCheckpoint.
+
+        Args:
+            journal (RunJournal): The journal of the snapshot.
+            src (str): Source path.
+        """
+        self.journal = journal
+        self.src = src
+        self.done = set(journal.get_source(src).get("subtrees", []))
+
+    def is_done(self, rel):
+        """
+        Checks if a subtree was finished by an earlier (interrupted) run.
+
+        Args:
+            rel (str): Name of the first-level directory in the source.
+
+        Returns:
+            bool: True if all its files were copied.
+        """
+        return rel in self.done
+
+    def mark_done(self, rel):
+        """
+        Records that all files of a subtree are copied.
+
+        Args:
+            rel (str): Name of the first-level directory in the source.
+        """
+        self.journal.mark_subtree(self.src, rel)
+
+
+class RunJournal:
+    """
+    Progress of the file backup written to '.run_journal.json' in the snapshot directory, so a backup stopped
+    or interrupted by a crash or suspend is resumed instead of started over: finished sources are skipped and the
+    native engine doesn't even scan the finished first-level subtrees of the partially copied source (rsync and
+    robocopy skip the copied files by their quick check).
+
+    A completed run marks the journal 'complete', a later run of the same day mirrors everything again.
+    """
+    FILE = ".run_journal.json"
+    VERSION = 1
+    FLUSH_INTERVAL = 2 # seconds between two writes of finished subtrees
+
+    def __init__(self, snapshot_path):
+        """
+        Initializes the RunJournal.
+
+        Args:
+            snapshot_path (str): Directory of the snapshot.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.path = os.path.join(str(snapshot_path), self.FILE)
+        self.data = {"version": self.VERSION, "started": None, "complete": False, "sources": {}}
+        self.lock = threading.Lock()
+        self.last_save = 0.0
+
+    def load(self):
+        """
+        Reads the journal of an earlier run of this snapshot.
+
+        Returns:
+            bool: True if that run didn't complete and can be resumed.
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Couldn't read the run journal '{self.path}' ({e}), starting over.")
+            return False
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            return False
+        self.data = data
+        return not data.get("complete")
+
+    def start(self, started, resume=False):
+        """
+        Starts the journal of this run.
+
+        Args:
+            started (str): Start of the run (ISO format), kept from the interrupted run when resuming.
+            resume (bool): If True, the finished sources and subtrees of the loaded journal are kept.
+        """
+        with self.lock:
+            if not resume:
+                self.data = {"version": self.VERSION, "started": started, "complete": False, "sources": {}}
+            self.data["resumed"] = datetime.now().isoformat(timespec="seconds") if resume else None
+        self.save()
+
+    def get_started(self):
+        """
+        Returns the start of the run the snapshot belongs to.
+
+        Returns:
+            str or None: ISO format.
+        """
+        return self.data.get("started")
+
+    def get_source(self, src):
+        """
+        Returns the entry of a source.
+
+        Args:
+            src (str): Source path.
+
+        Returns:
+            dict: 'status' ('running', 'done', 'failed' or 'stopped'), 'code' and 'subtrees', empty if not started yet.
+        """
+        with self.lock:
+            return dict(self.data["sources"].get(os.path.normpath(src), {}))
+
+    def is_done(self, src):
+        """
+        Checks if a source was copied completely by an earlier run.
+
+        Args:
+            src (str): Source path.
+
+        Returns:
+            bool: True if its copy finished with return code 0.
+        """
+        return self.get_source(src).get("status") == "done"
+
+    def start_source(self, src):
+        """
+        Marks a source as running (its finished subtrees are kept).
+
+        Args:
+            src (str): Source path.
+        """
+        with self.lock:
+            entry = self.data["sources"].setdefault(os.path.normpath(src), {"subtrees": []})
+            entry.update({"status": "running", "code": None})
+        self.save()
+
+    def get_checkpoint(self, src):
+        """
+        Returns the finished subtrees of a source and starts its entry.
+
+        Args:
+            src (str): Source path.
+
+        Returns:
+            SourceCheckpoint: Checkpoint for the copy handler.
+        """
+        self.start_source(src)
+        return SourceCheckpoint(self, src)
+
+    def mark_subtree(self, src, rel):
+        """
+        Records a finished first-level subtree of a source (written at most every `FLUSH_INTERVAL` seconds).
+
+        Args:
+            src (str): Source path.
+            rel (str): Name of the subtree.
+        """
+        with self.lock:
+            entry = self.data["sources"].setdefault(os.path.normpath(src), {"status": "running", "code": None, "subtrees": []})
+            if rel not in entry["subtrees"]:
+                entry["subtrees"].append(rel)
+            due = time.monotonic() - self.last_save >= self.FLUSH_INTERVAL
+        if due:
+            self.save()
+
+    def finish_source(self, src, code):
+        """
+        Records the end of the copy of a source.
+
+        Args:
+            src (str): Source path.
+            code (int): Return code of the copy (0 = done, 20 = stopped, other = failed).
+        """
+        status = "done" if code == 0 else "stopped" if code == 20 else "failed"
+        with self.lock:
+            entry = self.data["sources"].setdefault(os.path.normpath(src), {"subtrees": []})
+            entry.update({"status": status, "code": code})
+            if status == "done":
+                entry["subtrees"] = [] # the source is skipped as a whole
+        self.save()
+
+    def complete(self):
+        """Marks the run as complete, the next run of this snapshot starts over."""
+        with self.lock:
+            self.data["complete"] = True
+        self.save()
+
+    def count_done(self):
+        """
+        Returns the number of finished sources.
+
+        Returns:
+            int: Sources with status 'done'.
+        """
+        with self.lock:
+            return sum(1 for entry in self.data["sources"].values() if entry.get("status") == "done")
+
+    def save(self):
+        """Writes the journal atomically (failures are only logged, the backup goes on without checkpoints)."""
+        with self.lock:
+            content = json.dumps(self.data)
+            self.last_save = time.monotonic()
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(content)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                self.logger.warning(f"Couldn't write the run journal '{self.path}': {e}")
@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+
+def get_peak_memory():
+    """
+    Returns the peak resident memory of this process and of its largest child process (e.g. rsync).
+    Both are maxima over the lifetime of the process, for the daemon they include the earlier runs. On Linux a child
+    started by fork counts with at least the memory of this process at the fork.
+
+    Returns:
+        tuple: (own bytes, children bytes), None where it is unknown.
+    """
+    try:
+        import resource
+    except ImportError: # Windows
+        try:
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                            ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                            ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+                return counters.PeakWorkingSetSize, None
+        except Exception:
+            pass
+        return None, None
+    scale = 1 if sys.platform == "darwin" else 1024 # ru_maxrss is in bytes on macOS, in KiB elsewhere
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+class RunMetrics:
+    """
+    Performance metrics of one run: wall time per phase (preparing, waiting for the destination, every task),
+    bytes and files transferred, throughput and peak memory.
+
+    At the end of the run one JSON line is appended to the history file, and with a textfile directory the last run
+    is written as Prometheus metrics for the textfile collector of node_exporter (`--collector.textfile.directory`),
+    so the throughput can be graphed over time and an alert can fire when it drops or the last success gets too old.
+    """
+    PREFIX = "backup"
+
+    def __init__(self, hostname=None, history_path=None, textfile_dir=None):
+        """
+        Initializes the RunMetrics, the wall time of the run starts now.
+
+        Args:
+            hostname (str, optional): Name of the host, used as label.
+            history_path (str, optional): JSON lines file the runs are appended to, None for no history.
+            textfile_dir (str, optional): Directory of the node_exporter textfile collector, None for no textfile.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.hostname = hostname
+        self.history_path = str(history_path) if history_path else None
+        self.textfile_dir = str(textfile_dir) if textfile_dir else None
+        self.started = time.time()
+        self.start = time.monotonic()
+        self.phases = {} # name: seconds (summed if a phase runs several times)
+        self.tasks = {} # task: values recorded by the executor
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Measures the wall time of a phase.
+
+        Args:
+            name (str): Name of the phase, e.g. 'prepare', 'clean' or 'copy'.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.monotonic() - start
+
+    def record(self, task, **values):
+        """
+        Stores values of a task (e.g. bytes=..., files=...), numbers are added to earlier values of the same key.
+
+        Args:
+            task (str): Name of the task.
+            **values: The values.
+        """
+        with self.lock:
+            entry = self.tasks.setdefault(task, {})
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and isinstance(entry.get(key), (int, float)):
+                    entry[key] += value
+                else:
+                    entry[key] = value
+
+    def get_summary(self, status):
+        """
+        Builds the record of the run.
+
+        Args:
+            status (str): 'success', 'error' or 'stopped'.
+
+        Returns:
+            dict: The record (see the history file).
+        """
+        own_memory, children_memory = get_peak_memory()
+        with self.lock:
+            phases = {name: round(seconds, 3) for name, seconds in self.phases.items()}
+            tasks = {task: dict(values) for task, values in self.tasks.items()}
+        backup = tasks.get("file_backup", {})
+        copy_seconds = phases.get("copy") or phases.get("file_backup") or 0.0
+        transferred = backup.get("bytes", 0)
+        files = backup.get("files", 0)
+        return {
+            "host": self.hostname,
+            "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "finished": datetime.now().isoformat(timespec="seconds"),
+            "status": status,
+            "seconds": round(time.monotonic() - self.start, 3),
+            "phases": phases,
+            "tasks": tasks,
+            "bytes": transferred,
+            "files": files,
+            "bytes_per_second": round(transferred / copy_seconds, 1) if copy_seconds else 0.0,
+            "files_per_second": round(files / copy_seconds, 2) if copy_seconds else 0.0,
+            "peak_memory": own_memory,
+            "peak_memory_children": children_memory,
+        }
+
+    def finish(self, status):
+        """
+        Ends the run: appends it to the history file and writes the textfile. Failures are only logged,
+        the metrics must never fail a backup.
+
+        Args:
+            status (str): 'success', 'error' or 'stopped'.
+
+        Returns:
+            dict: The record of the run.
+        """
+        summary = self.get_summary(status)
+        self.logger.info(f"Run {status} in {summary['seconds']:.1f}s: {summary['files']} files, "
+                         f"{summary['bytes'] / (1024 * 1024):.1f} MB transferred ({summary['bytes_per_second'] / (1024 * 1024):.1f} MB/s), "
+                         f"phases: {', '.join(f'{name} {seconds:.1f}s' for name, seconds in summary['phases'].items())}.")
+        last_success = time.time() if status == "success" else self._get_last_success()
+        if self.history_path:
+            try:
+                with open(self.history_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(summary) + "\n")
+            except OSError as e:
+                self.logger.warning(f"Couldn't append the run to '{self.history_path}': {e}")
+        if self.textfile_dir:
+            try:
+                self.write_textfile(summary, last_success)
+            except OSError as e:
+                self.logger.warning(f"Couldn't write the metrics textfile to '{self.textfile_dir}': {e}")
+        return summary
+
+    def write_textfile(self, summary, last_success=None):
+        """
+        Writes the run in the Prometheus text format to `<textfile_dir>/backup_<hostname>.prom`
+        (through a temporary file, node_exporter must never read a half-written file).
+
+        Args:
+            summary (dict): The record of the run (see `get_summary`).
+            last_success (float, optional): Epoch seconds of the last successful run.
+        """
+        host = {"host": self.hostname or ""}
+        finished = datetime.fromisoformat(summary["finished"]).timestamp()
+        metrics = [
+            ("last_run_timestamp_seconds", "End of the last run.", [(host, finished)]),
+            ("last_run_success", "1 if the last run finished without errors.", [(host, int(summary["status"] == "success"))]),
+            ("last_run_duration_seconds", "Wall time of the last run.", [(host, summary["seconds"])]),
+            ("last_run_phase_duration_seconds", "Wall time of the phases of the last run.",
+             [({**host, "phase": name}, seconds) for name, seconds in summary["phases"].items()]),
+            ("last_run_transferred_bytes", "Bytes copied by the last run (hard-linked files not counted).", [(host, summary["bytes"])]),
+            ("last_run_transferred_files", "Files copied by the last run.", [(host, summary["files"])]),
+            ("last_run_throughput_bytes_per_second", "Copied bytes per second of the copy phase.", [(host, summary["bytes_per_second"])]),
+            ("last_run_files_per_second", "Copied files per second of the copy phase.", [(host, summary["files_per_second"])]),
+            ("last_run_peak_memory_bytes", "Peak resident memory of the backup process and its largest child process.",
+             [({**host, "process": process}, value) for process, value in (("self", summary["peak_memory"]),
+                                                                           ("children", summary["peak_memory_children"]))
+              if value is not None]),
+        ]
+        if last_success:
+            metrics.append(("last_success_timestamp_seconds", "End of the last successful run.", [(host, last_success)]))
+        lines = []
+        for name, help_text, samples in metrics:
+            if not samples:
+                continue
+            lines.append(f"# HELP {self.PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {self.PREFIX}_{name} gauge")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{self._escape(label)}"' for key, label in labels.items())
+                lines.append(f"{self.PREFIX}_{name}{{{label_text}}} {value}")
+        os.makedirs(self.textfile_dir, exist_ok=True)
+        path = os.path.join(self.textfile_dir, f"{self.PREFIX}_{self.hostname or 'host'}.prom")
+        tmp_path = f"{path}.{os.getpid()}.tmp" # the collector only reads '*.prom'
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+    # ----------------------------- helpers -----------------------------
+
+    def _get_last_success(self):
+        """Returns the end of the last successful run from the history file (epoch seconds), None if there is none."""
+        if not self.history_path or not os.path.isfile(self.history_path):
+            return None
+        last = None
+        try:
+            with open(self.history_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        run = json.loads(line)
+                    except ValueError:
+                        continue # line of a crashed run
+                    if run.get("status") == "success":
+                        last = run.get("finished")
+        except OSError:
+            return None
+        return datetime.fromisoformat(last).timestamp() if last else None
+
+    @staticmethod
+    def _escape(value):
+        """Escapes a label value for the Prometheus text format."""
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
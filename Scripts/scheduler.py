@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import signal
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime, timedelta
+
+from headless import Headless
+from locks import PidLock
+
+
+class Scheduler:
+    """
+    Long-running daemon (`main.py --daemon`) running the tasks of the host's 'schedule' setting periodically
+    without GUI, through the same Headless runner as `--fast`.
+
+    Only the time of the last successful run is stored, so runs missed while the computer was off or asleep are
+    made up by a single run. If the destination isn't mounted or a run fails, it retries with increasing delays.
+    Between two checks it sleeps (at most `MAX_SLEEP` seconds, so a resume from suspend is noticed), a PID lock
+    prevents a second daemon for the same host.
+    """
+    MAX_SLEEP = 300 # seconds
+    RETRY_MIN = 60 # seconds until the first retry, doubled per failure
+    RETRY_MAX = 3600
+
+    def __init__(self, testing=False):
+        """
+        Initializes the scheduler by loading the host profile like the headless mode.
+
+        Args:
+            testing (bool): If True, uses the test host.
+        """
+        self.testing = testing
+        self.headless = Headless(testing=testing)
+        self.filehandler = self.headless.filehandler
+        self.hostname = self.headless.hostname
+        self.logger = logging.getLogger(__name__)
+        base = Path(self.filehandler.config_path).parent
+        self.state_path = base.joinpath(f"scheduler_{self.hostname}.json")
+        self.lock = PidLock(base.joinpath(f"scheduler_{self.hostname}.pid"))
+        self.stop_event = threading.Event()
+        self.config_mtime = os.path.getmtime(self.filehandler.config_path)
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def run(self):
+        """
+        Runs the scheduled tasks until SIGINT/SIGTERM.
+
+        Returns:
+            int: Exit code (0 = stopped normally, 1 = another daemon runs for this host).
+        """
+        if not self.lock.acquire():
+            self.logger.error(f"The scheduler already runs for '{self.hostname}' (process {self.lock.get_owner()}).")
+            return 1
+        try:
+            self._install_signals()
+            self.logger.info(f"Scheduler started for '{self.hostname}'.")
+            while not self.stop_event.is_set():
+                self._reload_config()
+                schedule = self.get_schedule()
+                if schedule is None:
+                    self.stop_event.wait(self.MAX_SLEEP)
+                    continue
+                due = max(self.get_next_run(schedule), self.retry_at)
+                now = time.time()
+                if now < due:
+                    self.stop_event.wait(min(due - now, self.MAX_SLEEP))
+                    continue
+                self._run_tasks(schedule["tasks"])
+            self.logger.info("Scheduler stopped.")
+            return 0
+        finally:
+            self.lock.release()
+
+    def get_schedule(self):
+        """
+        Returns the schedule of the host, filled with defaults.
+
+        Returns:
+            dict or None: 'interval' (hours), 'at' (time of day 'HH:MM' or None) and 'tasks', None if not scheduled.
+        """
+        schedule = self.filehandler.get_settings().get("schedule")
+        if not schedule:
+            return None
+        return {"interval": float(schedule.get("interval", 24)), "at": schedule.get("at"),
+                "tasks": schedule.get("tasks") or Headless.DEFAULT_TASKS}
+
+    def get_next_run(self, schedule):
+        """
+        Computes when the next run is due.
+        With 'at' the runs are aligned to that time of day, a late run (e.g. after suspend) doesn't shift the next one.
+
+        Args:
+            schedule (dict): The schedule (see `get_schedule`).
+
+        Returns:
+            float: Epoch seconds, 0 if there was no run yet.
+        """
+        last_run = self._load_state().get("last_run")
+        if not last_run:
+            return 0.0
+        last = datetime.fromtimestamp(last_run)
+        if schedule["at"]:
+            hour, minute = (int(part) for part in str(schedule["at"]).split(":"))
+            due = last.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if due <= last:
+                due += timedelta(days=1)
+            due += timedelta(days=max(1, round(schedule["interval"] / 24)) - 1)
+            return due.timestamp()
+        return last_run + schedule["interval"] * 3600
+
+    # ----------------------------- helpers -----------------------------
+
+    def _run_tasks(self, tasks):
+        """Runs the tasks once if the destination is available, schedules a retry otherwise."""
+        dest = (self.filehandler.userDict.get("info") or {}).get("last_selected_dest")
+        if not dest or not os.path.isdir(dest) or not os.access(dest, os.W_OK):
+            self._retry_later(f"destination '{dest}' isn't mounted")
+            return
+        self.logger.info(f"Scheduled run of {', '.join(tasks)}.")
+        started = time.time()
+        headless = Headless(testing=self.testing, tasks=tasks)
+        code = headless.run()
+        self._install_signals() # the run replaced them with its own
+        if code == 130:
+            self.stop_event.set() # stopped by SIGINT/SIGTERM
+        elif code == 0:
+            self.failures = 0
+            self.retry_at = 0.0
+            self._save_state({"last_run": started, "last_code": code})
+            self.logger.info("Scheduled run finished.")
+        else:
+            self._retry_later(f"the run failed (exit code {code})")
+
+    def _retry_later(self, reason):
+        """Schedules a retry with exponential backoff."""
+        delay = min(self.RETRY_MAX, self.RETRY_MIN * 2 ** self.failures)
+        self.failures += 1
+        self.retry_at = time.time() + delay
+        self.logger.warning(f"Scheduled run postponed, {reason}. Retrying in {delay // 60} min.")
+
+    def _reload_config(self):
+        """Reads 'config.yaml' again if it was changed (e.g. a new schedule)."""
+        try:
+            mtime = os.path.getmtime(self.filehandler.config_path)
+        except OSError:
+            return
+        if mtime != self.config_mtime:
+            self.config_mtime = mtime
+            self.filehandler.parse_yaml()
+            if self.filehandler.search_user():
+                self.filehandler.get_userContent()
+                self.logger.info("Reloaded 'config.yaml'.")
+
+    def _load_state(self):
+        """Reads the state file (time of the last successful run)."""
+        try:
+            with open(self.state_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, state):
+        """Writes the state file atomically."""
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _install_signals(self):
+        """Stops the scheduler on SIGINT/SIGTERM."""
+        def handle_signal(signum, frame):
+            self.stop_event.set()
+        signal.signal(signal.SIGINT, handle_signal)
+        signal.signal(signal.SIGTERM, handle_signal)
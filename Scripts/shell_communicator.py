@@ -1,23 +1,34 @@
 import re
-import signal
 import subprocess
 import logging
 import os
+import time
+from resource_control import ResourceControl
+from process_manager import ProcessManager
 
 class ShellCommunicator:
     """
     Handles shell-based file operations like copy and delete for Linux and Windows systems.
+    The processes run on the event loop of a ProcessManager, which reads their stdout and stderr concurrently.
     """
+    BATCH_COMMAND_LENGTH = 8000 # characters of file names per robocopy batch (the command line is limited)
 
-    def __init__(self, os_type):
+    def __init__(self, os_type, resources=None, timeout=None, idle_timeout=None):
         """
         Initialize the shell communicator for the specified operating system.
 
         Args:
             os_type (str): The operating system type ('linux' or 'windows').
+            resources (ResourceControl, optional): Priority, bandwidth limit and compression of the copies.
+            timeout (float, optional): Seconds a single copy may run, None for no limit.
+            idle_timeout (float, optional): Seconds a copy may print nothing (e.g. hanging network share), None for no limit.
         """
         self.logger = logging.getLogger(__name__)
-        self.running_procs = []
+        self.resources = resources or ResourceControl(os_type, priority="normal")
+        self.processes = ProcessManager(os_type)
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.stats = {} # src: statistics of the last copy, parsed from the summary of rsync/robocopy
         self.os_type = os_type
         threads = os.cpu_count()
         self.threads_to_use = 16
@@ -102,8 +113,7 @@ class ShellCommunicator:
             cmd = ["RD", "/S", "/Q", dir]
         else:
             cmd = ["del", "/F", dir]
-        result = subprocess.run(cmd, check=True, shell=True, creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
-        return result
+        return self._run_checked(cmd, shell=True, creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
 
     def _delete_linux(self, dir):
         """
@@ -113,66 +123,376 @@ class ShellCommunicator:
             dir (str): Path to file or folder.
         """
         cmd = ["rm", "-rf", dir]
-        result = subprocess.run(cmd, check=True, shell=False)
+        return self._run_checked(cmd)
+
+    def _run_checked(self, cmd, **kwargs):
+        """
+        Runs a command and waits for it.
+
+        Args:
+            cmd (list[str]): The command.
+            **kwargs: Further arguments of `ProcessManager.run`.
+
+        Returns:
+            ProcessResult: The result.
+
+        Raises:
+            subprocess.CalledProcessError: If the command failed.
+        """
+        result = self.processes.run(cmd, **kwargs)
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, cmd, stderr="\n".join(result.stderr))
         return result
 
-    def copy(self, src, dst):
+    def copy(self, src, dst, link_dest=None, filters=None, on_line=None):
         """
-        Copies a file or directory from src to dst using OS-specific tools.
+        Copies a file or directory from src to dst using OS-specific tools and blocks until the copy is finished.
 
         Args:
             src (str): Source path.
             dst (str): Destination path.
+            link_dest (str, optional): Previous snapshot, unchanged files are hard-linked from it instead of copied.
+            filters (PathFilter, optional): Include/exclude rules of the source.
+            on_line (callable, optional): Called with every line of stdout (in the thread of the process manager).
 
         Returns:
-            subprocess.Popen: The process object handling the copy.
+            ProcessResult: Exit code and the last lines of stderr of the copy.
         """
         self.logger.debug(f"Now backupping '{src}' to '{dst}' ...")
         try:
             match self.os_type:
                 case "linux":
-                    process = self._copy_linux(src, dst)
+                    command = self._copy_linux(src, dst, link_dest, filters)
                 case "windows":
-                    process = self._copy_windows(src, dst)
-            self.running_procs.append(process)
-            return process
+                    if link_dest:
+                        self.logger.warning("copy(): robocopy can't hard-link from a previous snapshot, making a full copy. Use the native backend for incremental snapshots.")
+                    command = self._copy_windows(src, dst, filters)
+            return self._run_copy_command(command, on_line)
         except Exception as e:
             self.logger.error(f"copy(): Error ({e}).")
             raise e
 
-    def _copy_linux(self, src, dst):
+    def copy_batch(self, files, dst, link_dest=None, on_line=None, on_error=None):
+        """
+        Copies several files into dst with one process (`rsync --files-from`, robocopy with a list of file names)
+        and blocks until the copy is finished.
+
+        Args:
+            files (list[str]): Source files, for robocopy all in the same directory.
+            dst (str): Destination directory.
+            link_dest (str, optional): Previous snapshot, unchanged files are hard-linked from it instead of copied.
+            on_line (callable, optional): Called with every line of stdout (in the thread of the process manager).
+            on_error (callable, optional): Called with every line of stderr (in the thread of the process manager).
+
+        Returns:
+            ProcessResult: Exit code and the last lines of stderr of the copy.
+        """
+        self.logger.debug(f"Now backupping {len(files)} files to '{dst}' ...")
+        try:
+            match self.os_type:
+                case "linux":
+                    command = self._copy_batch_linux(files, dst, link_dest)
+                case "windows":
+                    if link_dest:
+                        self.logger.warning("copy_batch(): robocopy can't hard-link from a previous snapshot, making a full copy. Use the native backend for incremental snapshots.")
+                    command = self._copy_batch_windows(files, dst)
+            return self._run_copy_command(command, on_line, on_error)
+        except Exception as e:
+            self.logger.error(f"copy_batch(): Error ({e}).")
+            raise e
+
+    def _run_copy_command(self, command, on_line, on_error=None):
         """
-        Performs a copy using rsync on Linux.
+        Runs a copy command with the timeouts of the copies, errors of the tool are logged as they come.
+
+        Args:
+            command (dict): Arguments of `ProcessManager.run` ('cmd', 'input', ...).
+            on_line (callable, optional): Called with every line of stdout.
+            on_error (callable, optional): Called with every line of stderr (after logging it).
+
+        Returns:
+            ProcessResult: The result.
+        """
+        def on_stderr(line):
+            self.logger.error(f"copy: {line.strip()}")
+            if on_error:
+                on_error(line)
+
+        result = self.processes.run(on_stdout=on_line, on_stderr=on_stderr,
+                                    timeout=self.timeout, idle_timeout=self.idle_timeout, **command)
+        if result.timed_out:
+            self.logger.error(f"copy: stopped by the watchdog ({'no output for too long' if result.timed_out == 'idle' else 'ran too long'}), "
+                              f"return code {result.returncode}.")
+        return result
+
+    def run_batch(self, files, dst, progress_callback=None, link_dest=None):
+        """
+        Copies several single-file sources into dst and blocks until all are finished. rsync copies all of them
+        with one process, robocopy with one process per source directory, so the startup (and the handshake with
+        a remote destination) is paid once instead of once per file.
+        Statistics per file are stored in `self.stats[src]` (the reused bytes of the batch are split by file size).
+        If the tool reports that only some files failed (rsync 23/24, robocopy 8-15), those named in its error
+        messages get the return code and the others a success code; otherwise all files of the process share it.
+
+        Args:
+            files (list[str]): Source files.
+            dst (str): Destination directory.
+            progress_callback (callable, optional): Called with the source file and its progress event (dict with the key 'percent').
+            link_dest (str, optional): Previous snapshot to hard-link unchanged files from.
+
+        Returns:
+            dict: Source file as key and the return code of its copy process as value.
+        """
+        return_codes = {}
+        for group in self._group_batch(files):
+            by_name = {os.path.normpath(src) if self.os_type == "windows" else os.path.basename(os.path.normpath(src)): src for src in group}
+            by_path = {os.path.abspath(src): src for src in group}
+            transferred = set()
+            failed = set()
+            current = None
+            last_percent = -1
+            start = time.monotonic()
+            stats = {"bytes": 0, "reused": 0, "files": 0}
+
+            def on_line(line):
+                nonlocal current, last_percent
+                match = re.search(r"^file: (.*)$", line) if self.os_type == "linux" else re.search(r"\t([A-Za-z]:\\.*)$", line.rstrip())
+                if match and match.group(1) in by_name:
+                    current = by_name[match.group(1)]
+                    transferred.add(current)
+                    return
+                # robocopy: '... ERROR 32 (0x00000020) Copying File C:\dir\file'
+                match = re.search(r"ERROR \d+ \(0x[0-9A-Fa-f]+\) .*?([A-Za-z]:\\.*)$", line.rstrip())
+                if match and os.path.normpath(match.group(1)) in by_name:
+                    failed.add(by_name[os.path.normpath(match.group(1))])
+                    return
+                self.parse_stats(line, stats)
+                if '%' in line and progress_callback:
+                    percent = self._parse_progress_rsync(line) # robocopy shows the percent of the current file
+                    if percent is not None and last_percent != percent:
+                        last_percent = percent
+                        for src in (group if self.os_type == "linux" else [current] if current else []):
+                            progress_callback(src, {"percent": percent})
+
+            def on_error(line):
+                # rsync: 'file has vanished: "/dir/file"', 'send_files failed to open "/dir/file": Permission denied (13)'
+                for name in re.findall(r'"([^"]+)"', line):
+                    src = by_path.get("/" + name.lstrip("/"))
+                    if src:
+                        failed.add(src)
+
+            returncode = self.copy_batch(group, dst, link_dest, on_line, on_error).returncode
+            partial = returncode in (23, 24) if self.os_type == "linux" else 8 <= returncode < 16
+            seconds = time.monotonic() - start
+            sizes = {src: os.path.getsize(src) if os.path.isfile(src) else 0 for src in transferred}
+            total = sum(sizes.values())
+            for src in group:
+                size = sizes.get(src, 0)
+                self.stats[os.path.normpath(src)] = {"bytes": size, "reused": round(stats["reused"] * size / total) if total else 0,
+                                                     "files": int(src in transferred), "seconds": seconds}
+                if partial and failed and src not in failed:
+                    return_codes[src] = 0 if self.os_type == "linux" else returncode & 7 # copied/extra/mismatch bits
+                else:
+                    return_codes[src] = returncode
+        return return_codes
+
+    def _group_batch(self, files):
+        """
+        Splits the files of a batch into the groups copied by one process: rsync takes all files at once,
+        robocopy only names in one source directory (and its command line is limited).
+        Files with the same name (from different directories) go into different rsync groups, so their progress
+        and errors aren't mixed up; they are all copied to the same name in dst, so the last one wins.
+
+        Args:
+            files (list[str]): Source files.
+
+        Returns:
+            list[list[str]]: The groups.
+        """
+        names = {}
+        for src in files:
+            names.setdefault(os.path.basename(os.path.normpath(src)), []).append(src)
+        for name, same in names.items():
+            if len(same) > 1:
+                self.logger.warning(f"copy_batch(): {len(same)} sources are named '{name}', they overwrite each other in the backup: {same}")
+        if self.os_type == "linux":
+            groups = []
+            for src in files:
+                name = os.path.basename(os.path.normpath(src))
+                group = next((group for group in groups if name not in group), None)
+                if group is None:
+                    group = {}
+                    groups.append(group)
+                group[name] = src
+            return [list(group.values()) for group in groups]
+        groups = []
+        by_dir = {}
+        for src in files:
+            by_dir.setdefault(os.path.dirname(os.path.normpath(src)), []).append(src)
+        for parent, group in by_dir.items():
+            chunk, length = [], len(parent)
+            for src in group:
+                if chunk and length + len(os.path.basename(src)) + 3 > self.BATCH_COMMAND_LENGTH:
+                    groups.append(chunk)
+                    chunk, length = [], len(parent)
+                chunk.append(src)
+                length += len(os.path.basename(src)) + 3
+            groups.append(chunk)
+        return groups
+
+    def run_copy(self, src, dst, progress_callback=None, link_dest=None, total_files=None, dirty=None, checkpoint=None, filters=None, total_bytes=None):
+        """
+        Copies src to dst and blocks until the copy is finished, parsing the progress of the copy tool.
+        A source without changes (change journal) whose copy already exists in dst is skipped,
+        rsync/robocopy can't be restricted to the changed subtrees.
+        A copy interrupted earlier needs no checkpoints: rsync/robocopy skip the already copied files by their quick check.
+        Statistics of the copy (bytes, reused, files, seconds) are parsed from the summary of the tool and stored in `self.stats[src]`.
 
         Args:
             src (str): Source path.
             dst (str): Destination path.
+            progress_callback (callable, optional): Called with a progress event (dict with the key 'percent').
+            link_dest (str, optional): Previous snapshot to hard-link unchanged files from.
+            total_files (int, optional): Number of files in src (e.g. from the metadata index), only needed for robocopy.
+            dirty (DirtySet, optional): Directories changed since the backup in dst, None if unknown.
+            checkpoint (SourceCheckpoint, optional): Unused, only the native engine skips finished subtrees.
+            filters (PathFilter, optional): Include/exclude rules of the source (rsync `--exclude-from`, robocopy `/XD` `/XF`).
+            total_bytes (int, optional): Size of src (from the scan), robocopy's progress is then weighted by the file sizes
+                instead of counting files.
 
         Returns:
-            subprocess.Popen: The running rsync process.
+            int: The return code of the copy process.
         """
-        if os.path.isdir(src):
-            pass
-        cmd = ["rsync", "--mkpath", "-az", "--info=progress2", "--no-perms", "--delete", "--inplace", "--copy-unsafe-links", src, dst]
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, preexec_fn=os.setsid)
-        return process
+        if dirty is not None and dirty.is_clean("") and os.path.isdir(os.path.join(dst, os.path.basename(os.path.normpath(src)))):
+            self.logger.info(f"'{src}' is unchanged since the last backup (change journal), skipping it.")
+            if progress_callback:
+                progress_callback({"percent": 100})
+            return 0
+        if total_files is None and self.os_type == "windows":
+            total_files = sum(len(files) for _, _, files in os.walk(src))
+        copied_files = 0
+        last_percent = -1
+        start = time.monotonic()
+        stats = {"bytes": 0, "reused": 0, "files": 0, "seconds": 0.0}
+        done_bytes = current_size = 0
+
+        def on_line(line):
+            nonlocal copied_files, last_percent, done_bytes, current_size
+            if re.search(r'\t[A-Z]:\\.*', line):  # robocopy: begins to copy new file
+                copied_files += 1
+            self.parse_stats(line, stats)
+            if self.os_type == "windows" and total_bytes:
+                size = self._parse_file_robocopy(line)
+                if size is not None:
+                    done_bytes += current_size
+                    current_size = size
+                    return
+            if '%' in line:
+                if self.os_type == "windows" and total_bytes:
+                    file_percent = self._parse_progress_rsync(line)
+                    percent = None if file_percent is None else min(100, 100 * (done_bytes + current_size * file_percent / 100) / total_bytes)
+                else:
+                    percent = self.parse_progress(line, copied_files, total_files)
+                if percent is not None and last_percent != percent:
+                    last_percent = percent
+                    if progress_callback:
+                        progress_callback({"percent": percent})
+
+        returncode = self.copy(src, dst, link_dest, filters, on_line).returncode
+        stats["seconds"] = time.monotonic() - start
+        self.stats[os.path.normpath(src)] = stats
+        return returncode
+
+    def _copy_linux(self, src, dst, link_dest=None, filters=None):
+        """
+        Builds a copy using rsync on Linux.
+        Filter rules are passed through stdin (`--exclude-from=-`), excluded files already in dst are deleted.
+
+        Args:
+            src (str): Source path.
+            dst (str): Destination path.
+            link_dest (str, optional): Previous snapshot for `--link-dest`.
+            filters (PathFilter, optional): Include/exclude rules of the source.
+
+        Returns:
+            dict: The rsync command ('cmd') and its input ('input') for `ProcessManager.run`.
+        """
+        cmd = ["rsync", "--mkpath", "-a", "--info=progress2", "--stats", "--no-perms", "--delete", "--copy-unsafe-links"]
+        cmd += self.resources.get_rsync_args(dst)
+        if link_dest:
+            # no --inplace: it would write into files hard-linked with older snapshots
+            cmd.append(f"--link-dest={link_dest}")
+        else:
+            cmd.append("--inplace")
+        if filters:
+            cmd += ["--exclude-from=-", "--delete-excluded"]
+        cmd += [src, dst]
+        cmd = self.resources.wrap_command(cmd)
+        return {"cmd": cmd, "input": "\n".join(filters.to_rsync(src)) + "\n" if filters else None}
+
+    def _copy_batch_linux(self, files, dst, link_dest=None):
+        """
+        Builds the copy of several files into dst with one rsync: the list is passed through stdin (`--files-from=-`),
+        `--no-relative` puts every file directly into dst, the names of the transferred files are printed as 'file: <name>'.
+
+        Args:
+            files (list[str]): Source files.
+            dst (str): Destination directory.
+            link_dest (str, optional): Previous snapshot for `--link-dest`.
+
+        Returns:
+            dict: The rsync command ('cmd') and its input ('input') for `ProcessManager.run`.
+        """
+        cmd = ["rsync", "--mkpath", "-a", "--info=progress2", "--stats", "--no-perms", "--copy-unsafe-links",
+               "--files-from=-", "--from0", "--no-relative", "--out-format=file: %n"]
+        cmd += self.resources.get_rsync_args(dst)
+        if link_dest:
+            cmd.append(f"--link-dest={link_dest}")
+        else:
+            cmd.append("--inplace")
+        cmd += ["/", dst] # the paths in the list are relative to '/' (rsync strips their leading slash)
+        cmd = self.resources.wrap_command(cmd)
+        return {"cmd": cmd, "input": "".join(f"{os.path.abspath(src)}\0" for src in files)}
+
+    def _copy_batch_windows(self, files, dst):
+        """
+        Builds the copy of several files of one directory into dst with one robocopy (file names after source and destination).
+        Without `/MIR` and `/E`, nothing else in dst is touched; `/FP` prints full paths to recognize the transferred files.
+
+        Args:
+            files (list[str]): Source files in the same directory.
+            dst (str): Destination directory.
+
+        Returns:
+            dict: The robocopy command ('cmd') and its options for `ProcessManager.run`.
+        """
+        parent = os.path.dirname(os.path.normpath(files[0]))
+        cmd = ["robocopy", parent, dst] + [os.path.basename(os.path.normpath(src)) for src in files]
+        cmd += ["/R:3", "/W:5", "/B", "/Z", f"/MT:{self.threads_to_use}", "/BYTES", "/FP", "/NDL"]
+        cmd += self.resources.get_robocopy_args()
+        creationflags = subprocess.CREATE_NEW_PROCESS_GROUP | self.resources.get_creationflags()
+        return {"cmd": cmd, "encoding": "utf-8", "creationflags": creationflags}
 
-    def _copy_windows(self, src, dst):
+    def _copy_windows(self, src, dst, filters=None):
         """
-        Performs a copy using robocopy on Windows.
+        Builds a copy using robocopy on Windows.
 
         Args:
             src (str): Source path.
             dst (str): Destination path.
+            filters (PathFilter, optional): Include/exclude rules of the source, as far as robocopy can express them.
 
         Returns:
-            subprocess.Popen: The running robocopy process.
+            dict: The robocopy command ('cmd') and its options for `ProcessManager.run`.
         """
         if os.path.isdir(src):
             dst = os.path.join(dst, os.path.basename(src))
-        cmd = ["robocopy", src, dst, "/R:3", "/W:5", "/B", "/E", "/Z", f"/MT:{self.threads_to_use}", "/MIR"]
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8', errors='replace', creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
-        return process
+        cmd = ["robocopy", src, dst, "/R:3", "/W:5", "/B", "/E", "/Z", f"/MT:{self.threads_to_use}", "/MIR", "/BYTES"]
+        cmd += self.resources.get_robocopy_args()
+        if filters and os.path.isdir(src):
+            cmd += filters.to_robocopy(src)
+        creationflags = subprocess.CREATE_NEW_PROCESS_GROUP | self.resources.get_creationflags()
+        return {"cmd": cmd, "encoding": "utf-8", "creationflags": creationflags}
 
     def parse_progress(self, line, copied_files, total_files):
         """
@@ -193,6 +513,28 @@ class ShellCommunicator:
                 percent = self._parse_progress_robocopy(line, copied_files, total_files)
         return percent
 
+    def parse_stats(self, line, stats):
+        """
+        Parses a line of the summary printed at the end of a copy (rsync `--stats`, robocopy with `/BYTES`).
+
+        Args:
+            line (str): Output line from the subprocess.
+            stats (dict): Statistics to update ('bytes', 'reused', 'files').
+        """
+        match self.os_type:
+            case "linux":
+                patterns = {"bytes": r"^Total transferred file size: ([\d,.']+)", "reused": r"^Matched data: ([\d,.']+)",
+                            "files": r"^Number of regular files transferred: ([\d,.']+)"}
+                for key, pattern in patterns.items():
+                    match = re.search(pattern, line.strip())
+                    if match:
+                        stats[key] = int(re.sub(r"\D", "", match.group(1))) # digit grouping depends on the locale
+            case "windows":
+                # summary table: Total, Copied, Skipped, Mismatch, FAILED, Extras
+                match = re.search(r"^\s*(Files|Bytes)\s*:\s*(\d+)\s+(\d+)", line)
+                if match:
+                    stats["files" if match.group(1) == "Files" else "bytes"] = int(match.group(3))
+
     def _parse_progress_rsync(self, line):
         """
         Parses rsync progress output.
@@ -208,6 +550,21 @@ class ShellCommunicator:
             percent = int(match.group(1))
             return percent
 
+    def _parse_file_robocopy(self, line):
+        """
+        Parses a file line of robocopy with `/BYTES` (e.g. '\t    New File  \t\t    1234\tname.txt').
+
+        Args:
+            line (str): Output line from robocopy.
+
+        Returns:
+            int or None: Size of the file robocopy starts to copy, None for other lines (directories end with '\\').
+        """
+        match = re.search(r'\t\s*(\d+)\t([^\t]+)$', line.rstrip("\r\n"))
+        if match and not match.group(2).endswith("\\"):
+            return int(match.group(1))
+        return None
+
     def _parse_progress_robocopy(self, line, copied_files, total_files):
         """
         Parses robocopy progress output.
@@ -232,15 +589,7 @@ class ShellCommunicator:
         """
         self.logger.debug("Stopping all processes...")
         try:
-            for proc in self.running_procs:
-                if proc:
-                    if proc.poll() is None: #does process live?
-                        if self.os_type == "linux":
-                            os.killpg(os.getpgid(proc.pid), signal.SIGINT)  # Unix-style Ctrl+C to process group
-                        elif self.os_type == "windows":
-                            proc.send_signal(signal.CTRL_BREAK_EVENT)  # Windows-style Ctrl+Break to process group
-                        proc.wait()  # Wait for the subprocess to finish
-                        self.logger.debug(f"Stopped process {proc.pid}")
+            self.processes.stop_all() # Ctrl+C (Linux) or Ctrl+Break (Windows) to the process groups, waits for them
         except Exception as e:
             self.logger.error(f"stop_all_processes(): {e}.")
             raise e
\ No newline at end of file
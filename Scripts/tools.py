@@ -1,5 +1,4 @@
 import os
-from screeninfo import get_monitors
 
 def get_subdirs(parent_dir):
     """
@@ -23,6 +22,34 @@ def get_subdirs(parent_dir):
     return all_subs
 
 
+def get_copyHandler(os_type, backend="shell", resources=None, timeout=None, idle_timeout=None):
+    """
+    Returns the copy backend used by the executor.
+
+    Args:
+        os_type (str): The operating system type ('linux' or 'windows').
+        backend (str): 'shell' for rsync/robocopy or 'native' for the pure Python copier.
+        resources (ResourceControl, optional): Priority, bandwidth limit and compression of the copies.
+        timeout (float, optional): Seconds an rsync/robocopy process may run (shell only).
+        idle_timeout (float, optional): Seconds an rsync/robocopy process may print nothing (shell only).
+
+    Returns:
+        ShellCommunicator or NativeCopier: The handler for copy and delete operations.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    match backend:
+        case "shell":
+            from shell_communicator import ShellCommunicator
+            return ShellCommunicator(os_type, resources, timeout=timeout, idle_timeout=idle_timeout)
+        case "native":
+            from native_copy import NativeCopier
+            return NativeCopier(os_type, resources)
+        case _:
+            raise ValueError(f"get_copyHandler(): Unknown copy backend '{backend}'.")
+
+
 def window_in_middle(fenster, breite, hoehe):
     """
     Places a tkinter window in the center of the primary monitor.
@@ -32,6 +59,8 @@ def window_in_middle(fenster, breite, hoehe):
         breite (int): Desired width of the window.
         hoehe (int): Desired height of the window.
     """
+    from screeninfo import get_monitors  # only needed by the GUI, keeps headless runs free of it
+
     monitors = get_monitors()
     monitor = monitors[0]
 
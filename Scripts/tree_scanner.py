@@ -0,0 +1,213 @@
+import os
+import stat
+import time
+import queue
+import logging
+import threading
+
+
+class ScanResult:
+    """
+    Result of a tree scan.
+
+    Attributes:
+        root (str): Scanned path.
+        total_files (int): Number of regular files.
+        total_bytes (int): Size of all regular files in bytes.
+        per_dir (dict): Directory as key and [files, bytes] as value. Directories deeper than the
+            breakdown depth of the scanner are added to their ancestor at that depth.
+        changes (dict): Files 'added', 'removed' and 'modified' since the last scan (only with an index).
+        errors (int): Number of entries that couldn't be read.
+        seconds (float): Duration of the scan.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.total_files = 0
+        self.total_bytes = 0
+        self.per_dir = {}
+        self.changes = {"added": [], "removed": [], "modified": []}
+        self.errors = 0
+        self.seconds = 0.0
+
+
+class TreeScanner:
+    """
+    Scans source trees in a single pass with `os.scandir` (the stat of a DirEntry is reused, no extra `getsize`).
+    Subdirectories are fanned out to a pool of worker threads through a queue, so only the directories still
+    to scan are held in memory. Results are cached for the session, used by the size display and the executor.
+
+    With a MetadataIndex, directories whose mtime didn't change are taken from the index instead of being listed,
+    except when the full scan of the source is due (`MetadataIndex.FULL_SCAN_DAYS`), which corrects files changed in place.
+    With a PathFilter, excluded files aren't counted and excluded directories aren't walked at all (the index
+    still stores the complete listing of the walked directories, so other rules can use it).
+    """
+
+    def __init__(self, index=None, threads=None, breakdown_depth=2):
+        """
+        Initializes the TreeScanner.
+
+        Args:
+            index (MetadataIndex, optional): Persistent index to skip unchanged directories.
+            threads (int, optional): Number of worker threads. Defaults to min(8, 2 * CPUs).
+            breakdown_depth (int): Depth below the root up to which `ScanResult.per_dir` has own entries.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.index = index
+        self.threads = threads or min(8, (os.cpu_count() or 1) * 2)
+        self.breakdown_depth = breakdown_depth
+        self.cache = {}
+        self.cache_lock = threading.Lock()
+
+    def scan(self, root, use_cache=True, full=False, filters=None):
+        """
+        Scans a file or directory.
+
+        Args:
+            root (str): Path to scan.
+            use_cache (bool): If True, returns the result of an earlier scan of this session.
+            full (bool): If True, lists every directory even if the index has it unchanged.
+            filters (PathFilter, optional): Include/exclude rules relative to root.
+
+        Returns:
+            ScanResult: Counts, sizes and per-directory breakdown of the path.
+        """
+        root = os.path.normpath(root)
+        filters = filters or None # no rules: same as no filter
+        key = (root, filters.key if filters else None)
+        if use_cache:
+            with self.cache_lock:
+                if key in self.cache:
+                    return self.cache[key]
+        start = time.monotonic()
+        result = ScanResult(root)
+        if os.path.isdir(root):
+            if self.index and not full and self.index.needs_full_scan(root):
+                self.logger.info(f"scan(): full scan of '{root}' is due, listing every directory.")
+                full = True
+            self._scan_tree(root, result, full, filters)
+            if self.index and full:
+                self.index.set_full_scan(root)
+        elif os.path.isfile(root):
+            st = os.stat(root)
+            result.total_files, result.total_bytes = 1, st.st_size
+            result.per_dir[os.path.dirname(root)] = [1, st.st_size]
+            if self.index:
+                self._merge_changes(result, self.index.store_file(root, st))
+        elif self.index:
+            self._merge_changes(result, self.index.forget(root))
+        if self.index:
+            self.index.commit()
+        result.seconds = time.monotonic() - start
+        self.logger.debug(f"Scanned '{root}' in {result.seconds:.2f}s: {result.total_files} files, {result.total_bytes} bytes.")
+        with self.cache_lock:
+            self.cache[key] = result
+        return result
+
+    def invalidate(self, root=None):
+        """
+        Removes a cached result (or all of them).
+
+        Args:
+            root (str, optional): Path to remove from the cache. Clears the whole cache if None.
+        """
+        with self.cache_lock:
+            if root is None:
+                self.cache.clear()
+            else:
+                for key in [key for key in self.cache if key[0] == os.path.normpath(root)]:
+                    del self.cache[key]
+
+    def _scan_tree(self, root, result, full, filters=None):
+        """Scans a directory tree with the worker threads."""
+        dirs = queue.Queue()
+        lock = threading.Lock()
+        dirs.put((root, os.path.dirname(root), 0, root))
+
+        def worker():
+            while True:
+                item = dirs.get()
+                if item is None:
+                    dirs.task_done()
+                    return
+                try:
+                    path, parent, depth, bucket = item
+                    files, size, subdirs, changes = self._scan_dir(path, parent, full, root, filters)
+                    for sub in subdirs:
+                        dirs.put((sub, path, depth + 1, sub if depth + 1 <= self.breakdown_depth else bucket))
+                    with lock:
+                        result.total_files += files
+                        result.total_bytes += size
+                        counts = result.per_dir.setdefault(bucket, [0, 0])
+                        counts[0] += files
+                        counts[1] += size
+                        if changes:
+                            self._merge_changes(result, changes)
+                except OSError as e:
+                    self.logger.info(f"scan(): skipped '{item[0]}' ({e})")
+                    with lock:
+                        result.errors += 1
+                except Exception as e: # e.g. the index failed, the worker must go on or join() waits forever
+                    self.logger.error(f"scan(): failed on '{item[0]}' ({e})")
+                    with lock:
+                        result.errors += 1
+                finally:
+                    dirs.task_done()
+
+        workers = [threading.Thread(target=worker, daemon=True) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        dirs.join()
+        for _ in workers:
+            dirs.put(None)
+        for thread in workers:
+            thread.join()
+
+    def _scan_dir(self, path, parent, full, root=None, filters=None):
+        """
+        Scans the direct content of one directory.
+
+        Returns:
+            tuple: (number of files, bytes, list of subdirectories not excluded, changes or None)
+        """
+        if self.index and not full:
+            mtime_ns = os.stat(path).st_mtime_ns
+            cached = self.index.get_dir(path, mtime_ns)
+            if cached is not None:
+                files, subdirs = cached
+                if filters:
+                    files, subdirs = self._filter(files, subdirs, root, filters)
+                return len(files), sum(size for _, size in files), subdirs, None
+        mtime_ns = os.stat(path).st_mtime_ns if self.index else None
+        files = []
+        subdirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                except OSError as e:
+                    self.logger.info(f"scan(): skipped '{entry.path}' ({e})")
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    files.append((entry.path, st.st_size, st.st_mtime_ns, st.st_ino))
+        changes = None
+        if self.index:
+            changes = self.index.store_dir(path, parent, mtime_ns, files, subdirs)
+        if filters:
+            files, subdirs = self._filter(files, subdirs, root, filters)
+        return len(files), sum(f[1] for f in files), subdirs, changes
+
+    def _filter(self, files, subdirs, root, filters):
+        """Removes the excluded files (tuples starting with the path) and subdirectories of one directory."""
+        def rel(path):
+            return os.path.relpath(path, root).replace(os.sep, "/")
+        return ([f for f in files if not filters.is_excluded(rel(f[0]))],
+                [sub for sub in subdirs if not filters.is_excluded(rel(sub), is_dir=True)])
+
+    def _merge_changes(self, result, changes):
+        """Adds the changes of one directory to the result."""
+        for key, paths in changes.items():
+            result.changes[key].extend(paths)
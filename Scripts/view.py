@@ -4,11 +4,12 @@ import os as os
 import tkinter as tk
 from tkinter import ttk, filedialog
 from tkinter import messagebox
-from tools import window_in_middle, change_text
+from tools import window_in_middle, change_text, get_copyHandler
 import atexit
 
 from executor import Executor
-from shell_communicator import ShellCommunicator
+from progress_bus import ProgressBus, MessageEvent, EtaEvent, FinishedEvent
+from progress_model import format_eta
 from file_handler import FileHandler
 from device_communicator import DeviceCommunicator
 
@@ -19,6 +20,7 @@ class View:
     Main class to handle the GUI for the PC Utils application. It includes setup for tasks, folder management,
     and user settings. It also provides interaction with system-level operations such as backups and virus scans.
     """
+    FRAME_MS = 50 # the log is redrawn at most 20 times per second
     def __init__(self, testing=False, fast=False): 
         """
         Initializes the View class by setting up logging, user settings, and creating the graphical user interface (GUI).
@@ -60,6 +62,9 @@ class View:
         window_in_middle(self.root,1500,800)
         self.create_guiElements()
         self.filehandler.set_callback(self.update_log)
+        self.bus = ProgressBus()
+        self.subscription = self.bus.subscribe()
+        self.root.after(self.FRAME_MS, self.drain_events)
         atexit.register(self.cleanup)
         self.destDirs_combobox.bind("<<ComboboxSelected>>", self.edit_destDir)
         
@@ -117,6 +122,9 @@ class View:
         self.check_fileBackup = ttk.Checkbutton(self.mainframe_choosing_task, text="File Backup",style="Custom.TCheckbutton")
         self.check_fileBackup.state(['!alternate', 'selected'])
         self.check_fileBackup.place(x=10, y=500)
+        self.check_verify = ttk.Checkbutton(self.mainframe_choosing_task, text="Verify (check the backup)", style="Custom.TCheckbutton")
+        self.check_verify.state(['!alternate'])
+        self.check_verify.place(x=10, y=575)
         
         self.confirm_button = tk.Button(self.mainframe_choosing_task, text ="Execute tasks",bg="green", command=self.go)
         self.confirm_button.place(x=10,y=650)
@@ -158,6 +166,8 @@ class View:
         
         self.info_label = ttk.Label(self.root, text="", style="Custom.TLabel")
         self.info_label.place(x=850,y=550)
+        self.eta_label = ttk.Label(self.root, text="", style="Custom.TLabel")
+        self.eta_label.place(x=1100,y=710)
             
     def go(self):
         """
@@ -170,24 +180,18 @@ class View:
         
         try:
             self.filehandler.write_yaml()
+            checkboxes = {"clean": self.check_clean,
+                          "smartphone_backup": self.check_smartphoneBackup,
+                          "virus_scan": self.check_virusScan,
+                          "health_scan": self.check_healthScan,
+                          "file_backup": self.check_fileBackup,
+                          "verify": self.check_verify
+                          }
+            tasks = [task for task, check in checkboxes.items() if check.instate(['selected'])]
+            metrics = self.filehandler.get_runMetrics()
+            with metrics.phase("prepare"):
+                task_infos = self.filehandler.get_taskInfos(tasks)
             self.info_dict, self.backupPaths_list, self.destPaths_list = self.filehandler.get_userContent()
-            backupDst = self.filehandler.create_backupPath() #not optimal here, but method has to be called before filehandler.check_old_backups()
-            task_infos = {}
-            if self.check_clean.instate(['selected']):
-                task_infos["clean"] = {"cleanPaths": [],
-                                       "oldBackups": self.filehandler.check_old_backups("backup")
-                                       }   
-            if self.check_smartphoneBackup.instate(['selected']):
-                task_infos["smartphone_backup"] = {"None": "None"}
-            if self.check_virusScan.instate(['selected']):
-                task_infos["virus_scan"] = {"None": "None"}
-            if self.check_healthScan.instate(['selected']):
-                task_infos["health_scan"] = {"None": "None"}
-            if self.check_fileBackup.instate(['selected']):
-                task_infos["file_backup"] = {
-                    "dstPath": backupDst,
-                    "backupPaths": self.backupPaths_list
-                }
         except Exception as e:
             self.logger.error(f"go: {e}")
             change_text(self.log_text, "Error at preparing. See 'Task-Log.log' for more information. Exit program in 3s...", "error")
@@ -198,9 +202,11 @@ class View:
 
         #start executor to execute tasks
         self.taskRunning = True
-        self.subprocesshandler = ShellCommunicator(self.osType)
-        self.executor = Executor(self.subprocesshandler, self.update_log, self.update_rdy)
+        self.subprocesshandler = get_copyHandler(self.osType, self.filehandler.get_settings()["copy_backend"],
+                                                 self.filehandler.get_resourceControl(self.osType), **self.filehandler.get_copyTimeouts())
+        self.executor = Executor(self.subprocesshandler, self.bus)
         self.executor.set_details(task_infos)
+        self.executor.set_metrics(metrics)
         self.executor.start()
 
     def edit_destDir(self, event=None, mode=None):
@@ -300,7 +306,10 @@ class View:
         4. fill in specific paths for backup/clean/destDir
         5. update infoString
         """
-        if self.filehandler.backup_alreadyExists():
+        if self.filehandler.backup_isResumable():
+            self.update_log("Backup from today was interrupted, it is resumed by the next file backup.", "warning")
+            self.logger.warning("Backup from today was interrupted. Resuming it.")
+        elif self.filehandler.backup_alreadyExists():
             self.update_log(f"Backup from today already exists.", "warning")
             self.update_log("=> For a backup the destination will be mirrored 1:1 with the source (including deletion of missing files).", "warning")
             self.logger.warning(f"Backup from today already exists. Mirroring active!!!")
@@ -329,13 +338,26 @@ class View:
             
     def update_log(self, text, tag=None, clear=False, update=False):
         """
-        callback function for executor to be able to update gui log
-        Updates the confirmation button state to either 'normal' or 'disabled' based on the execution process.
+        Updates the gui log (only call from the tkinter main thread, the executor publishes to the bus instead).
         """
         change_text(self.log_text, text, tag=tag, clear=clear, update=update)
     
+    def drain_events(self):
+        """
+        Shows the events the executor published since the last frame (runs in the tkinter main loop).
+        Superseded progress events are coalesced, so a fast copy doesn't redraw the log for every percent.
+        """
+        for event in self.subscription.drain():
+            if isinstance(event, MessageEvent):
+                self.update_log(event.text, tag=event.tag, clear=event.clear, update=event.update)
+            elif isinstance(event, EtaEvent):
+                self.eta_label.config(text=format_eta(event))
+            elif isinstance(event, FinishedEvent):
+                self.update_rdy()
+        self.root.after(self.FRAME_MS, self.drain_events)
+
     def update_rdy(self):
-        """callback function for executor to be able to communicate that it is rdy
+        """called when the executor published that it is rdy
         """
         self.taskRunning = False
         self.confirm_button.config(state="normal")
@@ -356,7 +378,7 @@ class View:
     def stop_tasks(self):
         """Stops all tasks.
         """
-        if hasattr(self, 'ex'):
+        if hasattr(self, 'executor'):
             self.executor.stop_tasks()
         
     def start(self):